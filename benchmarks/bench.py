@@ -0,0 +1,195 @@
+"""Benchmarks the local sync pipeline on synthetic blogs.
+
+Every command runs in a fresh process on a fresh blog, and reports
+wall time, peak memory (max rss) and the number of files opened for
+reading and for writing. Pass --jobs to let dump and diff use more
+than one process; file counts only cover the main process.
+
+pull and push talk to a dumblr.fakeapi server holding the blog's
+snapshot, answering every request after --latency seconds.
+
+    python benchmarks/bench.py --sizes 1000,10000 --save baseline.json
+    python benchmarks/bench.py --sizes 1000,10000 --check baseline.json
+
+--check exits with 1 if any command got slower, bigger or touched
+more files than the baseline allows.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+## -warm commands run after a dump has filled the index,
+## build-edit rebuilds the site after editing one post
+COMMANDS = ['dump', 'dump-warm', 'status', 'status-warm', 'diff',
+            'diff-warm', 'load', 'parse_frontmatter', 'slugify',
+            'pull', 'push', 'build', 'build-edit']
+
+## allowed growth over the baseline before it counts as a regression
+TOLERANCE = {'wall' : 1.5, 'maxrss' : 1.25, 'reads' : 1.0, 'writes' : 1.0}
+## and in absolute terms, so tiny measurements are not all noise
+SLACK = {'wall' : 0.05, 'maxrss' : 4096, 'reads' : 0, 'writes' : 0}
+
+def child(command, root, jobs, latency):
+    """Runs one command in this process and prints its measurements
+    """
+    import __builtin__
+    import io
+
+    counts = {'reads' : 0, 'writes' : 0}
+    def counting(open_):
+        def wrapped(name, mode='r', *args, **kwargs):
+            key = 'reads' if mode.startswith('r') and '+' not in mode else 'writes'
+            counts[key] += 1
+            return open_(name, mode, *args, **kwargs)
+        return wrapped
+    ## before dumblr binds open
+    __builtin__.open = counting(__builtin__.open)
+    io.open = counting(io.open)
+
+    sys.path.insert(0, os.path.join(HERE, ".."))
+    from dumblr.core import Dumblr
+    os.chdir(root)
+    d = Dumblr()
+    d.jobs = jobs
+
+    if command.endswith('-warm'):
+        command = command[:-len('-warm')]
+        d.dump()
+    if command == 'build-edit':
+        command = 'build'
+        d.build()
+        name = sorted(os.listdir(d.posts_path))[0]
+        with io.open(os.path.join(d.posts_path, name), 'a',
+                     encoding='utf-8') as f:
+            f.write(u"\nedited\n")
+    if command in ('parse_frontmatter', 'slugify'):
+        files = sorted(os.path.join(d.posts_path, f)
+                       for f in os.listdir(d.posts_path))
+    if command == 'slugify':
+        titles = [Dumblr.parse_frontmatter(f)['title'] for f in files]
+    if command in ('pull', 'push'):
+        from dumblr.fakeapi import FakeTumblr
+        from dumblr.tumblr import Tumblr
+        api = FakeTumblr(d.CONFIG['tumblr']['name'], d.load_snapshot(),
+                         latency=latency).start()
+        d._tumblr = Tumblr('ckey', 'skey', 'oauth', 'oauth_s',
+                           d.CONFIG['tumblr']['name'], host=api.host)
+
+    counts.update(reads=0, writes=0)
+    start = time.time()
+    if command == 'dump':
+        d.dump()
+    elif command == 'status':
+        d.status()
+    elif command == 'diff':
+        for _ in d.iter_diff():
+            pass
+    elif command == 'load':
+        d.load()
+    elif command == 'parse_frontmatter':
+        for f in files:
+            Dumblr.parse_frontmatter(f)
+    elif command == 'slugify':
+        for title in titles:
+            Dumblr.slugify(title)
+    elif command == 'pull':
+        d.pull()
+    elif command == 'push':
+        d.push()
+    elif command == 'build':
+        d.build()
+    wall = time.time() - start
+    if command in ('pull', 'push'):
+        d._tumblr.tumblr.request.session.close()
+        api.stop()
+
+    ## ru_maxrss is in kilobytes on linux
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print json.dumps(dict(counts, wall=wall, maxrss=maxrss))
+
+def run(sizes, commands, jobs, seed, latency):
+    sys.path.insert(0, HERE)
+    from synth import make_blog
+
+    results = {}
+    for size in sizes:
+        template = tempfile.mkdtemp(prefix="dumblr-bench-")
+        try:
+            blog = os.path.join(template, "blog")
+            make_blog(blog, size, seed)
+            for command in commands:
+                root = os.path.join(template, command)
+                shutil.copytree(blog, root, symlinks=True)
+                out = subprocess.check_output(
+                    [sys.executable, os.path.abspath(__file__),
+                     "--child", command, root, "--jobs", str(jobs),
+                     "--latency", str(latency)])
+                key = "{}/{}".format(command, size)
+                results[key] = json.loads(out.splitlines()[-1])
+                print "{:<24} {wall:>9.3f}s {maxrss:>9}KB {reads:>7} read " \
+                      "{writes:>7} written".format(key, **results[key])
+                shutil.rmtree(root)
+        finally:
+            shutil.rmtree(template)
+    return results
+
+def check(results, baseline):
+    """Returns a line per measurement past its tolerance
+    """
+    regressions = []
+    for key, result in sorted(results.iteritems()):
+        if key not in baseline:
+            continue
+        for metric, factor in TOLERANCE.iteritems():
+            allowed = max(baseline[key][metric] * factor,
+                          baseline[key][metric] + SLACK[metric])
+            if result[metric] > allowed:
+                regressions.append("{} {}: {} > {} (baseline {})".format(
+                    key, metric, result[metric], allowed,
+                    baseline[key][metric]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default="1000,10000",
+                        help="comma separated blog sizes")
+    parser.add_argument('--commands', default=",".join(COMMANDS))
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help="seconds per fake api request")
+    parser.add_argument('--save', metavar="FILE")
+    parser.add_argument('--check', metavar="FILE")
+    parser.add_argument('--child', nargs=2, metavar=("COMMAND", "ROOT"),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child[0], args.child[1], args.jobs, args.latency)
+        return
+
+    results = run([int(s) for s in args.sizes.split(",")],
+                  args.commands.split(","), args.jobs, args.seed,
+                  args.latency)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.check:
+        with open(args.check) as f:
+            regressions = check(results, json.load(f))
+        for line in regressions:
+            print "REGRESSION", line
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Benchmarks how fast dumblr commands start.
+
+Runs every command --repeat times in a fresh interpreter on a
+synthetic blog (see synth.py) and reports the fastest and median
+wall time, along with the slow to import packages it pulled in.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --max 80
+
+--max exits with 1 if an offline command takes longer than that
+many milliseconds at its fastest.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+## none of these talk to tumblr
+COMMANDS = [['--version'], ['status'], ['diff'], ['log'],
+            ['new', 'a startup post']]
+
+## packages offline commands should not need
+HEAVY = ['pytumblr', 'requests', 'requests_oauthlib', 'oauthlib',
+         'httplib2', 'yaml', 'unidecode', 'multiprocessing', 'SocketServer']
+
+## runs the cli, and writes what it imported to argv[1]
+RUNNER = """
+import atexit, json, sys
+sys.path.insert(0, {root!r})
+out = sys.argv.pop(1)
+heavy = {heavy!r}
+def imported():
+    with open(out, 'w') as f:
+        json.dump(sorted(set(m.split('.')[0] for m in sys.modules
+                             if m.split('.')[0] in heavy)), f)
+atexit.register(imported)
+from dumblr.cli import cli
+cli()
+"""
+
+def measure(command, root, repeat):
+    runner = RUNNER.format(root=os.path.join(HERE, ".."), heavy=HEAVY)
+    out = os.path.join(root, ".imported")
+    devnull = open(os.devnull, 'w')
+    walls = []
+    for _ in range(repeat):
+        start = time.time()
+        subprocess.check_call([sys.executable, "-c", runner, out] + command,
+                              cwd=root, stdout=devnull, stderr=devnull)
+        walls.append(time.time() - start)
+    walls.sort()
+    with open(out) as f:
+        imported = json.load(f)
+    return walls[0], walls[len(walls) // 2], imported
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--max', type=float, metavar="MS")
+    args = parser.parse_args()
+
+    sys.path.insert(0, HERE)
+    from synth import make_blog
+
+    ## python itself, for reference
+    start = time.time()
+    subprocess.check_call([sys.executable, "-c", "pass"])
+    print "{:<24} {:>7.1f}ms".format("python", (time.time() - start) * 1000)
+
+    template = tempfile.mkdtemp(prefix="dumblr-startup-")
+    slow = []
+    try:
+        root = os.path.join(template, "blog")
+        make_blog(root, args.size)
+        ## a real checkout has an index
+        measure(['status'], root, 1)
+        for command in COMMANDS:
+            fastest, median, imported = measure(command, root, args.repeat)
+            name = " ".join(command)
+            print "{:<24} {:>7.1f}ms {:>7.1f}ms  {}".format(
+                name, fastest * 1000, median * 1000, " ".join(imported))
+            if args.max and fastest * 1000 > args.max:
+                slow.append(name)
+    finally:
+        shutil.rmtree(template)
+
+    for name in slow:
+        print "SLOW", name
+    if slow:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Generates synthetic dumblr blogs for benchmarking.
+
+A blog is a dumblr root with a pulled snapshot (.dumblr/TUMBLR) and
+the posts loaded to posts/, where a share of the posts were then
+edited, created or deleted locally.
+
+    python benchmarks/synth.py /tmp/blog 10000
+"""
+import cPickle
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from dumblr.core import Dumblr
+
+WORDS = [u"the", u"of", u"tumblr", u"static", u"site", u"post", u"python",
+         u"yaml", u"markdown", u"draft", u"café", u"naïve", u"résumé",
+         u"日本語", u"ブログ", u"блог", u"☃", u"\U0001f600", u"über", u"ελληνικά"]
+
+TAGS = [u"python", u"notes", u"travel", u"日本", u"café", u"long read",
+        u"c++", u"yes", u"#hash", u"a, b"]
+
+## share of posts changed locally after the last load
+EDITED = 0.10
+CREATED = 0.02
+DELETED = 0.02
+
+def words(r, n):
+    return u" ".join(r.choice(WORDS) for _ in range(n))
+
+def body(r):
+    """Mostly short posts, with a long tail of long reads
+    """
+    size = int(min(math.exp(r.gauss(6.5, 1.2)), 200000))
+    paragraphs = []
+    length = 0
+    while length < size:
+        p = words(r, r.randint(10, 80))
+        paragraphs.append(p)
+        length += len(p)
+    return u"\n\n".join(paragraphs) + u"\n"
+
+def post(r, i):
+    title = words(r, r.randint(1, 8))
+    return {'title' : title,
+            'date' : u"20{:02d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d} GMT".format(
+                r.randint(10, 15), r.randint(1, 12), r.randint(1, 28),
+                r.randint(0, 23), r.randint(0, 59), r.randint(0, 59)),
+            'slug' : u"{}-{}".format(Dumblr.slugify(title), i),
+            'tags' : r.sample(TAGS, r.randint(0, 4)),
+            'format' : r.choice([u"markdown", u"markdown", u"html"]),
+            'state' : r.choice([u"published"] * 9 + [u"draft"]),
+            'id' : 100000000 + i,
+            'body' : body(r)}
+
+def make_blog(root, n, seed=0):
+    """Creates a blog of n posts at root and returns its Dumblr
+    """
+    r = random.Random(seed)
+    dumblr_path = os.path.join(root, ".dumblr")
+    os.makedirs(dumblr_path)
+    with open(os.path.join(dumblr_path, "DUMBLR"), 'wb') as f:
+        cPickle.dump({'config' : {'consumer_key' : 'ckey',
+                                  'secret_key' : 'skey',
+                                  'oauth_token' : 'oauth',
+                                  'oauth_token_secret' : 'oauth_s'},
+                      'tumblr' : {'name' : 'synthetic'}}, f)
+
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        d = Dumblr()
+        posts = [post(r, i) for i in range(n)]
+        d.save_snapshot(posts)
+        d.load()
+
+        for p in r.sample(posts, int(n * EDITED)):
+            with open(d.post_path(p), 'ab') as f:
+                f.write(u"\nedited {}\n".format(words(r, 20)).encode('utf-8'))
+        for p in r.sample(posts, int(n * DELETED)):
+            if os.path.isfile(d.post_path(p)):
+                os.remove(d.post_path(p))
+        for i in range(int(n * CREATED)):
+            d.write_post(dict(post(r, n + i), id=-1))
+
+        ## files of a real checkout are older than the last index,
+        ## fresh ones would always be re-read (see index.RACY_WINDOW)
+        old = time.time() - 3600
+        for f in os.listdir(d.posts_path):
+            os.utime(os.path.join(d.posts_path, f), (old, old))
+
+        ## start every benchmark cold
+        if os.path.isfile(d.INDEX_FILE):
+            os.remove(d.INDEX_FILE)
+    finally:
+        os.chdir(cwd)
+    return d
+
+if __name__ == "__main__":
+    make_blog(sys.argv[1], int(sys.argv[2]))
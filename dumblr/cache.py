@@ -0,0 +1,118 @@
+"""On disk cache of api reads, .dumblr/cache.
+
+Every GET answered successfully is kept for `ttl` seconds under
+cache/<blog>/<sha1 of the url and parameters>, so commands run back
+to back do not fetch the same pages again. Reads of a blog are
+dropped whenever we write to it. Once the cache grows past
+`max_bytes`, the least recently used responses are evicted.
+"""
+import cPickle
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from timings import count
+
+## seconds a response is good for
+CACHE_TTL = 60
+## bytes of responses kept at most
+CACHE_SIZE = 32 * 1024 * 1024
+
+_blog_re = re.compile(r'^/v2/blog/([^/]+)')
+
+class ResponseCache(object):
+    def __init__(self, path, ttl=CACHE_TTL, max_bytes=CACHE_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        ## bytes on disk, counted on first write
+        self._size = None
+
+    def _dir(self, url):
+        match = _blog_re.match(url)
+        return os.path.join(self.path, match.group(1) if match else "_user")
+
+    def _path(self, url, params):
+        key = json.dumps([url, sorted((params or {}).items())])
+        return os.path.join(self._dir(url), hashlib.sha1(key).hexdigest())
+
+    def get(self, url, params):
+        """The cached response, None if there is none or it is stale
+        """
+        path = self._path(url, params)
+        try:
+            with open(path, 'rb') as f:
+                stored, resp = cPickle.load(f)
+        except Exception:
+            count('cache.miss')
+            return None
+        if time.time() - stored > self.ttl:
+            count('cache.miss')
+            return None
+        ## the mtime tells when it was last used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        count('cache.hit')
+        return resp
+
+    def put(self, url, params, resp):
+        path = self._path(url, params)
+        data = cPickle.dumps((time.time(), resp), cPickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmp, path)
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def invalidate(self, url):
+        """Drops every response of the blog `url` is about
+        """
+        with self.lock:
+            shutil.rmtree(self._dir(url), ignore_errors=True)
+            self._size = None
+
+    def _entries(self):
+        """(mtime, size, path) of every response
+        """
+        entries = []
+        if not os.path.isdir(self.path):
+            return entries
+        for blog in os.listdir(self.path):
+            blog_path = os.path.join(self.path, blog)
+            for name in os.listdir(blog_path):
+                path = os.path.join(blog_path, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict(self):
+        ## down to three quarters, so we do not evict on every write
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= self.max_bytes * 3 // 4:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+            count('cache.evicted')
@@ -1,7 +1,9 @@
 import click
+import os
 from core import Dumblr
 from exceptions import DumblrException
-from utils import get_dumblr_root, assert_dumblr_root
+from timings import timings
+from utils import assert_dumblr_root
 
 pass_dumblr = click.make_pass_decorator(Dumblr, ensure=True)
 
@@ -11,12 +13,107 @@ def print_version(ctx, param, value):
     click.echo('1.0')
     ctx.exit()
 
+def print_api_stats(dumblr):
+    if not dumblr._tumblr:
+        return
+    stats = dumblr._tumblr.stats
+    click.secho("# API calls:\n#", bold=True, err=True)
+    for line in stats.report():
+        click.secho("#\t{}".format(line), err=True)
+    click.secho("#\n# Total : {requests} requests, {sent}B sent, "
+                "{received}B received, {latency:.3f}s".format(**stats.totals()),
+                bold=True, err=True)
+
+def call_daemon(dumblr, command, **args):
+    """Result of the command from a running `dumblr daemon`,
+    None if there is none
+    """
+    if not os.path.exists(dumblr.DAEMON_SOCKET):
+        return None
+    import daemon
+    return daemon.call(dumblr.DAEMON_SOCKET, command, **args)
+
+def print_timings(json_path):
+    timings.finish()
+    if json_path:
+        with open(json_path, 'w') as f:
+            f.write(timings.to_json())
+        return
+    click.secho("# Timings:\n#", bold=True, err=True)
+    for line in timings.report():
+        click.secho("#\t{}".format(line), err=True)
+
+def each_blog(dumblr, method, echo, *args):
+    """Runs a Dumblr method on every blog at once,
+    then echoes the result of each
+    """
+    for blog, result, error in dumblr.for_each_blog(method, *args):
+        if error:
+            click.secho("# {} : FATAL: {}\n#".format(blog, error), bold=True)
+            continue
+        echo(blog, result)
+
+def scope_options(f):
+    """Paths, globs, --id and --tag picking the posts of a command
+    """
+    f = click.option('--tag', 'tags', multiple=True,
+                     help="Only posts with this tag")(f)
+    f = click.option('--id', 'ids', type=int, multiple=True,
+                     help="Only the post with this id")(f)
+    return click.argument('paths', nargs=-1, type=click.Path())(f)
+
+def make_scope(dumblr, paths, ids, tags, all_blogs=False):
+    """The scope.Scope of a command, None for every post
+    """
+    if not (paths or ids or tags):
+        return None
+    if paths and all_blogs:
+        raise click.UsageError("Paths cannot be given with --all")
+    from scope import Scope
+    return Scope.from_paths(dumblr.posts_path, paths, ids, tags)
+
+def start_profile(path):
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    def stop():
+        profiler.disable()
+        profiler.dump_stats(path)
+        click.secho("# Profile written to {}".format(path), err=True)
+    return stop
+
 @click.group()
 @click.option('--version', is_flag=True, callback=print_version,
               expose_value=False, is_eager=True)
+@click.option('--api-stats', is_flag=True,
+              help="Print API usage per endpoint on exit")
+@click.option('--jobs', '-j', type=int,
+              help="Processes used to parse posts (default: one per core)")
+@click.option('--timings', 'show_timings', is_flag=True,
+              help="Print time, API calls and files per phase on exit")
+@click.option('--timings-json', type=click.Path(dir_okay=False),
+              help="Write the timings to a JSON file instead")
+@click.option('--profile', type=click.Path(dir_okay=False),
+              help="Write cProfile stats of the command to a file")
+@click.option('--blog', '-b', help="Blog to work on (default: your own)")
+@click.option('--no-cache', is_flag=True,
+              help="Ask Tumblr again instead of reusing recent answers")
 @pass_dumblr
-def cli(dumblr):
-    pass
+def cli(dumblr, api_stats, jobs, show_timings, timings_json, profile, blog,
+        no_cache):
+    ctx = click.get_current_context()
+    if blog:
+        dumblr = ctx.obj = Dumblr(blog)
+    dumblr.jobs = jobs
+    dumblr.cache = not no_cache
+    if api_stats:
+        ctx.call_on_close(lambda : print_api_stats(dumblr))
+    if show_timings or timings_json:
+        timings.enable()
+        timings.root.name = "dumblr {}".format(ctx.invoked_subcommand)
+        ctx.call_on_close(lambda : print_timings(timings_json))
+    if profile:
+        ctx.call_on_close(start_profile(profile))
 
 @cli.command()
 @pass_dumblr
@@ -38,32 +135,88 @@ def init(d):
     click.secho("Initialized dumblr at {}".format(root))
 
 @cli.command()
+@click.argument('key', required=False)
+@click.argument('value', required=False)
+@click.option('--unset', is_flag=True, help="Go back to the default")
 @pass_dumblr
 @assert_dumblr_root
-def pull(d):
+def config(dumblr, key, value, unset):
+    """Shows or changes settings"""
+    from core import SETTINGS
+    if key and key not in SETTINGS:
+        click.secho("FATAL: Unknown setting: {} (one of {})".format(
+            key, ", ".join(sorted(SETTINGS))))
+        return
+    if key and (value is not None or unset):
+        try:
+            dumblr.set_setting(key, None if unset else value)
+        except DumblrException as e:
+            click.secho("FATAL: {}".format(e))
+            return
+    for name in [key] if key else sorted(SETTINGS):
+        value = dumblr.setting(name)
+        click.secho("{} = {}".format(
+            name, "(default)" if value is None else value))
+
+@cli.command()
+@click.option('--incremental', is_flag=True,
+              help="Only pull posts newer than the last pull")
+@click.option('--all', 'all_blogs', is_flag=True,
+              help="Pull every blog at once")
+@click.option('--load', 'and_load', is_flag=True,
+              help="Load every post to the fs as it arrives")
+@pass_dumblr
+@assert_dumblr_root
+def pull(d, incremental, all_blogs, and_load):
     """Pulls posts from Tumblr"""
+    if all_blogs:
+        each_blog(d, 'pull_load' if and_load else 'pull',
+                  lambda blog, result : echo_pull_load(
+                      d.for_blog(blog).posts_path, *result), incremental)
+        return
     try:
-        posts, name = d.pull()
+        if and_load:
+            result = d.pull_load(incremental)
+        else:
+            result = d.pull(incremental)
     except DumblrException as e:
         click.secho("FATAL: {}".format(e))
         return
+    echo_pull_load(d.posts_path, *result)
 
+def echo_pull_load(posts_path, posts, name, loaded=None):
+    echo_pull(posts, name)
+    if loaded is not None:
+        echo_load(posts_path, loaded)
+
+def echo_pull(posts, name):
     click.secho("# From blog {}\n#".format(name), bold=True)
     for post in posts:
         click.secho("#\tRetrieved : {}.{}".format(post['slug'], post['format']))
     click.secho("#\n# Total : {}".format(len(posts)), bold=True)
 
 @cli.command()
+@click.option('--all', 'all_blogs', is_flag=True,
+              help="Load every blog at once")
 @pass_dumblr
 @assert_dumblr_root
-def load(dumblr):
+def load(dumblr, all_blogs):
     """Loads posts pulled from tumblr to fs"""
-    posts = dumblr.load()
+    if all_blogs:
+        each_blog(dumblr, 'load', lambda blog, result : echo_load(
+            dumblr.for_blog(blog).posts_path, result))
+        return
+    echo_load(dumblr.posts_path, dumblr.load())
 
-    click.secho("# Loading to {}\n#".format(dumblr.posts_path), bold=True)
-    for post in posts:
+def echo_load(posts_path, result):
+    click.secho("# Loading to {}\n#".format(posts_path), bold=True)
+    for post in result['written']:
         click.secho("#\t{}".format(post))
-    click.secho("#\n# Total : {}".format(len(posts)), bold=True)
+    for post in result['skipped']:
+        click.secho("#\tskipped (duplicate file name) : {}".format(post))
+    click.secho("#\n# Written : {}, unchanged : {}, skipped : {}".format(
+        len(result['written']), len(result['unchanged']),
+        len(result['skipped'])), bold=True)
 
 @cli.command()
 @click.argument('postname')
@@ -79,13 +232,79 @@ def new(dumblr, postname, format):
     click.secho("# Created new post {}".format(post))
 
 @cli.command()
+@click.option('--output', '-o', type=click.Path(file_okay=False),
+              help="Directory of the site (default: site/)")
+@click.option('--force', is_flag=True,
+              help="Render every page, changed or not")
+@pass_dumblr
+@assert_dumblr_root
+def build(dumblr, output, force):
+    """Renders posts to a static site"""
+    result = dumblr.build(output, force)
+
+    click.secho("# Building {}\n#".format(output or dumblr.site_path),
+                bold=True)
+    for page in result['rendered']:
+        click.secho("#\tRendered : {}".format(page))
+    for page in result['removed']:
+        click.secho("#\tRemoved : {}".format(page))
+    click.secho("#\n# Rendered : {}, unchanged : {}, removed : {}".format(
+        len(result['rendered']), result['unchanged'],
+        len(result['removed'])), bold=True)
+
+@cli.command('import')
+@click.argument('source', type=click.Path(exists=True))
+@pass_dumblr
+@assert_dumblr_root
+def import_(dumblr, source):
+    """Imports posts of a Jekyll or Hugo directory,
+    or of a Tumblr xml or json export
+    """
+    click.secho("# Importing {} to {}\n#".format(source, dumblr.posts_path),
+                bold=True)
+    totals = {'written' : 0, 'unchanged' : 0, 'skipped' : 0}
+    try:
+        for status, name, detail in dumblr.iter_import(source):
+            totals[status] += 1
+            if status == 'written':
+                click.secho("#\tImported : {}".format(name))
+            elif status == 'skipped':
+                click.secho("#\tskipped ({}) : {}".format(detail, name))
+    except DumblrException as e:
+        click.secho("FATAL: {}".format(e))
+        return
+    click.secho("#\n# Imported : {written}, unchanged : {unchanged}, "
+                "skipped : {skipped}".format(**totals), bold=True)
+
+@cli.command()
+@click.option('--all', 'all_blogs', is_flag=True,
+              help="Check every blog at once")
+@scope_options
 @pass_dumblr
 @assert_dumblr_root
-def status(dumblr):
+def status(dumblr, all_blogs, paths, ids, tags):
     """Checks status of posts in file system"""
-    posts = dumblr.status()
+    try:
+        scope = make_scope(dumblr, paths, ids, tags, all_blogs)
+    except DumblrException as e:
+        click.secho("FATAL: {}".format(e))
+        return
+    if all_blogs:
+        each_blog(dumblr, 'status', lambda blog, posts : echo_status(
+            dumblr.for_blog(blog).posts_path, posts), scope)
+        return
+    posts = call_daemon(dumblr, 'status', **scope_args(scope))
+    if posts is None:
+        posts = dumblr.status(scope)
+    echo_status(dumblr.posts_path, posts)
+
+def scope_args(scope):
+    """A scope as the daemon takes it
+    """
+    return {'scope' : scope.to_dict()} if scope else {}
 
-    click.secho("# Status on directory {}\n#".format(dumblr.posts_path),
+def echo_status(posts_path, posts):
+    click.secho("# Status on directory {}\n#".format(posts_path),
                 bold=True)
     if posts:
         for post in posts:
@@ -104,38 +323,234 @@ def status(dumblr):
     click.secho("#")
 
 @cli.command()
+@click.option('--unified', '-u', 'mode', flag_value='unified',
+              help="Unified diff of the post files")
+@click.option('--stat', 'mode', flag_value='stat',
+              help="Lines added and removed per post")
+@click.option('--name-only', 'mode', flag_value='name',
+              help="Names of changed posts only")
+@scope_options
 @pass_dumblr
 @assert_dumblr_root
-def diff(dumblr):
+def diff(dumblr, mode, paths, ids, tags):
     """Generates diff report for updated posts
     """
-    posts = dumblr.diff()
-    
-    click.secho("# Diff result:\n#", bold=True)
-    if posts:
-        for post, diffs in posts.iteritems():
+    mode = mode or 'attr'
+    try:
+        scope = make_scope(dumblr, paths, ids, tags)
+    except DumblrException as e:
+        click.secho("FATAL: {}".format(e))
+        return
+    if mode == 'attr':
+        click.secho("# Diff result:\n#", bold=True)
+
+    changed = added = removed = 0
+    results = call_daemon(dumblr, 'diff', mode=mode, **scope_args(scope))
+    if results is None:
+        results = dumblr.iter_diff(mode, scope)
+    for post, result in results:
+        changed += 1
+        if mode == 'attr':
             click.secho(post+"\n", bold=True)
-            for attr, diff in diffs.iteritems():
+            for attr, diff in result.iteritems():
                 click.secho("\t"+attr, bold=True)
                 click.secho("\t"+diff+"\n")
-    else:
-        click.secho("#\tNothing to do here")
-    click.secho("#")
+        elif mode == 'unified':
+            for line in result:
+                click.echo(line)
+        elif mode == 'stat':
+            added += result[0]
+            removed += result[1]
+            click.echo(" {} | {} {}{}".format(post, sum(result),
+                                              "+" * min(result[0], 40),
+                                              "-" * min(result[1], 40)))
+        else:
+            click.echo(post)
+
+    if mode == 'stat':
+        click.echo(" {} posts changed, {} insertions(+), {} deletions(-)".format(
+            changed, added, removed))
+    elif mode == 'attr':
+        if not changed:
+            click.secho("#\tNothing to do here")
+        click.secho("#")
 
 @cli.command()
+@click.option('--workers', '-w', type=int, default=4,
+              help="Number of posts pushed at once")
+@click.option('--retries', type=int, default=3,
+              help="Retries per post on transient errors")
+@click.option('--all', 'all_blogs', is_flag=True,
+              help="Push every blog at once")
+@scope_options
 @pass_dumblr
 @assert_dumblr_root
-def push(dumblr):
+def push(dumblr, workers, retries, all_blogs, paths, ids, tags):
     """Pushes changes to Tumblr"""
     try:
-        resps = dumblr.push()
+        scope = make_scope(dumblr, paths, ids, tags, all_blogs)
     except DumblrException as e:
         click.secho("FATAL: {}".format(e))
         return
+    if all_blogs:
+        each_blog(dumblr, 'push', echo_push, workers, retries, scope)
+        return
+    try:
+        resps = call_daemon(dumblr, 'push', workers=workers, retries=retries,
+                            **scope_args(scope))
+        if resps is None:
+            resps = dumblr.push(workers, retries, scope)
+    except DumblrException as e:
+        click.secho("FATAL: {}".format(e))
+        return
+    echo_push(dumblr.blog_name, resps)
 
-    click.secho("# Push result:\n#", bold=True)
+def echo_push(blog, resps):
+    click.secho("# Push result of blog {}:\n#".format(blog), bold=True)
     for resp in resps:
         click.secho("#\t{}\t: {}".format(resp['status'],
                                          resp['post']))
+    deferred = [resp for resp in resps if isinstance(resp['status'], dict)
+                and resp['status'].get('deferred')]
+    if deferred:
+        click.secho("#\n#\t{} posts deferred, run `dumblr push` "
+                    "again later".format(len(deferred)), bold=True)
     click.secho("#")
 
+
+def query_options(f):
+    """Filters of ls and search
+    """
+    f = click.option('--no-refresh', 'refresh', is_flag=True, default=True,
+                     flag_value=False,
+                     help="Do not look for changed files first")(f)
+    f = click.option('--until', help="Only posts dated up to this day")(f)
+    f = click.option('--since', help="Only posts dated from this day")(f)
+    f = click.option('--format', '-f', type=click.Choice(['markdown', 'html']),
+                     help="Only posts in this format")(f)
+    f = click.option('--state', help="Only posts in this state")(f)
+    return click.option('--tag', 'tags', multiple=True,
+                        help="Only posts with this tag")(f)
+
+@cli.command('ls')
+@query_options
+@pass_dumblr
+@assert_dumblr_root
+def ls(dumblr, tags, state, format, since, until, refresh):
+    """Lists posts in file system, newest first"""
+    echo_query(dumblr.posts_path, dumblr.search(
+        (), tags, state, format, since, until, refresh))
+
+@cli.command()
+@click.argument('query', nargs=-1, required=True)
+@query_options
+@pass_dumblr
+@assert_dumblr_root
+def search(dumblr, query, tags, state, format, since, until, refresh):
+    """Searches posts in file system
+
+    Every word of QUERY must be in the title or body of a post, and
+    words ending in * match the words they start. tag:, state:,
+    format:, since:, until: and date: words filter like the options.
+    """
+    words, tags = [], list(tags)
+    filters = {'state' : state, 'format' : format, 'since' : since,
+               'until' : until}
+    for word in query:
+        key, sep, value = word.partition(':')
+        if not (sep and value):
+            words.append(word)
+        elif key == 'tag':
+            tags.append(value)
+        elif key == 'date':
+            filters['since'] = filters['until'] = value
+        elif key in filters:
+            filters[key] = value
+        else:
+            words.append(word)
+    echo_query(dumblr.posts_path,
+               dumblr.search(words, tags, refresh=refresh, **filters))
+
+def echo_query(posts_path, posts):
+    click.secho("# Posts in {}\n#".format(posts_path), bold=True)
+    for post in posts:
+        click.secho(u"#\t{}\t{}\t{}\t{}".format(
+            post['date'][:10], post['state'], post['name'],
+            ", ".join(post['tags'])))
+    click.secho("#\n# Total : {}".format(len(posts)))
+
+@cli.command()
+@click.argument('post', required=False)
+@pass_dumblr
+@assert_dumblr_root
+def log(dumblr, post):
+    """Shows pulled revisions of a post"""
+    try:
+        revisions = dumblr.log(post)
+    except DumblrException as e:
+        click.secho("FATAL: {}".format(e))
+        return
+
+    if post is None:
+        click.secho("# Recorded revisions:\n#", bold=True)
+        for rev in revisions:
+            click.secho("#\t{number}\t{time}\t{source}".format(**rev))
+    else:
+        click.secho("# History of {}:\n#".format(post), bold=True)
+        for rev in revisions:
+            if rev['post']:
+                click.secho("#\t{}\t{}\t{}\t{}.{}\t{}".format(
+                    rev['manifest'], rev['time'], rev['source'],
+                    rev['post']['slug'], rev['post']['format'],
+                    rev['hash'][:10]))
+            else:
+                click.secho("#\t{}\t{}\t{}\tdeleted".format(
+                    rev['manifest'], rev['time'], rev['source']))
+    click.secho("#")
+
+@cli.command()
+@click.argument('revision', type=int)
+@click.argument('post', required=False)
+@pass_dumblr
+@assert_dumblr_root
+def rollback(dumblr, revision, post):
+    """Restores posts as of an earlier revision"""
+    try:
+        paths = dumblr.rollback(revision, post)
+    except DumblrException as e:
+        click.secho("FATAL: {}".format(e))
+        return
+
+    click.secho("# Restored revision {}\n#".format(revision), bold=True)
+    for path in paths:
+        click.secho("#\t{}".format(os.path.basename(path)))
+    click.secho("#\n# Run `dumblr status` to review, "
+                "`dumblr push` to apply", bold=True)
+
+@cli.command()
+@click.option('--auto-push', is_flag=True,
+              help="Push changes once posts stop changing")
+## daemon.DEBOUNCE, without importing the daemon
+@click.option('--debounce', type=float, default=2.0,
+              help="Seconds without changes before an auto push")
+@click.option('--stop', is_flag=True, help="Stop the running daemon")
+@pass_dumblr
+@assert_dumblr_root
+def daemon(dumblr, auto_push, debounce, stop):
+    """Serves status, diff and push from memory"""
+    import daemon as _daemon
+    try:
+        if stop:
+            if call_daemon(dumblr, 'stop') is None:
+                click.secho("# No daemon is running")
+            return
+
+        warm = _daemon.WarmDumblr(dumblr.blog_name)
+        warm.jobs = dumblr.jobs
+        server = _daemon.Daemon(warm, auto_push, debounce,
+                                log=lambda line : click.secho("#\t" + line))
+        click.secho("# Serving {} on {}".format(
+            warm.root_path, warm.DAEMON_SOCKET), bold=True)
+        server.serve()
+    except DumblrException as e:
+        click.secho("FATAL: {}".format(e))
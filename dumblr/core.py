@@ -1,21 +1,50 @@
 import click
 import cPickle
 import datetime
-import difflib
+import hashlib
 import json
+import frontmatter
 import os
-import yaml
 import re
 import shutil
-import tumblr
+import threading
 from codecs import open
+from collections import OrderedDict
+from itertools import chain, imap, islice
 from exceptions import DumblrException
-from textwrap import dedent, wrap
-from unidecode import unidecode
-from utils import get_dumblr_root
+from index import PostIndex
+from snapshot import Snapshot, body_hash, write as write_snapshot
+from snapshot import Writer as SnapshotWriter
+from store import History
+from timings import count, span, timed
+from utils import get_dumblr_root, BatchWriter
+
+## tumblr (and with it the network stack), diff, importer, static,
+## multiprocessing and unidecode are imported where they are used,
+## so commands that do not need them start fast
+
+## diffing fewer posts than this is not worth a process pool
+DIFF_PARALLEL_THRESHOLD = 32
+
+## requests per second of all blogs synced at once
+SHARED_RATE_LIMIT = 10
+
+## settings `dumblr config` takes, with their types
+SETTINGS = {'rate_limit' : float, 'cache_ttl' : float}
+
+## posts of an archive converted at a time, a whole batch
+## of them is also the least worth a process pool
+IMPORT_BATCH = 512
+
+## word separators of slugs
+_punct_re = re.compile(r'[\t !"#$%&\'()*\-/<=>?@\[\\\]^_`{|},.]+')
 
 class Dumblr(object):
-    def __init__(self):
+    def __init__(self, blog=None):
+        """`blog` is the blog to sync, the one named after
+        the user by default. Other blogs of the account keep their
+        posts in blogs/<name> and their state in .dumblr/blogs/<name>.
+        """
         self.initialized = True
         root_path = get_dumblr_root(os.getcwd())
 
@@ -24,14 +53,51 @@ class Dumblr(object):
             root_path = os.getcwd()
 
         self.root_path = root_path
-        self.posts_path = os.path.join(root_path, "posts")
         self.dumblr_path = os.path.join(root_path, ".dumblr")
         # config file contains meta info to run dumblr
         self.CONFIG_FILE = os.path.join(self.dumblr_path, "DUMBLR")
-        # tumblr file contains text posts in tumblr as observed at the time
-        self.TUMBLR_FILE = os.path.join(self.dumblr_path, "TUMBLR")
         self.CONFIG = self.load_data()
 
+        self.blog = blog
+        if blog is None or blog == self.CONFIG.get('tumblr', {}).get('name'):
+            self.posts_path = os.path.join(root_path, "posts")
+            self.site_path = os.path.join(root_path, "site")
+            self.state_path = self.dumblr_path
+        else:
+            self.posts_path = os.path.join(root_path, "blogs", blog)
+            self.site_path = os.path.join(root_path, "sites", blog)
+            self.state_path = os.path.join(self.dumblr_path, "blogs", blog)
+        # tumblr file contains text posts in tumblr as observed at the time
+        self.TUMBLR_FILE = os.path.join(self.state_path, "TUMBLR")
+        # cursor file marks how far the last pull got
+        self.CURSOR_FILE = os.path.join(self.state_path, "CURSOR")
+        # index file caches parsed posts of the fs
+        self.INDEX_FILE = os.path.join(self.state_path, "INDEX")
+        # build files remember what `dumblr build` rendered,
+        # and cache the headers of posts
+        self.BUILD_FILE = os.path.join(self.state_path, "BUILD")
+        self.BUILD_INDEX_FILE = os.path.join(self.state_path, "BUILD_INDEX")
+        # journal of a push, there while one runs or was cut short
+        self.JOURNAL_FILE = os.path.join(self.state_path, "PUSH")
+        # posts created lately, by every blog of the account
+        self.POSTED_FILE = os.path.join(self.dumblr_path, "POSTED")
+        # inverted index of the posts in the fs, see search.py
+        self.SEARCH_FILE = os.path.join(self.state_path, "SEARCH")
+        # api reads of every blog of the account, see cache.py
+        self.CACHE_PATH = os.path.join(self.dumblr_path, "cache")
+        # socket of a running `dumblr daemon`
+        self.DAEMON_SOCKET = os.path.join(self.state_path, "daemon.sock")
+        self._tumblr = None
+        # Dumblr whose client is shared, see for_blog
+        self._parent = None
+        self._tumblr_lock = threading.Lock()
+        # requests a second of the client, None for no limit
+        self.rate_limit = None
+        # number of processes for cpu bound work, None for one per core
+        self.jobs = None
+        # whether api reads are cached in self.CACHE_PATH
+        self.cache = True
+
     def initialize(self):
         """Completes the following tasks.
         
@@ -41,6 +107,7 @@ class Dumblr(object):
         - if directory already exists, we remove it
         4. Pickles configuration data into .dumblr/DUMBLR
         """
+        import tumblr
         d = {}
         d['config'] = tumblr.Tumblr.oauth()
 
@@ -49,8 +116,8 @@ class Dumblr(object):
                           d['config']['oauth_token'],
                           d['config']['oauth_token_secret'])
 
-        ## IMPORTANT: We only consider blog named after username
-        ## Later update `might` address this issue
+        ## the blog named after the user is the default one,
+        ## the others are synced with --blog or --all
         d['tumblr'] = t.info()
 
         if os.path.isdir(self.dumblr_path):
@@ -62,23 +129,105 @@ class Dumblr(object):
 
         return self.dumblr_path
 
-    def pull(self):
+    @timed('pull')
+    def pull(self, incremental=False):
         """Pulls all text posts from Tumblr.
 
         Retrieved text posts is stored in .dumblr/TUMBLR,
         later to be used to compare with commited data.
 
-        If load is set to true, post data will be converted and
-        dumped to the file system on self.posts_path.
+        If incremental is set to true, only published posts newer
+        than the cursor saved by the last pull are retrieved and
+        merged into .dumblr/TUMBLR. Edits to older published posts
+        and deletions are only picked up by a full pull.
+
+        Posts are written to the snapshot a page at a time as they
+        arrive, so memory stays flat however large the blog is.
+        Returns the pulled posts, without their bodies, and the blog.
         """
-        t_config = self.CONFIG['tumblr']
+        posts, name, _ = self._pull(incremental, False)
+        return posts, name
+
+    @timed('pull')
+    def pull_load(self, incremental=False):
+        """Pulls like pull() and loads the posts like load(),
+        writing the file of every post as soon as it arrives.
+        Files are only renamed in place once the whole pull is
+        saved, so a failed pull leaves posts/ as it was.
+
+        Returns the pulled posts, the blog and what load() returns.
+        """
+        return self._pull(incremental, True)
+
+    def _pull(self, incremental, load):
+        name = self.blog_name
         t = self._get_tumblr()
-        posts = t.get_text_posts(t_config['name'])
+        cursor = self.load_cursor() if incremental else {}
+        ## the posts an incremental pull does not fetch again
+        old = self.open_snapshot() if 'date' in cursor else None
+
+        if not os.path.isdir(self.state_path):
+            os.makedirs(self.state_path)
+        writer = SnapshotWriter(self.TUMBLR_FILE)
+        pulled = []
+        ## indices in writer, see merge_posts for the order
+        published, kept, drafts = [], [], []
+
+        def stream():
+            new_ids = set()
+            for post in t.iter_text_posts(name, since=cursor.get('date')):
+                new_ids.add(post['id'])
+                (published if post['state'] == 'published'
+                 else drafts).append(len(writer.headers))
+                writer.add(post)
+                pulled.append(writer.headers[-1])
+                if post['state'] == 'published':
+                    yield post
+            if old is not None:
+                for i, header in enumerate(old.headers):
+                    if header['id'] in new_ids or header['state'] == 'draft':
+                        continue
+                    kept.append(len(writer.headers))
+                    ## bodies are only read back to be loaded
+                    writer.copy(old, i)
+                    if load:
+                        yield old.post(i)
+            ## drafts are loaded last, as load() does, so they lose
+            ## to published posts mapping to the same file
+            if load:
+                for i in drafts:
+                    yield writer.post(i)
+
+        def save():
+            with span('save'):
+                writer.close(published + kept + drafts)
+
+        result = None
+        with span('fetch'):
+            try:
+                if load:
+                    ## files are only renamed in place once the
+                    ## snapshot holding their posts is saved
+                    result = self._load_posts(stream(), save)
+                else:
+                    for _ in stream():
+                        pass
+                    save()
+            except:
+                writer.abort()
+                raise
+        count('posts.pulled', len(pulled))
 
-        with open(self.TUMBLR_FILE, 'w') as f:
-            cPickle.dump(posts, f)
+        with span('save'):
+            if old is not None:
+                old.close()
+            snapshot = self.open_snapshot()
+            self.save_cursor(snapshot.headers, cursor)
+        with span('history'):
+            History(self.state_path).record(snapshot, 'pull')
+        snapshot.close()
 
-        return posts, t_config['name']
+        return pulled, name, result
 
     def new(self, postname, _format):
         if not os.path.isdir(self.posts_path):
@@ -95,13 +244,12 @@ class Dumblr(object):
               'format' : _format,
               'state' : "draft",
               'id': -1}
-        frontmatter = Dumblr.dump_frontmatter(fm)
-
         with open(fpath, 'w', encoding='utf-8') as f:
-            f.write(frontmatter)
+            f.write(Dumblr.dump_frontmatter(fm))
 
         return fpath
-        
+
+    @timed('load')
     def load(self):
         """Loads posts to the file system.
         
@@ -110,147 +258,716 @@ class Dumblr(object):
 
         The posts will live in the directory self.posts_path.
         If a file already exists with the target post file name,
-        it will be OVERWRITTEN!
+        it will be OVERWRITTEN! Files that already hold the post
+        are left alone, and files are replaced atomically.
+
+        Returns the file names that were written, the ones that
+        were unchanged, and the ones that were skipped because
+        an earlier post in the snapshot maps to the same file.
+        """
+        ## one body in memory at a time
+        return self._load_posts(self.open_snapshot())
+
+    def _load_posts(self, posts, commit=None):
+        """Writes the file of every post, see load(). If given,
+        `commit` is called once every post was read, and no file
+        is renamed in place before it returns. Nothing is left
+        behind of the files not renamed yet if anything fails.
         """
         if not os.path.isdir(self.posts_path):
             os.makedirs(self.posts_path)
-            
-        posts = {}
 
-        with open(self.TUMBLR_FILE) as f:
-            posts = cPickle.load(f)
+        index = PostIndex(self.INDEX_FILE)
+        writer = BatchWriter(hold=commit is not None)
+        result = {'written' : [], 'unchanged' : [], 'skipped' : []}
+        seen = set()
+
+        try:
+            for post in posts:
+                filepath = self.post_path(post)
+                filename = os.path.basename(filepath)
+                if filename in seen:
+                    result['skipped'].append(filename)
+                    continue
+                seen.add(filename)
+
+                data = Dumblr.render_post(post)
+                if Dumblr._same_content(filepath, data, index):
+                    result['unchanged'].append(filename)
+                else:
+                    writer.write(filepath, data)
+                    result['written'].append(filename)
 
-        for post in posts:
-            filename = "{}.{}".format(post['slug'], post['format'])
-            filepath = os.path.join(self.posts_path, filename)
-            frontmatter = Dumblr.dump_frontmatter(post)
+            if commit is not None:
+                commit()
+            with span('flush'):
+                writer.flush()
+        except:
+            writer.abort()
+            raise
+        self.reindex(result['written'])
+        return result
 
-            with open(filepath, 'w', encoding='utf-8') as f:
-                body = frontmatter + post['body']
-                f.write(body)
+    def write_post(self, post):
+        """Atomically writes a single post to self.posts_path
+        and returns its path
+        """
+        filepath = self.post_path(post)
+        writer = BatchWriter()
+        writer.write(filepath, Dumblr.render_post(post))
+        writer.flush()
+        return filepath
 
-        return ["{}.{}".format(post['slug'], post['format'])
-                for post in posts]
+    def post_path(self, post):
+        filename = "{}.{}".format(post['slug'], post['format'])
+        return os.path.join(self.posts_path, filename)
 
-    def dump(self):
+    @timed('dump')
+    def dump(self, scope=None):
         """Dumps posts from the file system
 
         Each valid text post in self.posts_path is
-        parsed to generate a list of posts.
+        parsed to generate a list of posts, sorted by file name.
+        Parsed posts are cached in .dumblr/INDEX, so only
+        files that changed since the last dump are parsed.
+        Large batches of changed files are parsed on
+        self.jobs processes.
+
+        Only the posts in `scope` (a scope.Scope) are dumped if
+        given, and only their files and the changed ones are read.
         """
-        posts_f = []
-        if os.path.exists(self.posts_path):
-            posts_f = [os.path.join(self.posts_path, f) 
-                       for f in os.listdir(self.posts_path) 
-                       if os.path.isfile(os.path.join(self.posts_path,f))]
-        
-        posts = map(Dumblr.parse_frontmatter, posts_f)
-        posts = [post for post in posts if post] # remove None
+        index = PostIndex(self.INDEX_FILE)
+        names = self.scoped_names(index, scope) if scope else None
+        posts = index.refresh(self.posts_path, frontmatter.loads, self.jobs,
+                              names)
+        if os.path.isdir(self.state_path):
+            index.save()
+
+        posts = [post for name, post in posts # remove None
+                 if post and (not scope or scope.match(post, name))]
         return posts
 
-    def status(self):
+    def scoped_names(self, index, scope):
+        """The files of self.posts_path that may hold posts
+        in scope, going by their names and the index
+        """
+        if not os.path.isdir(self.posts_path):
+            return []
+        names = [name for name in os.listdir(self.posts_path)
+                 if scope.match_name(name)]
+        if not (scope.ids or scope.tags):
+            return names
+        ## files that changed since they were indexed may be in scope now
+        scoped = []
+        for name in names:
+            entry = index.entries.get(name)
+            if entry is not None and entry['post'] is not None:
+                try:
+                    st = os.stat(os.path.join(self.posts_path, name))
+                except OSError:
+                    continue
+                if (index.fresh(name, st) and
+                    not scope.match(entry['post'], name)):
+                    continue
+            scoped.append(name)
+        return scoped
+
+    @timed('search')
+    def search(self, words=(), tags=(), state=None, format=None,
+               since=None, until=None, refresh=True):
+        """Posts in the fs with every word and tag, in `state` and
+        `format` and dated between `since` and `until` (date
+        prefixes, inclusive), newest first. Words ending in * match
+        the words they start. Without words it is a listing.
+
+        Answered from the inverted index in self.SEARCH_FILE (see
+        search), which is first brought up to date with the files
+        that changed, unless not `refresh`.
+        """
+        import search
+        if not os.path.isdir(self.state_path):
+            os.makedirs(self.state_path)
+        index = search.SearchIndex(self.SEARCH_FILE)
+        try:
+            if refresh:
+                with span('refresh'):
+                    index.refresh(self.posts_path, self.jobs)
+            terms, prefixes = search.query_terms(words)
+            terms += [u"tag:{}".format(tag.lower()) for tag in tags]
+            if state:
+                terms.append(u"state:{}".format(state))
+            if format:
+                terms.append(u"format:{}".format(format))
+            with span('query'):
+                return index.query(terms, prefixes, since, until)
+        finally:
+            index.close()
+
+    def reindex(self, names):
+        """Updates the search index, if there is one, with
+        the files in self.posts_path just written or removed
+        """
+        if not (names and os.path.isfile(self.SEARCH_FILE)):
+            return
+        import search
+        index = search.SearchIndex(self.SEARCH_FILE)
+        try:
+            index.refresh(self.posts_path, self.jobs, names)
+        finally:
+            index.close()
+
+    @timed('build')
+    def build(self, output=None, force=False):
+        """Renders the posts to a static site in `output`
+        (self.site_path by default), see static.
+
+        Only posts that changed since the last build, and the
+        pages listing them, are rendered again, unless `force`.
+        """
+        import static
+        ## headers are all pages listing posts need, and
+        ## much faster to load than whole posts
+        index = PostIndex(self.BUILD_INDEX_FILE)
+        with span('dump'):
+            entries = index.refresh(self.posts_path, static.parse_header,
+                                    self.jobs)
+        if os.path.isdir(self.state_path):
+            index.save()
+        if force and os.path.isfile(self.BUILD_FILE):
+            os.remove(self.BUILD_FILE)
+
+        site = static.Site(output or self.site_path, self.BUILD_FILE,
+                           self.blog_name)
+        return site.build([(os.path.join(self.posts_path, name),
+                            index.entries[name]['hash'], header)
+                           for name, header in entries if header], self.jobs)
+
+    @timed('status')
+    def status(self, scope=None):
         """Reports difference between posts in the fs
         and the posts saved in TUMBLR file
+
+        Only posts in `scope` (a scope.Scope) are reported if given.
         """
-        fs_posts = self.dump()
+        fs_posts = self.dump(scope)
         tb_posts = []
         
         try:
-            with open(self.TUMBLR_FILE) as f:
-                tb_posts = cPickle.load(f)
+            tb_posts = self.open_snapshot()
         except:
             ## user never pulled from tumblr
             pass
+
+        ## bodies on tumblr are compared by hash, and only
+        ## read for the posts that changed
+        headers = tb_posts.headers if tb_posts else []
+        hashes = tb_posts.hashes if tb_posts else []
+        tb_by_id = {}
+        for i, tb_p in enumerate(headers):
+            tb_by_id.setdefault(tb_p['id'], i)
+        fs_ids = set(fs_p['id'] for fs_p in fs_posts)
             
         posts = []
         for fs_p in fs_posts:
             ## find corresponding posts on TUMBLR
-            tb_p = next((p for p in tb_posts
-                         if p['id'] == fs_p['id']), None)
-            if tb_p:
-                diff = Dumblr.diff_post(tb_p, fs_p)
-                if diff:
+            i = tb_by_id.get(fs_p['id'])
+            if i is not None:
+                diff = Dumblr.diff_post(headers[i], fs_p)
+                if diff or hashes[i] != body_hash(fs_p.get('body')):
+                    tb_p = tb_posts.post(i)
                     posts.append({'action' : 'update',
                                   'post' : fs_p,
-                                  'diff' : diff})
+                                  'remote' : tb_p,
+                                  'diff' : Dumblr.diff_post(tb_p, fs_p)})
             else:
                 posts.append({'action' : 'create',
                               'post' : fs_p})
 
-        for tb_p in tb_posts:
-            ## find corresponding post in fs
-            fs_p = next((p for p in fs_posts
-                         if p['id'] == tb_p['id']), None)
-            if not fs_p:
-                posts.append({'action' : 'delete',
-                              'post' : tb_p})
+        ## find corresponding post in fs
+        deleted = [i for i, tb_p in enumerate(headers)
+                   if tb_p['id'] not in fs_ids and
+                   (not scope or scope.match(
+                       tb_p, os.path.basename(self.post_path(tb_p))))]
+        if scope and deleted:
+            ## the file of a post may have moved out of scope
+            fs_ids = set(fs_p['id'] for fs_p in self.dump())
+            deleted = [i for i in deleted if headers[i]['id'] not in fs_ids]
+        for i in deleted:
+            posts.append({'action' : 'delete',
+                          'post' : tb_posts.post(i)})
         return posts
 
-    def diff(self):
+    def diff(self, scope=None):
         """Reports specific difference for a given list
         of posts
 
         Returns a dictionary that maps postname 
         to its diff report
         """
-        posts = self.status()
-        updates = filter(lambda x : x['action'] == 'update', posts)
+        return dict(self.iter_diff(scope=scope))
+
+    def iter_diff(self, mode='attr', scope=None):
+        """Yields (postname, diff report) of every updated post
+        in `scope` as soon as it is computed, in one of diff.MODES.
+
+        Many posts are diffed on self.jobs processes.
+        """
+        import diff
+        from multiprocessing import Pool, cpu_count
+        updates = [change for change in self.status(scope)
+                   if change['action'] == 'update']
+        count('posts.diffed', len(updates))
+        jobs = [(os.path.basename(self.post_path(update['post'])),
+                 update['remote'], update['post'],
+                 sorted(update['diff']), mode)
+                for update in updates]
+
+        workers = self.jobs or cpu_count()
+        if len(jobs) > DIFF_PARALLEL_THRESHOLD and workers > 1:
+            pool = Pool(workers)
+            try:
+                for result in pool.imap(diff.diff_post, jobs):
+                    yield result
+            finally:
+                pool.terminate()
+        else:
+            for job in jobs:
+                yield diff.diff_post(job)
+
+    def iter_import(self, source):
+        """Imports the posts of an archive (see importer) as new
+        posts. Yields, as soon as each post is done,
+
+        - ('written', file name, source name) of imported posts,
+        - ('unchanged', file name, source name) of posts an earlier
+          import already wrote,
+        - ('skipped', source name, reason) of posts left out.
+
+        The archive is streamed and converted on self.jobs processes
+        IMPORT_BATCH posts at a time, so memory stays flat. Slugs
+        already taken get a -2, -3, ... suffix.
+        """
+        import importer
+        if not os.path.exists(source):
+            raise DumblrException("No such archive: {}".format(source))
+        if not os.path.isdir(self.posts_path):
+            os.makedirs(self.posts_path)
 
-        d = difflib.Differ()
-        diff_result = {}
-        for update in updates:
-            post = update['post']
-            diffs = update['diff']
+        existing = set(os.path.splitext(f)[0]
+                       for f in os.listdir(self.posts_path))
+        slugs = set(existing)
+        ## next suffix to try, by slug
+        suffixes = {}
+        index = PostIndex(self.INDEX_FILE)
+        writer = BatchWriter()
+        items = importer.items(source)
+
+        from xml.etree.cElementTree import ParseError
+
+        def batch():
+            try:
+                return list(islice(items, IMPORT_BATCH))
+            except (ValueError, ParseError) as e:
+                raise DumblrException(str(e))
+
+        jobs = batch()
+        pool = None
+        if len(jobs) == IMPORT_BATCH:
+            from multiprocessing import Pool, cpu_count
+            workers = self.jobs or cpu_count()
+            if workers > 1:
+                pool = Pool(workers)
+                chunksize = max(1, IMPORT_BATCH // (workers * 4))
+        try:
+            while jobs:
+                if pool:
+                    results = pool.imap(importer.convert, jobs, chunksize)
+                else:
+                    results = imap(importer.convert, jobs)
 
-            diff_attr = {}
-            for k, diff in diffs.iteritems():
-                ## if not a string, convert to string first!
-                if not isinstance(diff[0], basestring):
-                    diff[0] = str(diff[0])
-                    diff[1] = str(diff[1])
-                diff_str = list(d.compare(wrap(diff[0].encode('utf-8'), 60),
-                                          wrap(diff[1].encode('utf-8'), 60)))
-                diff_attr[k] = "\n\t".join(diff_str)
+                for name, post, data in results:
+                    if post is None:
+                        count('posts.skipped')
+                        yield ('skipped', name, data)
+                        continue
 
-            postname = "{}.{}".format(post['slug'], post['format'])
-            diff_result[postname] = diff_attr
+                    base = post['slug']
+                    n = suffixes.get(base, 1)
+                    slug = base if n == 1 else u"{}-{}".format(base, n)
+                    unchanged = False
+                    while slug in slugs:
+                        if slug in existing:
+                            post['slug'] = slug
+                            data = Dumblr.render_post(post)
+                            if Dumblr._same_content(self.post_path(post),
+                                                    data, index):
+                                unchanged = True
+                                break
+                        n += 1
+                        slug = u"{}-{}".format(base, n)
+                    suffixes[base] = n
 
-        return diff_result
+                    if post['slug'] != slug:
+                        post['slug'] = slug
+                        data = Dumblr.render_post(post)
+                    filepath = self.post_path(post)
+                    if unchanged:
+                        yield ('unchanged', os.path.basename(filepath), name)
+                        continue
+                    slugs.add(slug)
+                    writer.write(filepath, data)
+                    count('posts.imported')
+                    yield ('written', os.path.basename(filepath), name)
+                jobs = batch()
+        finally:
+            if pool:
+                pool.terminate()
+            writer.flush()
 
-    def push(self):
+    @timed('push')
+    def push(self, workers=None, retries=None, scope=None):
         """Pushes changes in the posts in the filesystem
         directly to dumblr
+
+        Changes are pushed concurrently on `workers` threads,
+        retrying transient failures up to `retries` times
+        (tumblr.PUSH_WORKERS and tumblr.PUSH_RETRIES by default).
+
+        What was pushed is journaled in self.JOURNAL_FILE, so a push
+        that was cut short is reconciled first and not pushed twice.
+        Posts tumblr would not take today are left for a later push.
+        Only posts in `scope` (a scope.Scope) are pushed if given.
         """
+        import tumblr
+        from journal import Journal, post_quota
+        if workers is None:
+            workers = tumblr.PUSH_WORKERS
+        if retries is None:
+            retries = tumblr.PUSH_RETRIES
         t = self._get_tumblr()
-        changes = self.status()
+        resps = self.resume()
+        changes = self.status(scope)
+        if not changes:
+            return resps
 
         ## push the changes
-        resps = [{'post' : change['post']['slug'],
-                 'status' : t.push_post(change['action'],
-                                        change['post'])}
-                for change in changes]
+        journal = Journal(self.JOURNAL_FILE)
+        journal.start(changes)
+        with span('send'):
+            statuses = t.push_posts(changes, workers=workers, retries=retries,
+                                    journal=journal,
+                                    quota=post_quota(self.POSTED_FILE))
+        count('posts.pushed', len(changes))
+        self.settle_creates(changes, statuses, [
+            i for i, change in enumerate(changes)
+            if change['action'] == 'create' and
+            tumblr.Tumblr.unanswered(statuses[i])])
+
+        ## update snapshot and fs with what was pushed
+        self.reconcile(changes, statuses)
+        journal.remove()
+
+        return resps + self.responses(changes, statuses)
+
+    def resume(self):
+        """Reconciles what a push that was cut short got done,
+        as recorded in self.JOURNAL_FILE. Returns its responses.
+        """
+        from journal import Journal
+        from tumblr import Tumblr
+        journal = Journal(self.JOURNAL_FILE)
+        try:
+            changes, sent, statuses = journal.load()
+        except IOError:
+            return []
+
+        ## creates that were sent but never answered, or answered
+        ## with a failure tumblr may have had after creating them,
+        ## may have made it
+        doubtful = sorted(i for i in sent
+                          if changes[i]['action'] == 'create' and
+                          (i not in statuses or
+                           Tumblr.unanswered(statuses[i])))
+        self.settle_creates(changes, statuses, doubtful)
+
+        ## what was not answered shows up in status() again
+        done = sorted(statuses)
+        changes = [changes[i] for i in done]
+        statuses = [statuses[i] for i in done]
+        count('posts.resumed', len(changes))
+        if changes:
+            self.reconcile(changes, statuses)
+        journal.remove()
+        return self.responses(changes, statuses)
 
+    def settle_creates(self, changes, statuses, doubtful):
+        """Sets the status of the creates at indices `doubtful`,
+        which were sent but not answered with an id, to the id
+        tumblr gave them if they were created after all
+        """
+        if not doubtful:
+            return
+        ids = self._get_tumblr().find_created(
+            self.blog_name, [changes[i]['post'] for i in doubtful])
+        for i, id in zip(doubtful, ids):
+            if id is not None:
+                statuses[i] = {'id' : id}
+
+    @staticmethod
+    def responses(changes, statuses):
+        """What push reports of each change: True if it was
+        pushed, the response 'meta' of tumblr otherwise
+        """
         ## push to tumblr may fail
         ## then the respo objet will NOT have 'id' key
         ## (behavior from tumblr api)
-        for resp in resps:
-            if 'id' in resp['status']:
-                resp['status'] = True
+        resps = []
+        for change, status in zip(changes, statuses):
+            if status and 'id' in status:
+                status = True
             else:
-                resp['status'] = status['meta']
+                status = (status or {}).get('meta')
+            resps.append({'post' : change['post']['slug'], 'status' : status})
+        return resps
 
-        ## update fs system
-        self.pull()
-        self.load()
+    @timed('reconcile')
+    def reconcile(self, changes, statuses):
+        """Applies pushed changes to .dumblr/TUMBLR and the fs.
 
-        return resps
+        Instead of pulling the whole blog again, published posts
+        that were created or updated are fetched by id. Drafts
+        cannot be fetched by id, so what we pushed is kept as is.
+        Only the files of pushed posts are rewritten.
+        """
+        t = self._get_tumblr()
+        name = self.blog_name
+        try:
+            snapshot = self.load_snapshot()
+        except (IOError, EOFError):
+            snapshot = []
+        posts = OrderedDict((post['id'], post) for post in snapshot)
+        ## files written or removed
+        touched = []
+
+        for change, status in zip(changes, statuses):
+            ## failed push, nothing changed on tumblr
+            if not status or 'id' not in status:
+                continue
+
+            local = change['post']
+            if change['action'] == 'delete':
+                posts.pop(local['id'], None)
+                continue
+
+            post = None
+            if local['state'] == 'published':
+                with span('fetch'):
+                    post = t.get_text_post(name, status['id'])
+            if not post:
+                post = dict(local, id=status['id'])
+            posts[post['id']] = post
+
+            ## tumblr may have changed the slug of a new post
+            filepath = self.write_post(post)
+            old_filepath = self.post_path(local)
+            touched.append(os.path.basename(filepath))
+            if old_filepath != filepath and os.path.isfile(old_filepath):
+                os.remove(old_filepath)
+                touched.append(os.path.basename(old_filepath))
+
+        self.save_snapshot(posts.values())
+        self.reindex(touched)
+        with span('history'):
+            History(self.state_path).record(posts.values(), 'push')
+
+    def log(self, post=None):
+        """Reports the recorded history of a post, or of the
+        blog if no post is given. Needs no network access.
+
+        `post` may be a post id, slug or file name.
+        """
+        history = History(self.state_path)
+        if post is None:
+            return [dict(history.manifest(number), posts=None)
+                    for number in history.manifests()]
+
+        post_id = self._resolve_post(post, history)
+        revisions = history.log(post_id)
+        for rev in revisions:
+            rev['post'] = history.store.get(rev['hash']) if rev['hash'] else None
+        return revisions
+
+    def rollback(self, number, post=None):
+        """Writes posts as they were at manifest `number` to the fs.
+
+        Tumblr and .dumblr/TUMBLR are left alone, so the rolled
+        back posts show up in status and can be pushed.
+        """
+        history = History(self.state_path)
+        if number not in history.manifests():
+            raise DumblrException("No such revision: {}".format(number))
+
+        posts = history.checkout(number)
+        if post is not None:
+            post_id = self._resolve_post(post, history)
+            posts = [p for p in posts if p['id'] == post_id]
+
+        if not os.path.isdir(self.posts_path):
+            os.makedirs(self.posts_path)
+        return [self.write_post(p) for p in posts]
+
+    def _resolve_post(self, post, history):
+        """Finds the id of a post given its id, slug or file name
+        """
+        if post.lstrip('-').isdigit():
+            return int(post)
+
+        slug = os.path.splitext(os.path.basename(post))[0]
+        try:
+            snapshot = self.open_snapshot().headers
+        except (IOError, EOFError):
+            snapshot = []
+        ## only look back in history for posts that are gone
+        for posts in chain([snapshot], (history.checkout(number) for number
+                                        in reversed(history.manifests()))):
+            for p in posts:
+                if p['slug'] == slug:
+                    return p['id']
+        raise DumblrException("No history of {}".format(post))
 
     def _get_tumblr(self):
-        config = self.CONFIG['config']
-        return tumblr.Tumblr(config['consumer_key'],
-                             config['secret_key'],
-                             config['oauth_token'],
-                             config['oauth_token_secret'])
+        """One client per Dumblr, so connections and the
+        blog name are reused across calls
+        """
+        ## blogs synced at once ask from several threads
+        with self._tumblr_lock:
+            if self._tumblr:
+                return self._tumblr
+            if self._parent:
+                self._tumblr = self._parent._get_tumblr().for_blog(
+                    self.blog_name)
+                return self._tumblr
+            import tumblr
+            config = self.CONFIG['config']
+            self._tumblr = tumblr.Tumblr(config['consumer_key'],
+                                         config['secret_key'],
+                                         config['oauth_token'],
+                                         config['oauth_token_secret'],
+                                         self.blog_name)
+            if self.rate_limit:
+                self._tumblr.limit_rate(self.rate_limit)
+            if self.cache and os.path.isdir(self.dumblr_path):
+                self._tumblr.use_cache(self.CACHE_PATH,
+                                       self.setting('cache_ttl'))
+            return self._tumblr
+
+    @property
+    def blog_name(self):
+        return self.blog or self.CONFIG['tumblr']['name']
+
+    def blogs(self):
+        """Names of every blog synced here, the default one first
+        """
+        name = self.CONFIG['tumblr']['name']
+        return [name] + [blog for blog in self.CONFIG['tumblr'].get('blogs', [])
+                         if blog != name]
+
+    def for_blog(self, name):
+        """A Dumblr for another blog, sharing this one's client
+        once it needs one
+        """
+        d = Dumblr(name)
+        d.jobs = self.jobs
+        d._parent = self
+        return d
+
+    def for_each_blog(self, method, *args, **kwargs):
+        """Calls a method of Dumblr on every blog concurrently.
+
+        All blogs share one client, and with it one pool of
+        connections and a limit of SHARED_RATE_LIMIT requests a
+        second, so N blogs take about as long as the slowest one.
+
+        Returns (blog, result, error) of every blog, in order.
+        """
+        from multiprocessing.pool import ThreadPool
+        self.rate_limit = self.setting('rate_limit', SHARED_RATE_LIMIT)
+        if self._tumblr:
+            self._tumblr.limit_rate(self.rate_limit)
+        dumblrs = [self.for_blog(name) for name in self.blogs()]
+
+        def run(d):
+            with span(d.blog):
+                try:
+                    return d.blog, getattr(d, method)(*args, **kwargs), None
+                except DumblrException as e:
+                    return d.blog, None, e
+
+        pool = ThreadPool(len(dumblrs))
+        try:
+            return pool.map(run, dumblrs)
+        finally:
+            pool.close()
+
+    def open_snapshot(self):
+        """The snapshot in self.TUMBLR_FILE, bodies read on demand
+        """
+        return Snapshot(self.TUMBLR_FILE)
+
+    def load_snapshot(self):
+        """Text posts stored in self.TUMBLR_FILE, bodies included
+        """
+        return list(self.open_snapshot())
+
+    def save_snapshot(self, posts):
+        write_snapshot(self.TUMBLR_FILE, posts)
+
+    def load_cursor(self):
+        """Unpickles the cursor left by the last pull.
+        If there is no snapshot to build on, returns nothing.
+        """
+        if not (os.path.isfile(self.CURSOR_FILE) and
+                os.path.isfile(self.TUMBLR_FILE)):
+            return {}
+        with open(self.CURSOR_FILE) as f:
+            return cPickle.load(f)
+
+    def save_cursor(self, posts, cursor):
+        """Cursor holds the date and id of the newest published post,
+        and the time of the pull
+        """
+        published = [p for p in posts if p['state'] == 'published']
+        if published:
+            newest = max(published, key=lambda p : (p['date'], p['id']))
+            cursor = {'date' : newest['date'], 'id' : newest['id']}
+        cursor = dict(cursor, synced="{} GMT".format(
+            datetime.datetime.utcnow()))
+
+        with open(self.CURSOR_FILE, 'w') as f:
+            cPickle.dump(cursor, f)
+
+    def setting(self, key, default=None):
+        """A setting of the user, see SETTINGS
+        """
+        return self.CONFIG.get('config', {}).get(key, default)
+
+    def set_setting(self, key, value):
+        """Sets a setting of the user in self.CONFIG_FILE,
+        unsets it if `value` is None
+        """
+        if key not in SETTINGS:
+            raise DumblrException("Unknown setting: {} (one of {})".format(
+                key, ", ".join(sorted(SETTINGS))))
+        config = self.CONFIG.setdefault('config', {})
+        if value is None:
+            config.pop(key, None)
+        else:
+            try:
+                config[key] = SETTINGS[key](value)
+            except ValueError:
+                raise DumblrException("Not a valid {}: {}".format(key, value))
+        with open(self.CONFIG_FILE, 'w') as f:
+            cPickle.dump(self.CONFIG, f)
 
     def load_data(self):
         """Unpickles data file stored in self.CONFIG_FILE
@@ -265,24 +982,47 @@ class Dumblr(object):
 
     @staticmethod
     def dump_frontmatter(post):
-        ## python's list of string prints
-        ## strings within single quotes
-        ## this doesn't work well with
-        ## python's yaml library
-        post['tags'] = u"[{0}]".format(u", ".join([tag for tag in post['tags']]))
-        frontmatter = dedent(u"""\
-        ---
-        title: {title}
-        date: {date}
-        slug: {slug}
-        tags: {tags}
-        format: {format}
-        state: {state}
-        id: {id}
-        ---
-        """.format(**post))
-        return frontmatter
+        return frontmatter.dumps(post)
+
+    @staticmethod
+    def render_post(post):
+        """Contents of the file of a post, utf-8 encoded
+        """
+        return (Dumblr.dump_frontmatter(post) + post['body']).encode('utf-8')
+
+    @staticmethod
+    def _same_content(filepath, data, index):
+        """Whether filepath already holds data. The hash in the
+        index is trusted if the file did not change since.
+        """
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return False
+        if st.st_size != len(data):
+            return False
+
+        name = os.path.basename(filepath)
+        if index.fresh(name, st):
+            return index.entries[name]['hash'] == hashlib.sha1(data).hexdigest()
+        with open(filepath, 'rb') as f:
+            return f.read() == data
         
+    @staticmethod
+    def merge_posts(old, new):
+        """Merges freshly pulled posts into an older snapshot.
+
+        Posts in `new` replace posts with the same id in `old`.
+        Drafts are always pulled in full, so drafts in `old`
+        that are not in `new` are gone.
+        """
+        new_ids = set(post['id'] for post in new)
+        kept = [post for post in old
+                if post['id'] not in new_ids and post['state'] != 'draft']
+        published = [post for post in new if post['state'] == 'published']
+        drafts = [post for post in new if post['state'] == 'draft']
+        return published + kept + drafts
+
     @staticmethod
     def diff_post(p1, p2):
         """Diffs two of posts and returns
@@ -303,20 +1043,22 @@ class Dumblr(object):
 
         http://flask.pocoo.org/snippets/5/
         """
-        _punct_re = re.compile(r'[\t !"#$%&\'()*\-/<=>?@\[\\\]^_`{|},.]+')
+        from unidecode import unidecode
         result = []
         for word in _punct_re.split(text.lower()):
             result.extend(unidecode(word).split())
         return unicode(delim.join(result))
 
     @staticmethod
-    def parse_frontmatter(filename):
-        reg_fm = re.compile(r'^-{3,}$', re.MULTILINE)
+    def parse_frontmatter(filename, header_only=False):
         try:
-            with open(filename, encoding='utf-8') as f:
-                _, fm, content = reg_fm.split(f.read(), 2)
-                p = yaml.load(fm)
-                p.update({'body' : content.lstrip()})
-                return p
+            return frontmatter.load(filename, header_only)
         except (ValueError, IOError) as e:
             return None
+
+    @staticmethod
+    def parse_post(text):
+        """Parses the frontmatter and body of a post.
+        Raises ValueError if there is no frontmatter.
+        """
+        return frontmatter.loads(text)
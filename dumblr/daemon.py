@@ -0,0 +1,299 @@
+"""Long running dumblr, answering commands over a unix socket.
+
+The daemon keeps the snapshot open and the parsed posts in memory and
+watches posts/ and .dumblr/TUMBLR for changes, with pyinotify if
+it is installed and by polling otherwise. Only what changed is read
+again, so status, diff and push are answered without re-importing,
+unpickling or re-parsing anything.
+
+The protocol is one json line each way:
+
+    {"command" : "status", "args" : {}}
+    {"ok" : true, "result" : [...]}
+
+With auto_push, changes to posts/ are pushed once nothing changed
+for `debounce` seconds.
+"""
+import frontmatter
+import json
+import os
+import socket
+import threading
+from SocketServer import StreamRequestHandler, UnixStreamServer
+from core import Dumblr
+from exceptions import DumblrException
+from index import PostIndex
+from scope import Scope
+
+## seconds of quiet before changes are auto pushed
+DEBOUNCE = 2.0
+## seconds between scans when pyinotify is not available
+POLL_INTERVAL = 1.0
+
+class WarmDumblr(Dumblr):
+    """Dumblr that keeps the snapshot and the post index in memory.
+
+    Parsed posts are kept until invalidate_posts() is called or
+    a file in posts/ changes, the snapshot until
+    invalidate_snapshot() is called or .dumblr/TUMBLR changes.
+    Both are checked on every command, so an answer never waits
+    for the watcher to notice a file that was just saved.
+    """
+    def __init__(self, blog=None):
+        Dumblr.__init__(self, blog)
+        self.index = PostIndex(self.INDEX_FILE)
+        self._posts = None
+        self._posts_stat = None
+        self._snapshot = None
+        self._snapshot_stat = None
+
+    def invalidate_posts(self):
+        self._posts = None
+
+    def invalidate_snapshot(self):
+        self._snapshot = None
+
+    def posts_stat(self):
+        """mtime and size of every file in posts/, by name
+        """
+        files = {}
+        if not os.path.isdir(self.posts_path):
+            return files
+        for name in os.listdir(self.posts_path):
+            if name.startswith("."):
+                continue
+            try:
+                st = os.stat(os.path.join(self.posts_path, name))
+            except OSError:
+                continue
+            files[name] = (st.st_mtime, st.st_size)
+        return files
+
+    def dump(self, scope=None):
+        ## stat only, files are read again by the index if they changed
+        stat = self.posts_stat()
+        if self._posts is None or stat != self._posts_stat:
+            entries = self.index.refresh(self.posts_path, frontmatter.loads,
+                                         self.jobs)
+            self.index.save()
+            self._posts = [(name, post) for name, post in entries if post]
+            self._posts_stat = stat
+        return [post for name, post in self._posts
+                if not scope or scope.match(post, name)]
+
+    def open_snapshot(self):
+        st = os.stat(self.TUMBLR_FILE)
+        stat = (st.st_ino, st.st_mtime, st.st_size)
+        if self._snapshot is None or stat != self._snapshot_stat:
+            self._snapshot = Dumblr.open_snapshot(self)
+            self._snapshot_stat = stat
+        return self._snapshot
+
+    def save_snapshot(self, posts):
+        Dumblr.save_snapshot(self, posts)
+        self.invalidate_snapshot()
+
+class Daemon(object):
+    def __init__(self, dumblr, auto_push=False, debounce=DEBOUNCE,
+                 poll=POLL_INTERVAL, log=None):
+        """`dumblr` is a WarmDumblr, `log` is called with
+        a line for every auto push
+        """
+        self.dumblr = dumblr
+        self.auto_push = auto_push
+        self.debounce = debounce
+        self.poll = poll
+        self.log = log or (lambda line : None)
+        ## one command at a time, auto pushes included
+        self.lock = threading.RLock()
+        self.timer = None
+        self.watcher = None
+        self.server = None
+
+    def serve(self):
+        """Serves until a stop command
+        """
+        path = self.dumblr.DAEMON_SOCKET
+        if call(path, 'ping') is not None:
+            raise DumblrException("A daemon is already running")
+        if os.path.exists(path):
+            ## left over by a daemon that died
+            os.remove(path)
+
+        for d in [self.dumblr.posts_path, self.dumblr.state_path]:
+            if not os.path.isdir(d):
+                os.makedirs(d)
+
+        self.server = UnixStreamServer(path, _Handler)
+        self.server.daemon = self
+        self.watcher = watch([self.dumblr.posts_path, self.dumblr.TUMBLR_FILE],
+                             self.changed, self.poll)
+        try:
+            self.server.serve_forever()
+        finally:
+            self.watcher.stop()
+            if self.timer:
+                self.timer.cancel()
+            self.server.server_close()
+            os.remove(path)
+
+    def stop(self):
+        ## shutdown() waits for serve_forever, which is serving us
+        threading.Thread(target=self.server.shutdown).start()
+
+    def handle(self, command, args):
+        if args.get('scope'):
+            args['scope'] = Scope(**args['scope'])
+        with self.lock:
+            if command == 'ping':
+                return os.getpid()
+            if command == 'status':
+                return self.dumblr.status(**args)
+            if command == 'diff':
+                return list(self.dumblr.iter_diff(**args))
+            if command == 'push':
+                return self.dumblr.push(**args)
+            if command == 'stop':
+                self.stop()
+                return True
+        raise DumblrException("Unknown command: {}".format(command))
+
+    def changed(self, path):
+        """Called by the watcher with every changed path
+        """
+        with self.lock:
+            if path == self.dumblr.TUMBLR_FILE:
+                self.dumblr.invalidate_snapshot()
+                return
+            self.dumblr.invalidate_posts()
+            ## temporary files of atomic writes
+            if os.path.basename(path).startswith("."):
+                return
+            if self.auto_push:
+                if self.timer:
+                    self.timer.cancel()
+                self.timer = threading.Timer(self.debounce, self.push)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def push(self):
+        with self.lock:
+            try:
+                if not self.dumblr.status():
+                    return
+                for resp in self.dumblr.push():
+                    self.log("{}\t: {}".format(resp['status'], resp['post']))
+            except DumblrException as e:
+                self.log("auto push failed: {}".format(e))
+
+class _Handler(StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            result = self.server.daemon.handle(request['command'],
+                                               request.get('args', {}))
+            response = {'ok' : True, 'result' : result}
+        except Exception as e:
+            ## one bad command should not take the daemon down
+            response = {'ok' : False, 'error' : str(e)}
+        self.wfile.write(json.dumps(response) + "\n")
+
+def call(path, command, **args):
+    """Sends a command to the daemon listening on `path` and
+    returns its result, or None if no daemon is running there
+    """
+    if not os.path.exists(path):
+        return None
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+    except socket.error:
+        s.close()
+        return None
+    try:
+        f = s.makefile('rwb')
+        f.write(json.dumps({'command' : command, 'args' : args}) + "\n")
+        f.flush()
+        line = f.readline()
+    finally:
+        s.close()
+    if not line:
+        raise DumblrException("The daemon hung up")
+    response = json.loads(line)
+    if not response['ok']:
+        raise DumblrException(response['error'])
+    return response['result']
+
+def watch(paths, callback, poll=POLL_INTERVAL):
+    """Calls callback(path) for every changed file in or of `paths`
+    on a background thread. Returns the watcher, call stop() on it.
+    """
+    try:
+        import pyinotify
+    except ImportError:
+        return PollingWatcher(paths, callback, poll)
+    return InotifyWatcher(pyinotify, paths, callback)
+
+class PollingWatcher(object):
+    """Compares mtime and size of every watched file
+    every `poll` seconds
+    """
+    def __init__(self, paths, callback, poll):
+        self.paths = paths
+        self.callback = callback
+        self.poll = poll
+        self.stopped = threading.Event()
+        self.seen = self.scan()
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def scan(self):
+        files = {}
+        for path in self.paths:
+            if os.path.isdir(path):
+                names = [os.path.join(path, f) for f in os.listdir(path)]
+            else:
+                names = [path]
+            for name in names:
+                try:
+                    st = os.stat(name)
+                except OSError:
+                    continue
+                files[name] = (st.st_mtime, st.st_size)
+        return files
+
+    def run(self):
+        while not self.stopped.wait(self.poll):
+            files = self.scan()
+            for name in set(files) | set(self.seen):
+                if files.get(name) != self.seen.get(name):
+                    self.callback(name)
+            self.seen = files
+
+    def stop(self):
+        self.stopped.set()
+
+class InotifyWatcher(object):
+    def __init__(self, pyinotify, paths, callback):
+        mask = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO |
+                pyinotify.IN_MOVED_FROM | pyinotify.IN_DELETE |
+                pyinotify.IN_CREATE)
+        ## watch directories, files may be replaced by renames
+        dirs = set(p if os.path.isdir(p) else os.path.dirname(p)
+                   for p in paths)
+        watched = set(p for p in paths if not os.path.isdir(p))
+
+        def process(event):
+            path = event.pathname
+            if os.path.dirname(path) in paths or path in watched:
+                callback(path)
+
+        self.manager = pyinotify.WatchManager()
+        self.notifier = pyinotify.ThreadedNotifier(self.manager, process)
+        self.notifier.daemon = True
+        self.notifier.start()
+        self.manager.add_watch(list(dirs), mask)
+
+    def stop(self):
+        self.notifier.stop()
@@ -0,0 +1,152 @@
+"""Line diffs of posts.
+
+Common leading and trailing lines are stripped in linear time
+before anything is matched, and only what is left is handed to
+difflib. Past LINE_CUTOFF lines that is no longer worth it, and
+the remaining block is reported as replaced outright.
+"""
+import frontmatter
+from difflib import SequenceMatcher
+
+## past this many lines (after trimming), don't look for a minimal diff
+LINE_CUTOFF = 2000
+
+MODES = ['attr', 'unified', 'stat', 'name']
+
+def opcodes(a, b):
+    """Same contract as SequenceMatcher.get_opcodes()
+    """
+    n = min(len(a), len(b))
+    prefix = 0
+    while prefix < n and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while (suffix < n - prefix and
+           a[len(a) - suffix - 1] == b[len(b) - suffix - 1]):
+        suffix += 1
+
+    a_mid = a[prefix:len(a) - suffix]
+    b_mid = b[prefix:len(b) - suffix]
+
+    codes = []
+    if prefix:
+        codes.append(('equal', 0, prefix, 0, prefix))
+
+    if a_mid or b_mid:
+        if max(len(a_mid), len(b_mid)) > LINE_CUTOFF or not (a_mid and b_mid):
+            tag = ('replace' if a_mid and b_mid else
+                   'delete' if a_mid else 'insert')
+            mid = [(tag, 0, len(a_mid), 0, len(b_mid))]
+        else:
+            mid = SequenceMatcher(None, a_mid, b_mid).get_opcodes()
+        codes.extend((tag, i1 + prefix, i2 + prefix, j1 + prefix, j2 + prefix)
+                     for tag, i1, i2, j1, j2 in mid)
+
+    if suffix:
+        codes.append(('equal', len(a) - suffix, len(a),
+                      len(b) - suffix, len(b)))
+    return codes
+
+def line_diff(a, b):
+    """Every line of a and b, prefixed with '  ', '- ' or '+ '
+    """
+    lines = []
+    for tag, i1, i2, j1, j2 in opcodes(a, b):
+        if tag == 'equal':
+            lines.extend("  " + line for line in a[i1:i2])
+            continue
+        lines.extend("- " + line for line in a[i1:i2])
+        lines.extend("+ " + line for line in b[j1:j2])
+    return lines
+
+def unified_diff(a, b, fromfile, tofile, n=3):
+    """Like difflib.unified_diff, built on opcodes()
+    """
+    codes = opcodes(a, b)
+    if all(tag == 'equal' for tag, _, _, _, _ in codes):
+        return []
+
+    lines = ["--- " + fromfile, "+++ " + tofile]
+    for group in _grouped(codes, n):
+        i1, i2 = group[0][1], group[-1][2]
+        j1, j2 = group[0][3], group[-1][4]
+        lines.append("@@ -{} +{} @@".format(_range(i1, i2), _range(j1, j2)))
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                lines.extend(" " + line for line in a[i1:i2])
+                continue
+            lines.extend("-" + line for line in a[i1:i2])
+            lines.extend("+" + line for line in b[j1:j2])
+    return lines
+
+def _grouped(codes, n):
+    """Hunks with up to n lines of context,
+    as in SequenceMatcher.get_grouped_opcodes()
+    """
+    codes = list(codes)
+    if codes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    if codes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == 'equal' and i2 - i1 > n * 2:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+def _range(start, stop):
+    length = stop - start
+    if length == 1:
+        return "{}".format(start + 1)
+    if not length:
+        start -= 1
+    return "{},{}".format(start + 1, length)
+
+def _lines(value):
+    if not isinstance(value, basestring):
+        value = unicode(value)
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return value.splitlines()
+
+def _render(post):
+    return (frontmatter.dumps(post) + post['body']).encode('utf-8')
+
+def diff_post(job):
+    """Diffs one updated post, in one of MODES
+
+    job is (name, old post, new post, changed fields, mode).
+    Returns (name, result) where result is
+    - attr: {field : diff lines joined by "\\n\\t"}
+    - unified: unified diff lines of the whole post file
+    - stat: (lines added, lines removed) of the whole post file
+    - name: None
+    """
+    name, old, new, fields, mode = job
+    if mode == 'name':
+        return name, None
+
+    if mode == 'attr':
+        return name, dict((field, "\n\t".join(line_diff(_lines(old[field]),
+                                                        _lines(new[field]))))
+                          for field in fields)
+
+    a = _render(old).splitlines()
+    b = _render(new).splitlines()
+    if mode == 'unified':
+        return name, unified_diff(a, b, "a/" + name, "b/" + name)
+
+    added = removed = 0
+    for tag, i1, i2, j1, j2 in opcodes(a, b):
+        if tag != 'equal':
+            removed += i2 - i1
+            added += j2 - j1
+    return name, (added, removed)
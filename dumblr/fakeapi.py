@@ -0,0 +1,273 @@
+"""An in-process fake of the Tumblr v2 api, as far as dumblr uses it.
+
+Serves user info, text posts paged by offset, drafts paged by
+before_id, and creating, editing and deleting posts, on a threaded
+http server bound to localhost. Latency, random failures and rate
+limits can be injected, so pulls and pushes can be tested and
+benchmarked without credentials or a network.
+
+    with FakeTumblr('blog', posts, latency=0.05, rate_limit=50) as api:
+        t = Tumblr('ckey', 'skey', 'oauth', 'oauth_s', host=api.host)
+
+OAuth signatures are not checked.
+"""
+import json
+import random
+import threading
+import time
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+## same as the real api
+PAGE_LIMIT = 20
+
+STATUS_MSG = {200 : "OK", 201 : "Created", 400 : "Bad Request",
+              404 : "Not Found", 429 : "Limit Exceeded",
+              503 : "Service Unavailable"}
+
+class FakeTumblr(object):
+    def __init__(self, name='fake', posts=(), latency=0, error_rate=0,
+                 rate_limit=None, seed=None, blogs=None):
+        """`posts` are dumblr posts, 'state' tells drafts apart.
+        `blogs` maps the names of more blogs of the user to their posts.
+
+        `latency` is seconds per request, or a (min, max) range.
+        `error_rate` is the share of requests answered with a 503.
+        `rate_limit` is the number of requests per second answered
+        before the rest of that second is answered with a 429.
+        Statuses appended to `failures` answer the next requests.
+        Statuses appended to `lost` answer the next requests once
+        they were carried out, as if the answer was lost.
+        """
+        self.name = name
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.failures = []
+        self.lost = []
+        ## (method, path) of every request, in order
+        self.requests = []
+
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        self.window = (0, 0)
+        self.next_id = 1
+        self._published = {}
+        self.blogs = {name : {}}
+        ## posts of the main blog
+        self.posts = self.blogs[name]
+        for post in posts:
+            self.add(post)
+        for blog, blog_posts in (blogs or {}).iteritems():
+            self.blogs[blog] = {}
+            for post in blog_posts:
+                self.add(post, blog)
+        self.server = None
+
+    @property
+    def host(self):
+        return "http://{}:{}".format(*self.server.server_address)
+
+    def start(self):
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.api = self
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def add(self, post, blog=None):
+        """Stores a post as tumblr would return it, returns its id
+        """
+        blog = blog or self.name
+        post = dict(post)
+        if post.get('id', -1) < 0:
+            post['id'] = self.next_id
+        self.next_id = max(self.next_id, post['id'] + 1)
+        post.setdefault('date', time.strftime("%Y-%m-%d %H:%M:%S GMT",
+                                              time.gmtime()))
+        post.setdefault('state', 'published')
+        post.setdefault('format', 'html')
+        post.setdefault('tags', [])
+        post.setdefault('title', None)
+        post.setdefault('body', "")
+        post.setdefault('slug', "")
+        post.update({'type' : 'text', 'blog_name' : blog})
+        self.blogs[blog][post['id']] = post
+        self._published.pop(blog, None)
+        return post['id']
+
+    def published(self, blog=None):
+        """Newest first, as the api pages them
+        """
+        blog = blog or self.name
+        if blog not in self._published:
+            self._published[blog] = sorted(
+                (p for p in self.blogs[blog].itervalues()
+                 if p['state'] == 'published'),
+                key=lambda p : (p['date'], p['id']), reverse=True)
+        return self._published[blog]
+
+    def drafts(self, blog=None):
+        return sorted((p for p in self.blogs[blog or self.name].itervalues()
+                       if p['state'] == 'draft'),
+                      key=lambda p : p['id'], reverse=True)
+
+    def handle(self, method, path, params):
+        """Returns (status, response) of one api call
+        """
+        with self.lock:
+            self.requests.append((method, path))
+            status = self._injected()
+            if status:
+                return status, []
+            resp = self._route(method, path, params)
+            if self.lost:
+                return self.lost.pop(0), []
+            return resp
+
+    def _route(self, method, path, params):
+        parts = path.strip("/").split("/")
+        if parts[:3] == ['v2', 'user', 'info'] and method == "GET":
+            blogs = [self.name] + sorted(set(self.blogs) - set([self.name]))
+            return 200, {'user' : {'name' : self.name,
+                                   'blogs' : [{'name' : blog}
+                                              for blog in blogs]}}
+        if parts[:2] != ['v2', 'blog'] or len(parts) < 4:
+            return 404, []
+        blog = parts[2]
+        if blog.endswith(".tumblr.com"):
+            blog = blog[:-len(".tumblr.com")]
+        if blog not in self.blogs:
+            return 404, []
+
+        endpoint = (method, "/".join(parts[3:]))
+        if endpoint in (("GET", "posts"), ("GET", "posts/text")):
+            return self._get_posts(blog, params)
+        if endpoint == ("GET", "posts/draft"):
+            return self._get_drafts(blog, params)
+        if endpoint == ("POST", "post"):
+            return self._create(blog, params)
+        if endpoint == ("POST", "post/edit"):
+            return self._edit(blog, params)
+        if endpoint == ("POST", "post/delete"):
+            return self._delete(blog, params)
+        return 404, []
+
+    def _injected(self):
+        if self.failures:
+            return self.failures.pop(0)
+        if self.rate_limit is not None:
+            second = int(time.time())
+            start, count = self.window
+            if start != second:
+                start, count = second, 0
+            self.window = (start, count + 1)
+            if count >= self.rate_limit:
+                return 429
+        if self.error_rate and self.random.random() < self.error_rate:
+            return 503
+        return None
+
+    def delay(self):
+        if isinstance(self.latency, tuple):
+            with self.lock:
+                seconds = self.random.uniform(*self.latency)
+        else:
+            seconds = self.latency
+        if seconds:
+            time.sleep(seconds)
+
+    def _get_posts(self, blog, params):
+        posts = self.published(blog)
+        if 'id' in params:
+            posts = [p for p in posts if p['id'] == int(params['id'])]
+        offset = int(params.get('offset', 0))
+        limit = min(int(params.get('limit', PAGE_LIMIT)), PAGE_LIMIT)
+        return 200, {'blog' : {'name' : blog, 'posts' : len(posts)},
+                     'posts' : posts[offset:offset + limit],
+                     'total_posts' : len(posts)}
+
+    def _get_drafts(self, blog, params):
+        posts = self.drafts(blog)
+        if 'before_id' in params:
+            posts = [p for p in posts if p['id'] < int(params['before_id'])]
+        return 200, {'posts' : posts[:PAGE_LIMIT]}
+
+    def _create(self, blog, params):
+        if params.get('type') != 'text':
+            return 400, []
+        return 201, {'id' : self.add(_fields(params), blog)}
+
+    def _edit(self, blog, params):
+        id = int(params.get('id', 0))
+        if id not in self.blogs[blog]:
+            return 404, []
+        self.blogs[blog][id].update(_fields(params))
+        self._published.pop(blog, None)
+        return 200, {'id' : id}
+
+    def _delete(self, blog, params):
+        id = int(params.get('id', 0))
+        if self.blogs[blog].pop(id, None) is None:
+            return 404, []
+        self._published.pop(blog, None)
+        return 200, {'id' : id}
+
+def _fields(params):
+    """Post fields of a create or edit call
+    """
+    keys = ['title', 'body', 'date', 'format', 'slug', 'state']
+    post = dict((k, params[k]) for k in keys if k in params)
+    if 'tags' in params:
+        post['tags'] = [t for t in params['tags'].split(",") if t]
+    return post
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class _Handler(BaseHTTPRequestHandler):
+    ## keep-alive, like the real thing
+    protocol_version = "HTTP/1.1"
+    ## one write per response, or nagle holds back the body
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        self._respond("GET", url.path, url.query)
+
+    def do_POST(self):
+        url = urlparse.urlparse(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        self._respond("POST", url.path, self.rfile.read(length))
+
+    def _respond(self, method, path, query):
+        params = dict((k, v[-1].decode('utf-8')) for k, v in
+                      urlparse.parse_qs(query, keep_blank_values=True).items())
+        api = self.server.api
+        api.delay()
+        status, response = api.handle(method, path, params)
+
+        body = json.dumps({'meta' : {'status' : status,
+                                     'msg' : STATUS_MSG.get(status, "")},
+                           'response' : response})
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""Reads and writes the frontmatter of dumblr posts.
+
+Headers written by dumblr only use a handful of keys with simple
+values, so they are parsed without yaml. Anything else (hand edited
+headers with comments, block lists, ...) falls back to yaml's
+safe loader.
+"""
+import datetime
+import io
+import re
+
+KEYS = ['title', 'date', 'slug', 'tags', 'format', 'state', 'id']
+
+_delim_re = re.compile(ur'^-{3,}$', re.MULTILINE)
+_line_re = re.compile(ur'^(\w+): ?(.*)$')
+_int_re = re.compile(ur'^-?[0-9]+$')
+
+## plain scalars that yaml resolves to something other than a string
+_implicit_re = re.compile(ur'''^(?:
+    yes|Yes|YES|no|No|NO|true|True|TRUE|false|False|FALSE|on|On|ON|off|Off|OFF
+   |[-+]?(?:[0-9][0-9_]*)\.[0-9_]*(?:[eE][-+][0-9]+)?
+   |\.[0-9_]+(?:[eE][-+][0-9]+)?
+   |[-+]?[0-9][0-9_]*(?::[0-5]?[0-9])+\.[0-9_]*
+   |[-+]?\.(?:inf|Inf|INF)
+   |\.(?:nan|NaN|NAN)
+   |[-+]?0b[0-1_]+
+   |[-+]?0[0-7_]+
+   |[-+]?(?:0|[1-9][0-9_]*)
+   |[-+]?0x[0-9a-fA-F_]+
+   |[-+]?[1-9][0-9_]*(?::[0-5]?[0-9])+
+   |<<|~|null|Null|NULL|=
+   |[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]
+   |[0-9][0-9][0-9][0-9]-[0-9][0-9]?-[0-9][0-9]?
+    (?:[Tt]|[ \t]+)[0-9][0-9]?:[0-9][0-9]:[0-9][0-9](?:\.[0-9]*)?
+    (?:[ \t]*(?:Z|[-+][0-9][0-9]?(?::[0-9][0-9])?))?
+)$''', re.X)
+
+## characters that cannot appear raw on a single yaml line
+_unsafe_re = re.compile(u'[^\x20-\x7e\xa0-\u2027\u202a-\ud7ff\ue000-\ufefe\uff00-\ufffd]')
+
+## how dumblr writes dates, as tumblr does
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S GMT"
+
+## yaml double quoted escapes
+_escapes = {u'0' : u'\x00', u'a' : u'\x07', u'b' : u'\x08', u't' : u'\t',
+            u'\t' : u'\t', u'n' : u'\n', u'v' : u'\x0b', u'f' : u'\x0c',
+            u'r' : u'\r', u'e' : u'\x1b', u' ' : u' ', u'"' : u'"',
+            u'/' : u'/', u'\\' : u'\\', u'N' : u'\x85', u'_' : u'\xa0',
+            u'L' : u'\u2028', u'P' : u'\u2029'}
+_escape_re = re.compile(ur'\\(x[0-9a-fA-F]{2}|u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|.)')
+_short_escapes = {u'\n' : u'\\n', u'\t' : u'\\t', u'\r' : u'\\r'}
+
+def dumps(post):
+    """Returns the frontmatter of a post
+    """
+    return u"".join([
+        u"---\n",
+        u"title: {}\n".format(scalar(post['title'])),
+        u"date: {}\n".format(scalar(post['date'])),
+        u"slug: {}\n".format(scalar(post['slug'])),
+        u"tags: [{}]\n".format(u", ".join(scalar(tag, flow=True)
+                                          for tag in post['tags'])),
+        u"format: {}\n".format(scalar(post['format'])),
+        u"state: {}\n".format(scalar(post['state'])),
+        u"id: {}\n".format(int(post['id'])),
+        u"---\n"])
+
+def loads(text, header_only=False):
+    """Parses a post. Raises ValueError if there is no frontmatter.
+
+    The body is everything after the frontmatter, leading
+    whitespace removed. It is left out if header_only is set.
+    """
+    _, fm, content = _delim_re.split(text, 2)
+    post = parse_header(fm)
+    if not header_only:
+        post['body'] = content.lstrip()
+    return post
+
+def load(filename, header_only=False):
+    """Parses the post in `filename`.
+
+    With header_only, the file is only read up
+    to the end of the frontmatter.
+    """
+    with io.open(filename, encoding='utf-8') as f:
+        if not header_only:
+            return loads(f.read())
+
+        lines = []
+        delims = 0
+        for line in f:
+            lines.append(line)
+            if _delim_re.match(line.rstrip(u'\r\n')):
+                delims += 1
+                if delims == 2:
+                    break
+        return loads(u"".join(lines), header_only=True)
+
+def parse_header(fm):
+    """Parses the text between the frontmatter delimiters
+    """
+    post = _parse_known(fm)
+    if post is None:
+        post = _parse_yaml(fm)
+        ## yaml reads unquoted timestamps as datetimes
+        if isinstance(post.get('date'), datetime.date):
+            post['date'] = format_date(post['date'])
+    return post
+
+def format_date(value):
+    """A date or datetime as dumblr writes dates, in UTC
+    """
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    elif value.utcoffset():
+        value = value.replace(tzinfo=None) - value.utcoffset()
+    return unicode(value.strftime(DATE_FORMAT))
+
+def _parse_known(fm):
+    """Parses a header made of known keys with simple values.
+    Returns None on anything else.
+    """
+    post = {}
+    for line in fm.splitlines():
+        if not line.strip():
+            continue
+        m = _line_re.match(line)
+        if not m or m.group(1) not in KEYS or m.group(1) in post:
+            return None
+        key, value = m.group(1), m.group(2).rstrip()
+
+        if key == 'id':
+            if not _int_re.match(value):
+                return None
+            value = int(value)
+        elif key == 'tags':
+            value = _parse_flow_list(value)
+        else:
+            value = _parse_scalar(value)
+
+        if value is None:
+            return None
+        post[key] = value
+    return post
+
+def _parse_scalar(value, flow=False):
+    if value.startswith(u'"'):
+        if len(value) < 2 or not value.endswith(u'"'):
+            return None
+        return _unquote_double(value[1:-1])
+    if value.startswith(u"'"):
+        inner = value[1:-1]
+        if (len(value) < 2 or not value.endswith(u"'") or
+            u"'" in inner.replace(u"''", u"")):
+            return None
+        return inner.replace(u"''", u"'")
+    if not is_plain(value, flow):
+        return None
+    return value
+
+def _parse_flow_list(value):
+    if not (value.startswith(u'[') and value.endswith(u']')):
+        return None
+    inner = value[1:-1].strip()
+    if not inner:
+        return []
+
+    items = []
+    while inner:
+        if inner[0] == u'"':
+            m = re.match(ur'"((?:[^"\\]|\\.)*)"', inner)
+        elif inner[0] == u"'":
+            m = re.match(ur"'((?:[^']|'')*)'", inner)
+        else:
+            m = re.match(ur'([^,]*)', inner)
+        if not m:
+            return None
+        item = _parse_scalar(m.group(0).strip(), flow=True)
+        if item is None:
+            return None
+        items.append(item)
+
+        inner = inner[m.end():].lstrip()
+        if inner.startswith(u','):
+            inner = inner[1:].lstrip()
+            if not inner:
+                return None
+        elif inner:
+            return None
+    return items
+
+def _unquote_double(inner):
+    if u'"' in _escape_re.sub(u'', inner):
+        return None
+    try:
+        return _escape_re.sub(_unescape, inner)
+    except KeyError:
+        return None
+
+def _unescape(m):
+    e = m.group(1)
+    if len(e) > 1:
+        return unichr(int(e[1:], 16))
+    return _escapes[e]
+
+def _parse_yaml(fm):
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    post = yaml.load(fm, Loader=loader)
+    if not isinstance(post, dict):
+        raise ValueError("frontmatter is not a mapping")
+    return post
+
+def is_plain(value, flow=False):
+    """Whether yaml reads `value` back unchanged as a plain scalar
+    """
+    if not value or value != value.strip():
+        return False
+    if value[0] in u'-?:,[]{}#&*!|>\'"%@`':
+        return False
+    if u': ' in value or u' #' in value or value.endswith(u':'):
+        return False
+    if flow and any(c in value for c in u':,[]{}'):
+        return False
+    return not (_unsafe_re.search(value) or _implicit_re.match(value))
+
+def scalar(value, flow=False):
+    """Formats a string as a yaml scalar,
+    quoting it only if it has to be
+    """
+    if not isinstance(value, basestring):
+        value = unicode(value)
+    if is_plain(value, flow):
+        return value
+    value = value.replace(u'\\', u'\\\\').replace(u'"', u'\\"')
+    return u'"{}"'.format(_unsafe_re.sub(_escape, value))
+
+def _escape(m):
+    c = m.group()
+    if c in _short_escapes:
+        return _short_escapes[c]
+    n = ord(c)
+    if n < 0x100:
+        return u'\\x{:02x}'.format(n)
+    elif n < 0x10000:
+        return u'\\u{:04x}'.format(n)
+    return u'\\U{:08x}'.format(n)
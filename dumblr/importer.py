@@ -0,0 +1,278 @@
+"""Reads posts out of other blogs' archives.
+
+Sources are streamed one post at a time, so archives of any size
+import in flat memory:
+
+- Jekyll and Hugo content directories, posts with yaml (---) or
+  simple toml (+++) frontmatter. A Jekyll site is read from its
+  _posts and _drafts.
+- Tumblr xml exports (api v1), parsed incrementally.
+- Tumblr json exports (api v2): a list of posts, an api response
+  holding one, or one post per line (.jsonl).
+
+Only text posts are imported. `items` yields what `convert` turns
+into dumblr posts; convert runs on worker processes.
+"""
+import datetime
+import io
+import json
+import os
+import re
+import frontmatter
+
+EXTENSIONS = {'.md' : 'markdown', '.markdown' : 'markdown',
+              '.mdown' : 'markdown', '.html' : 'html', '.htm' : 'html'}
+
+## characters of json read at a time
+CHUNK = 1 << 16
+
+_jekyll_name_re = re.compile(r'^(\d{4}-\d{2}-\d{2})-(.+)$')
+_toml_delim_re = re.compile(ur'^\+{3}\s*$', re.MULTILINE)
+_toml_line_re = re.compile(ur'^([\w-]+)\s*=\s*(.+?)\s*$')
+_offset_re = re.compile(r'^(.*?)\s*(?:(Z|GMT|UTC)|([-+])(\d\d):?(\d\d))$')
+_posts_key_re = re.compile(ur'"posts"\s*:\s*\[')
+_separator_re = re.compile(ur'[\s,]*')
+
+DATE_FORMATS = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S",
+                "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%Y-%m-%d"]
+
+def items(source):
+    """Yields ('file', path) or ('tumblr', post) of every post in
+    source. Files are left for the workers to read.
+    """
+    if os.path.isdir(source):
+        for item in _files(source):
+            yield item
+        return
+    ext = os.path.splitext(source)[1].lower()
+    if ext == '.xml':
+        posts = _tumblr_xml(source)
+    elif ext == '.json':
+        posts = _tumblr_json(source)
+    elif ext == '.jsonl':
+        posts = _json_lines(source)
+    else:
+        raise ValueError("Unknown kind of archive: {}".format(source))
+    ## undated posts are dated the same on every import
+    mtime = os.path.getmtime(source)
+    for post in posts:
+        if isinstance(post, dict) and not post.get('timestamp'):
+            post['timestamp'] = mtime
+        yield ('tumblr', post)
+
+def convert(item):
+    """Turns an item into a dumblr post, rendered.
+
+    Returns (source name, post, data), or (source name, None,
+    reason) for items that cannot be imported.
+    """
+    ## imported here, core imports this module
+    from core import Dumblr
+    kind, value = item
+    name = value
+    try:
+        if kind == 'file':
+            post = _from_file(value)
+        else:
+            name = u"{} {}".format(value.get('type', 'post'),
+                                   value.get('id', ''))
+            post = _from_tumblr(value)
+    except Exception as e:
+        ## one bad post should not stop the import
+        return name, None, str(e) or e.__class__.__name__
+    if isinstance(post, basestring):
+        return name, None, post
+    return name, post, Dumblr.render_post(post)
+
+def _files(source):
+    dirs = [source]
+    posts = os.path.join(source, "_posts")
+    if os.path.isdir(posts):
+        dirs = [posts, os.path.join(source, "_drafts")]
+    for d in dirs:
+        for root, subdirs, files in os.walk(d):
+            ## hidden, and hugo's section pages
+            subdirs[:] = sorted(s for s in subdirs if not s.startswith("."))
+            for f in sorted(files):
+                if (os.path.splitext(f)[1].lower() in EXTENSIONS and
+                    not f.startswith((".", "_"))):
+                    yield ('file', os.path.join(root, f))
+
+def _from_file(path):
+    with io.open(path, encoding='utf-8') as f:
+        text = f.read()
+    if _toml_delim_re.match(text):
+        _, fm, body = _toml_delim_re.split(text, 2)
+        meta = _parse_toml(fm)
+    else:
+        meta = frontmatter.loads(text)
+        body = meta.pop('body')
+
+    stem, ext = os.path.splitext(os.path.basename(path))
+    m = _jekyll_name_re.match(stem)
+    name_date, name_slug = m.groups() if m else (None, stem)
+
+    draft = (meta.get('draft') is True or meta.get('published') is False or
+             meta.get('state') == 'draft' or
+             os.path.basename(os.path.dirname(path)) == "_drafts")
+    tags = meta.get('tags') or []
+    if isinstance(tags, basestring):
+        tags = tags.split()
+    title = meta.get('title') or name_slug.replace(u"-", u" ")
+    date = _date(meta.get('date') or name_date, os.path.getmtime(path))
+    return _post(title, date,
+                 meta.get('slug') or name_slug, tags,
+                 meta.get('format') or EXTENSIONS[ext.lower()],
+                 'draft' if draft else 'published', body.lstrip())
+
+def _from_tumblr(post):
+    if post.get('type', 'text') not in ('text', 'regular'):
+        return "not a text post"
+    return _post(post.get('title') or u"",
+                 _date(post.get('date'), float(post.get('timestamp') or 0)),
+                 post.get('slug') or unicode(post.get('id', u"")),
+                 post.get('tags') or [], post.get('format') or 'html',
+                 'draft' if post.get('state') in ('draft', 'private')
+                 else 'published',
+                 post.get('body') or u"")
+
+def _post(title, date, slug, tags, format, state, body):
+    from core import Dumblr
+    return {'title' : unicode(title), 'date' : date,
+            'slug' : Dumblr.slugify(unicode(slug)) or u"post",
+            'tags' : [unicode(tag) for tag in tags],
+            'format' : format, 'state' : state, 'id' : -1,
+            'body' : body}
+
+def _date(value, default):
+    """The date as dumblr writes it, UTC, `default` (seconds since
+    the epoch) if there is none. Strings in no known format are
+    passed on as they are.
+    """
+    if value is None:
+        value = datetime.datetime.utcfromtimestamp(default)
+    if isinstance(value, datetime.datetime):
+        if value.utcoffset():
+            value = value.replace(tzinfo=None) - value.utcoffset()
+    elif isinstance(value, datetime.date):
+        value = datetime.datetime.combine(value, datetime.time())
+    else:
+        text = unicode(value).strip()
+        m = _offset_re.match(text)
+        offset = datetime.timedelta()
+        if m and m.group(3):
+            offset = datetime.timedelta(hours=int(m.group(4)),
+                                        minutes=int(m.group(5)))
+            offset = offset if m.group(3) == '+' else -offset
+        stripped = m.group(1) if m else text
+        for format in DATE_FORMATS:
+            try:
+                value = datetime.datetime.strptime(stripped, format) - offset
+                break
+            except ValueError:
+                continue
+        else:
+            return text
+    return value.strftime("%Y-%m-%d %H:%M:%S GMT")
+
+def _parse_toml(fm):
+    """Top level `key = value` pairs of a toml header, as far
+    as hugo headers use them. Tables are left out.
+    """
+    meta = {}
+    for line in fm.splitlines():
+        line = line.strip()
+        if line.startswith(u"["):
+            break
+        m = _toml_line_re.match(line)
+        if not m:
+            continue
+        key, value = m.groups()
+        if value.startswith((u'"', u'[')):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                continue
+        elif value.startswith(u"'") and value.endswith(u"'"):
+            value = value[1:-1]
+        elif value in (u"true", u"false"):
+            value = value == u"true"
+        meta[key] = value
+    return meta
+
+def _tumblr_xml(path):
+    from xml.etree import cElementTree
+    parents = []
+    for event, elem in cElementTree.iterparse(path, ('start', 'end')):
+        if event == 'start':
+            parents.append(elem)
+            continue
+        parents.pop()
+        if elem.tag != 'post':
+            continue
+        post = {'id' : elem.get('id'), 'slug' : elem.get('slug'),
+                'type' : elem.get('type'), 'date' : elem.get('date-gmt'),
+                'timestamp' : elem.get('unix-timestamp'),
+                'format' : elem.get('format'),
+                'state' : 'private' if elem.get('private') == 'true'
+                          else elem.get('state'),
+                'title' : elem.findtext('regular-title'),
+                'body' : elem.findtext('regular-body'),
+                'tags' : [tag.text for tag in elem.findall('tag')]}
+        ## parsed posts are dropped, so memory stays flat
+        if parents:
+            parents[-1].remove(elem)
+        yield post
+
+def _tumblr_json(path):
+    with io.open(path, encoding='utf-8') as f:
+        buf = f.read(CHUNK)
+        start = buf.lstrip()[:1]
+        if start == u"[":
+            pos = buf.index(u"[") + 1
+        elif start == u"{":
+            ## an api response, the posts follow a short header
+            m = _posts_key_re.search(buf)
+            while not m:
+                more = f.read(CHUNK)
+                if not more:
+                    raise ValueError("No posts in {}".format(path))
+                buf += more
+                m = _posts_key_re.search(buf)
+            pos = m.end()
+        else:
+            raise ValueError("Not a json archive: {}".format(path))
+        for post in _json_array(f, buf, pos):
+            yield post
+
+def _json_array(f, buf, pos):
+    """Yields the elements of the json array whose
+    first element starts at buf[pos], reading f as needed
+    """
+    decoder = json.JSONDecoder()
+    chunk = CHUNK
+    while True:
+        pos = _separator_re.match(buf, pos).end()
+        if pos < len(buf) and buf[pos] == u"]":
+            return
+        try:
+            if pos == len(buf):
+                raise ValueError("need more")
+            element, pos = decoder.raw_decode(buf, pos)
+        except ValueError:
+            more = f.read(chunk)
+            if not more:
+                raise ValueError("Truncated json archive")
+            buf = buf[pos:] + more
+            pos = 0
+            ## a big element, don't decode it over and over
+            chunk *= 2
+            continue
+        chunk = CHUNK
+        yield element
+
+def _json_lines(path):
+    with io.open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
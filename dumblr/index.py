@@ -0,0 +1,144 @@
+import cPickle
+import hashlib
+import os
+import time
+from timings import count
+
+## mtimes this close to the last save cannot be trusted
+## (the file may have changed again within the same tick)
+RACY_WINDOW = 2.0
+
+## below this many changed files, a process pool costs more than it saves
+PARALLEL_THRESHOLD = 500
+
+class PostIndex(object):
+    """Persistent cache of parsed posts in the posts directory.
+
+    Entries are keyed by file name and hold the mtime, size and
+    sha1 of the file along with the parsed post. A file is only
+    read again when its mtime or size changed, and only parsed
+    again when its content did.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.indexed_at = 0
+        self.dirty = False
+
+        if os.path.isfile(path):
+            try:
+                with open(path, 'rb') as f:
+                    d = cPickle.load(f)
+                self.entries = d['entries']
+                self.indexed_at = d['indexed_at']
+            except Exception:
+                ## corrupt or from an older dumblr, start over
+                self.dirty = True
+
+    def refresh(self, posts_path, parse, workers=None, names=None):
+        """Brings the index up to date with posts_path.
+
+        `parse` turns the text of a file into a post (or None).
+        It has to be a module level function, since more than
+        PARALLEL_THRESHOLD changed files are parsed on a pool of
+        `workers` processes (one per core by default).
+
+        Only the files in `names` are looked at if given, and the
+        entries of other files are left alone.
+
+        Returns the (name, post) of every file, sorted by name.
+        """
+        listed = []
+        if os.path.isdir(posts_path):
+            listed = [f for f in (os.listdir(posts_path) if names is None
+                                  else names)
+                      ## dotfiles are editor and temporary files
+                      if not f.startswith(".") and
+                      os.path.isfile(os.path.join(posts_path, f))]
+        listed = sorted(listed)
+
+        gone = set(self.entries if names is None else names) - set(listed)
+        for name in gone.intersection(self.entries):
+            del self.entries[name]
+            self.dirty = True
+        names = listed
+
+        stats = [os.stat(os.path.join(posts_path, name)) for name in names]
+        stale = [(name, st) for name, st in zip(names, stats)
+                 if not self.fresh(name, st)]
+
+        jobs = [(os.path.join(posts_path, name),
+                 self.entries.get(name, {}).get('hash'),
+                 parse) for name, _ in stale]
+        count('index.hit', len(names) - len(stale))
+        count('index.miss', len(stale))
+        results = read_all(jobs, workers)
+
+        for (name, st), (digest, post, parsed) in zip(stale, results):
+            count('files.parsed', parsed)
+            entry = self.entries.get(name) if not parsed else None
+            entry = entry or {'hash' : digest, 'post' : post}
+            entry.update({'mtime' : st.st_mtime, 'size' : st.st_size})
+            self.entries[name] = entry
+            self.dirty = True
+
+        return [(name, self.entries[name]['post']) for name in names]
+
+    def fresh(self, name, st):
+        """Whether the entry of a file can be trusted without reading it
+        """
+        entry = self.entries.get(name)
+        return (entry is not None and entry['mtime'] == st.st_mtime and
+                entry['size'] == st.st_size and
+                st.st_mtime < self.indexed_at - RACY_WINDOW)
+
+    def save(self):
+        if not self.dirty:
+            return
+        self.indexed_at = time.time()
+        with open(self.path, 'wb') as f:
+            cPickle.dump({'entries' : self.entries,
+                          'indexed_at' : self.indexed_at},
+                         f, cPickle.HIGHEST_PROTOCOL)
+        self.dirty = False
+
+def read_all(jobs, workers=None):
+    """Reads the (file path, known hash, parse) of every job,
+    see _read. More than PARALLEL_THRESHOLD are read on a pool
+    of `workers` processes (one per core by default).
+    """
+    count('files.read', len(jobs))
+    if len(jobs) > PARALLEL_THRESHOLD:
+        ## slow to import, and rarely needed
+        from multiprocessing import Pool, cpu_count
+        workers = workers or cpu_count()
+    if len(jobs) > PARALLEL_THRESHOLD and workers > 1:
+        pool = Pool(workers)
+        try:
+            ## chunks keep the pickling overhead down,
+            ## imap keeps the order
+            chunksize = max(1, len(jobs) // (workers * 4))
+            return list(pool.imap(_read, jobs, chunksize))
+        finally:
+            pool.close()
+            pool.join()
+    return map(_read, jobs)
+
+def _read(job):
+    """Reads and hashes a file, parsing it
+    only if its hash changed
+
+    Returns (hash, post, parsed)
+    """
+    filepath, known, parse = job
+    with open(filepath, 'rb') as f:
+        raw = f.read()
+    digest = hashlib.sha1(raw).hexdigest()
+
+    if digest == known:
+        return digest, None, False
+    try:
+        post = parse(raw.decode('utf-8'))
+    except ValueError:
+        post = None
+    return digest, post, True
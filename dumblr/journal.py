@@ -0,0 +1,167 @@
+"""What a push is doing, so that an interrupted push can be finished.
+
+.dumblr/PUSH is a journal of json lines: first the changes the push
+plans to make, then a line for every change as it is sent and
+another as it is answered. A push that finishes removes it, one that
+is cut short leaves it for the next push to reconcile.
+
+.dumblr/POSTED holds the times of the posts created lately, for the
+whole account, so pushes stay within the posts tumblr takes a day.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+## new posts tumblr takes from an account in a day
+DAILY_POST_LIMIT = 250
+DAY = 24 * 60 * 60
+
+class Journal(object):
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._f = None
+
+    def start(self, changes):
+        """Records the changes about to be pushed
+        """
+        self._f = open(self.path, 'wb')
+        self._append({'plan' : [{'action' : c['action'], 'post' : c['post']}
+                                for c in changes]})
+
+    def sent(self, i):
+        self._append({'sent' : i})
+
+    def done(self, i, status):
+        self._append({'done' : i, 'status' : status})
+
+    def _append(self, record):
+        ## every line must be on disk before the request it records
+        with self.lock:
+            self._f.write(json.dumps(record) + "\n")
+            self._f.flush()
+            os.fsync(self._f.fileno())
+
+    def load(self):
+        """The planned changes, the indices of those that were sent
+        and the status of those that were answered, by index.
+
+        Raises IOError if there is no journal.
+        """
+        changes, sent, statuses = [], set(), {}
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    ## cut short while writing it
+                    break
+                if 'plan' in record:
+                    changes = record['plan']
+                elif 'sent' in record:
+                    sent.add(record['sent'])
+                elif 'done' in record:
+                    statuses[record['done']] = record['status']
+        return changes, sent, statuses
+
+    def remove(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+class PostQuota(object):
+    """The posts tumblr still takes today. Thread safe, see post_quota.
+
+    POSTED is read again, under a lock, every time it is counted
+    from, so processes pushing at once (a daemon and the command
+    line) see each other's posts.
+    """
+    def __init__(self, path, limit=None):
+        self.path = path
+        self.limit = limit or DAILY_POST_LIMIT
+        self.lock = threading.Lock()
+        self.posted = []
+        ## times of the posts counted by this process
+        self.taken = []
+        self._load()
+
+    @contextmanager
+    def _locked(self):
+        with self.lock:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                yield
+                return
+            with open("{}.lock".format(self.path), 'ab') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    self._load()
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                self.posted = json.load(f)
+        except (IOError, ValueError):
+            pass
+
+    def _expire(self):
+        since = time.time() - DAY
+        self.posted = [t for t in self.posted if t > since]
+
+    def take(self):
+        """Counts a post about to be created, False if
+        there is no room left for it today
+        """
+        with self._locked():
+            self._expire()
+            if len(self.posted) >= self.limit:
+                return False
+            self.taken.append(time.time())
+            self.posted.append(self.taken[-1])
+            self._save()
+            return True
+
+    def give_back(self):
+        """Uncounts a post that was not created after all
+        """
+        with self._locked():
+            if not self.taken:
+                return
+            taken = self.taken.pop()
+            if taken in self.posted:
+                self.posted.remove(taken)
+                self._save()
+
+    def resets(self):
+        """When the next post may be created, in seconds since the epoch
+        """
+        with self._locked():
+            self._expire()
+            if len(self.posted) < self.limit:
+                return time.time()
+            return sorted(self.posted)[-self.limit] + DAY
+
+    def _save(self):
+        if not os.path.isdir(os.path.dirname(self.path)):
+            return
+        tmp = "{}.tmp".format(self.path)
+        with open(tmp, 'wb') as f:
+            json.dump(self.posted, f)
+        os.rename(tmp, self.path)
+
+## one quota per account, shared by the blogs pushed at once
+_quotas = {}
+_quotas_lock = threading.Lock()
+
+def post_quota(path):
+    with _quotas_lock:
+        if path not in _quotas:
+            _quotas[path] = PostQuota(path)
+        return _quotas[path]
@@ -0,0 +1,59 @@
+"""Which posts status, diff and push are about.
+
+A post is in scope if its file matches one of the patterns, its id
+is one of the ids and it has one of the tags, each only when given.
+Patterns are globs of file names in the posts directory, so a scope
+picks its files before any of them is read.
+"""
+import os
+from fnmatch import fnmatchcase
+from exceptions import DumblrException
+
+class Scope(object):
+    def __init__(self, patterns=(), ids=(), tags=()):
+        self.patterns = list(patterns)
+        self.ids = set(ids)
+        self.tags = set(tags)
+
+    @classmethod
+    def from_paths(cls, posts_path, paths=(), ids=(), tags=()):
+        """A scope of `paths` and globs as given on the command line,
+        relative to the current directory
+        """
+        patterns = []
+        for path in paths:
+            full = os.path.abspath(path)
+            if full == os.path.abspath(posts_path):
+                patterns.append("*")
+                continue
+            pattern = os.path.relpath(full, posts_path)
+            if pattern.startswith(os.pardir) or os.sep in pattern:
+                ## a bare name is a post of the posts directory
+                if os.path.dirname(path):
+                    raise DumblrException(
+                        "Not a post of {}: {}".format(posts_path, path))
+                pattern = path
+            patterns.append(pattern)
+        return cls(patterns, ids, tags)
+
+    def __nonzero__(self):
+        return bool(self.patterns or self.ids or self.tags)
+
+    def to_dict(self):
+        return {'patterns' : self.patterns, 'ids' : sorted(self.ids),
+                'tags' : sorted(self.tags)}
+
+    def match_name(self, name):
+        return (not self.patterns or
+                any(fnmatchcase(name, pattern) for pattern in self.patterns))
+
+    def match(self, post, name):
+        """Whether a post, held in the file `name`, is in scope
+        """
+        if not self.match_name(name):
+            return False
+        if self.ids and post.get('id') not in self.ids:
+            return False
+        if self.tags and not self.tags.intersection(post.get('tags') or []):
+            return False
+        return True
@@ -0,0 +1,217 @@
+"""Inverted index of the posts in the fs, .dumblr/SEARCH.
+
+An sqlite database of two tables:
+
+    posts (name, mtime, size, hash, id, title, date, state, format, tags)
+    terms (term, post)
+
+with a row in terms for every distinct term of a post: the words of
+its title and body, lowercased, and tag:<tag>, state:<state> and
+format:<format>. A query intersects the posts of its terms, so it
+reads a few pages of the database however many posts there are.
+
+Like the post index, only files whose mtime or size changed are
+read again, and only parsed again if their content did. Files that
+are not posts are kept with no id, so they are not read again either.
+"""
+import json
+import os
+import re
+import sqlite3
+import time
+import frontmatter
+import index
+from timings import count
+
+## words shorter than this are left out of the index
+MIN_WORD = 2
+## and longer ones are cut
+MAX_WORD = 40
+
+_word_re = re.compile(ur'\w+', re.UNICODE)
+## sorts after every term starting with a prefix
+_LAST = unichr(0xffff)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    name TEXT UNIQUE, mtime REAL, size INTEGER, hash TEXT,
+    id INTEGER, title TEXT, date TEXT, state TEXT, format TEXT, tags TEXT);
+CREATE INDEX IF NOT EXISTS posts_date ON posts (date);
+CREATE TABLE IF NOT EXISTS terms (
+    term TEXT, post INTEGER, PRIMARY KEY (term, post)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS terms_post ON terms (post);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+"""
+
+## what a query returns of every post, newest first
+COLUMNS = ['name', 'id', 'title', 'date', 'state', 'format', 'tags']
+
+def words(text):
+    """The distinct words of a text, as they are indexed
+    """
+    return set(word[:MAX_WORD] for word in _word_re.findall(text.lower())
+               if len(word) >= MIN_WORD)
+
+def query_terms(words):
+    """The terms and prefixes a query of `words` looks for. Words
+    ending in * match the words they start
+    """
+    terms, prefixes = [], []
+    for word in words:
+        tokens = _word_re.findall(word.lower())
+        if word.endswith(u"*") and tokens:
+            prefixes.append(tokens.pop()[:MAX_WORD])
+        ## words too short to be indexed would match nothing
+        terms.extend(token[:MAX_WORD] for token in tokens
+                     if len(token) >= MIN_WORD)
+    return terms, prefixes
+
+def parse_doc(text):
+    """The search index parser of posts: its columns and terms
+    """
+    post = frontmatter.loads(text)
+    tags = [unicode(tag) for tag in post.get('tags') or []]
+    terms = words(u"{}\n{}".format(post.get('title') or u"",
+                                   post.get('body') or u""))
+    terms.update(u"tag:{}".format(tag.lower()) for tag in tags)
+    terms.add(u"state:{}".format(post.get('state')))
+    terms.add(u"format:{}".format(post.get('format')))
+    return {'id' : post.get('id'), 'title' : post.get('title'),
+            'date' : unicode(post.get('date') or u""),
+            'state' : post.get('state'), 'format' : post.get('format'),
+            'tags' : json.dumps(tags), 'terms' : sorted(terms)}
+
+class SearchIndex(object):
+    def __init__(self, path):
+        self.path = path
+        try:
+            self.db = self._open()
+        except sqlite3.DatabaseError:
+            ## corrupt, it is only a cache
+            os.remove(path)
+            self.db = self._open()
+
+    def _open(self):
+        db = sqlite3.connect(self.path)
+        ## a crash costs a rebuild at worst
+        db.execute("PRAGMA synchronous = OFF")
+        db.executescript(SCHEMA)
+        return db
+
+    def close(self):
+        self.db.close()
+
+    def refresh(self, posts_path, workers=None, names=None):
+        """Brings the index up to date with posts_path, or with
+        the files in `names` only if given
+        """
+        known = self._known(names)
+        row = self.db.execute(
+            "SELECT value FROM meta WHERE key = 'indexed_at'").fetchone()
+        indexed_at = row[0] if row else 0
+
+        listed = []
+        if os.path.isdir(posts_path):
+            listed = [f for f in (os.listdir(posts_path) if names is None
+                                  else names)
+                      ## dotfiles are editor and temporary files
+                      if not f.startswith(".") and
+                      os.path.isfile(os.path.join(posts_path, f))]
+        gone = set(known if names is None else names) - set(listed)
+        gone.intersection_update(known)
+
+        stale = []
+        for name in listed:
+            st = os.stat(os.path.join(posts_path, name))
+            entry = known.get(name)
+            if (entry is None or entry[1] != st.st_mtime or
+                entry[2] != st.st_size or
+                st.st_mtime >= indexed_at - index.RACY_WINDOW):
+                stale.append((name, st))
+        count('search.hit', len(listed) - len(stale))
+        count('search.miss', len(stale))
+        if not (gone or stale):
+            return False
+
+        jobs = [(os.path.join(posts_path, name),
+                 (known.get(name) or (None,) * 4)[3], parse_doc)
+                for name, _ in stale]
+        results = index.read_all(jobs, workers)
+        for (name, st), (digest, doc, parsed) in zip(stale, results):
+            if not parsed:
+                self.db.execute(
+                    "UPDATE posts SET mtime = ?, size = ? WHERE name = ?",
+                    (st.st_mtime, st.st_size, name))
+                continue
+            count('search.parsed')
+            if name in known:
+                self._remove(known[name][0])
+            doc = doc or {'terms' : []}
+            rowid = self.db.execute(
+                "INSERT INTO posts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, st.st_mtime, st.st_size, digest, doc.get('id'),
+                 doc.get('title'), doc.get('date'), doc.get('state'),
+                 doc.get('format'), doc.get('tags'))).lastrowid
+            self.db.executemany("INSERT INTO terms VALUES (?, ?)",
+                                ((term, rowid) for term in doc['terms']))
+        for name in gone:
+            self._remove(known[name][0])
+
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('indexed_at', ?)",
+                        (time.time(),))
+        self.db.commit()
+        return True
+
+    def _known(self, names):
+        """(rowid, mtime, size, hash) of the files indexed, by name,
+        of `names` only if given
+        """
+        sql = "SELECT name, rowid, mtime, size, hash FROM posts"
+        if names is None:
+            return dict((row[0], row[1:]) for row in self.db.execute(sql))
+        names = list(names)
+        known = {}
+        ## sqlite takes so many parameters at once
+        for i in range(0, len(names), 500):
+            chunk = names[i:i + 500]
+            known.update((row[0], row[1:]) for row in self.db.execute(
+                "{} WHERE name IN ({})".format(sql, ", ".join("?" * len(chunk))),
+                chunk))
+        return known
+
+    def _remove(self, rowid):
+        self.db.execute("DELETE FROM terms WHERE post = ?", (rowid,))
+        self.db.execute("DELETE FROM posts WHERE rowid = ?", (rowid,))
+
+    def query(self, terms=(), prefixes=(), since=None, until=None):
+        """Posts with every term, a term starting with every
+        prefix, and dated between `since` and `until` (both
+        date prefixes, inclusive). Newest first.
+        """
+        sql = "SELECT {} FROM posts WHERE id IS NOT NULL".format(
+            ", ".join(COLUMNS))
+        args = []
+        subqueries = []
+        for term in terms:
+            subqueries.append("SELECT post FROM terms WHERE term = ?")
+            args.append(term)
+        for prefix in prefixes:
+            subqueries.append(
+                "SELECT post FROM terms WHERE term >= ? AND term < ?")
+            args.extend([prefix, prefix + _LAST])
+        if subqueries:
+            sql += " AND rowid IN ({})".format(" INTERSECT ".join(subqueries))
+        if since:
+            sql += " AND date >= ?"
+            args.append(since)
+        if until:
+            sql += " AND date < ?"
+            args.append(until + _LAST)
+        sql += " ORDER BY date DESC, name"
+
+        posts = []
+        for row in self.db.execute(sql, args):
+            post = dict(zip(COLUMNS, row))
+            post['tags'] = json.loads(post['tags'] or "[]")
+            posts.append(post)
+        return posts
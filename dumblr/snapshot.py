@@ -0,0 +1,206 @@
+"""The snapshot of the blog on tumblr, .dumblr/TUMBLR.
+
+    MAGIC
+    body, body, ...           zlib compressed, utf-8
+    table                     pickled (headers, hashes, spans)
+    table offset              8 bytes, little endian
+
+The table holds every post without its body, the sha1 of its body
+and where the body is, so a snapshot is opened by reading the end
+of the file only. The file is memory mapped and a body is only
+decompressed when it is asked for: comparing posts with the files
+in posts/ needs the table and the hashes, not the bodies.
+
+Snapshots written by older dumblrs (a pickled list of posts) are
+still read, in full.
+"""
+import cPickle
+import hashlib
+import mmap
+import os
+import struct
+import zlib
+from timings import count
+
+MAGIC = "DUMBLR-SNAPSHOT-1\n"
+## snapshots are written on every pull and push, and
+## bodies barely compress better past this
+COMPRESS_LEVEL = 1
+_offset = struct.Struct('<Q')
+
+def body_hash(body):
+    """The hash of a body as the table holds it, None for no body
+    """
+    if body is None:
+        return None
+    if isinstance(body, unicode):
+        body = body.encode('utf-8')
+    return hashlib.sha1(body).hexdigest()
+
+def write(path, posts):
+    """Writes posts to path atomically, one body at a time
+    """
+    writer = Writer(path)
+    try:
+        for post in posts:
+            writer.add(post)
+    except:
+        writer.abort()
+        raise
+    writer.close()
+
+class Writer(object):
+    """Writes a snapshot a post at a time. Nothing replaces
+    the snapshot in `path` until close()
+    """
+    def __init__(self, path):
+        self.path = path
+        self.tmp = os.path.join(os.path.dirname(path),
+                                ".{}.tmp".format(os.path.basename(path)))
+        self.headers, self.hashes, self.spans = [], [], []
+        self._f = open(self.tmp, 'wb')
+        self._f.write(MAGIC)
+        self._offset = len(MAGIC)
+
+    def add(self, post):
+        header = dict(post)
+        body = header.pop('body', None)
+        if body is None:
+            self._add(header, None, None)
+            return
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        self._add(header, body_hash(body),
+                  zlib.compress(body, COMPRESS_LEVEL))
+
+    def copy(self, snapshot, i):
+        """Adds the i-th post of another snapshot,
+        without decompressing its body
+        """
+        self._add(snapshot.headers[i], snapshot.hashes[i], snapshot.raw(i))
+
+    def _add(self, header, digest, data):
+        self.headers.append(header)
+        self.hashes.append(digest)
+        if data is None:
+            self.spans.append(None)
+            return
+        self._f.write(data)
+        self.spans.append((self._offset, len(data)))
+        self._offset += len(data)
+
+    def post(self, i):
+        """The i-th post added so far, body included
+        """
+        post = dict(self.headers[i])
+        if self.spans[i] is None:
+            return post
+        offset, size = self.spans[i]
+        self._f.flush()
+        with open(self.tmp, 'rb') as f:
+            f.seek(offset)
+            post['body'] = zlib.decompress(f.read(size)).decode('utf-8')
+        return post
+
+    def close(self, order=None):
+        """Writes the table, posts in `order` (their indices)
+        if given, and replaces the snapshot
+        """
+        table = (self.headers, self.hashes, self.spans)
+        if order is not None:
+            table = tuple([column[i] for i in order] for column in table)
+        self._f.write(cPickle.dumps(table, cPickle.HIGHEST_PROTOCOL))
+        self._f.write(_offset.pack(self._offset))
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._f.close()
+        os.rename(self.tmp, self.path)
+
+    def abort(self):
+        """Drops what was written, unless close() got through
+        """
+        self._f.close()
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+class Snapshot(object):
+    """The posts of a snapshot. Iterating yields whole posts,
+    `headers` and `hashes` are there without reading any body.
+    """
+    def __init__(self, path):
+        """Raises IOError if there is no snapshot,
+        EOFError if it is empty or cut short
+        """
+        self._map = None
+        self._posts = None
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                f.seek(0)
+                self._load_legacy(f)
+                return
+            size = os.fstat(f.fileno()).st_size
+            if size < len(MAGIC) + _offset.size:
+                raise EOFError("Snapshot cut short: {}".format(path))
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        offset, = _offset.unpack(self._map[-_offset.size:])
+        try:
+            self.headers, self.hashes, self._spans = cPickle.loads(
+                self._map[offset:-_offset.size])
+        except Exception:
+            raise EOFError("Snapshot cut short: {}".format(path))
+
+    def _load_legacy(self, f):
+        self._posts = cPickle.load(f)
+        self.headers = []
+        self.hashes = []
+        for post in self._posts:
+            header = dict(post)
+            self.hashes.append(body_hash(header.pop('body', None)))
+            self.headers.append(header)
+
+    def __len__(self):
+        return len(self.headers)
+
+    def __iter__(self):
+        for i in xrange(len(self.headers)):
+            yield self.post(i)
+
+    def post(self, i):
+        """The i-th post, body included
+        """
+        if self._posts is not None:
+            return dict(self._posts[i])
+        post = dict(self.headers[i])
+        if self._spans[i] is not None:
+            post['body'] = self.body(i)
+        return post
+
+    def raw(self, i):
+        """The compressed body of the i-th post, None for no body
+        """
+        if self._posts is not None:
+            body = self.body(i)
+            if body is None:
+                return None
+            if isinstance(body, unicode):
+                body = body.encode('utf-8')
+            return zlib.compress(body, COMPRESS_LEVEL)
+        span = self._spans[i]
+        if span is None:
+            return None
+        offset, size = span
+        return self._map[offset:offset + size]
+
+    def body(self, i):
+        if self._posts is not None:
+            return self._posts[i].get('body')
+        span = self._spans[i]
+        if span is None:
+            return None
+        offset, size = span
+        count('snapshot.bodies')
+        return zlib.decompress(self._map[offset:offset + size]).decode('utf-8')
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
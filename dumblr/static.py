@@ -0,0 +1,320 @@
+"""Static site of the posts.
+
+Every published post is rendered to post/<slug>.html, the posts newest
+first to index.html, page/2.html, ... and the posts of every tag to
+tags/<tag>.html.
+
+What was rendered is remembered in .dumblr/BUILD: the hash of the
+file of every post and the hash of what every other page shows.
+Only posts whose file changed and pages whose listing changed are
+rendered again. Pages listing posts only need their headers, which
+are kept in a post index of their own (.dumblr/BUILD_INDEX), so
+only the posts rendered again are read in full. Many posts are
+read and rendered on a process pool.
+
+Markdown posts need the markdown package (dumblr[build]). Without
+it they are rendered as plain paragraphs.
+"""
+import cgi
+import cPickle
+import hashlib
+import os
+import re
+import frontmatter
+from timings import count, span
+from utils import BatchWriter
+
+## posts per index page
+PAGE_SIZE = 20
+
+## below this many posts to render, a process pool costs more than it saves
+PARALLEL_THRESHOLD = 64
+
+PAGE = u"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<link rel="stylesheet" href="{root}style.css">
+</head>
+<body>
+<header><a href="{root}index.html">{blog}</a></header>
+{content}
+</body>
+</html>
+"""
+
+POST = u"""<article>
+<h1>{title}</h1>
+<time>{date}</time>
+{body}
+<ul class="tags">{tags}</ul>
+</article>"""
+
+LISTING = u"""<h1>{title}</h1>
+<ul class="posts">
+{items}
+</ul>
+{nav}"""
+
+ITEM = u"""<li><a href="{root}{page}">{title}</a> <time>{date}</time></li>"""
+
+TAG = u"""<li><a href="{root}tags/{page}">{tag}</a></li>"""
+
+STYLE = u"""body { max-width: 40em; margin: 2em auto; font-family: sans-serif; }
+time { color: #888; }
+ul.tags li { display: inline; margin-right: 1em; }
+"""
+
+_paragraph_re = re.compile(ur'\n\s*\n')
+
+class Site(object):
+    def __init__(self, path, cache_path, blog):
+        """Builds to `path`, remembering what
+        was built in `cache_path`
+        """
+        self.path = path
+        self.cache_path = cache_path
+        self.blog = blog
+        ## everything depends on the templates and the renderer
+        self.version = hashlib.sha1(u"\0".join(
+            [PAGE, POST, LISTING, ITEM, TAG, STYLE, blog,
+             unicode(_markdown() is not None)]).encode('utf-8')).hexdigest()
+        self.tags = {}
+
+    def build(self, entries, workers=None):
+        """Brings the site up to date with `entries`, the
+        (file path, file hash, header) of every post.
+
+        Returns the pages that were rendered, the number of
+        pages left alone, and the pages that were removed.
+        """
+        cache = self.load_cache()
+        old_posts, old_pages = cache['posts'], cache['pages']
+        ## {page : (file hash, what pages listing it show)}
+        posts = {}
+        headers = []
+        jobs = []
+
+        for path, digest, post in entries:
+            if post.get('state', 'published') != 'published':
+                continue
+            page = self.post_page(post, path, posts)
+            posts[page] = (digest, (_date(post), post.get('title'),
+                                    tuple(post.get('tags', []))))
+            headers.append((page, post))
+            if old_posts.get(page, (None,))[0] != digest:
+                jobs.append((page, path, self.blog, self.tag_pages(post)))
+        count('render.hit', len(posts) - len(jobs))
+        count('render.miss', len(jobs))
+
+        with span('render'):
+            rendered = self.render_posts(jobs, workers)
+
+        ## pages listing posts only change with what they list,
+        ## which edits of bodies leave alone
+        pages = old_pages
+        if not old_pages or any(old_posts.get(page, (None, None))[1] != listed
+                                for page, (_, listed) in posts.iteritems()) \
+           or len(old_posts) != len(posts):
+            pages = {}
+            listings = [(u"style.css", STYLE, lambda : STYLE)]
+            listings += self.index_pages(headers)
+            listings += self.tag_index(headers)
+            for page, key, render in listings:
+                digest = hashlib.sha1(repr(key)).hexdigest()
+                pages[page] = digest
+                if old_pages.get(page) != digest:
+                    rendered.append((page, render().encode('utf-8')))
+                    count('render.miss')
+                else:
+                    count('render.hit')
+
+        with span('write'):
+            writer = BatchWriter()
+            for page, data in rendered:
+                path = os.path.join(self.path, page)
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                writer.write(path, data)
+            writer.flush()
+
+        removed = sorted((set(old_posts) | set(old_pages)) -
+                         (set(posts) | set(pages)))
+        for page in removed:
+            try:
+                os.remove(os.path.join(self.path, page))
+            except OSError:
+                pass
+
+        count('pages.rendered', len(rendered))
+        if posts != old_posts or pages != old_pages:
+            self.save_cache(posts, pages)
+        return {'rendered' : [page for page, _ in rendered],
+                'unchanged' : len(posts) + len(pages) - len(rendered),
+                'removed' : removed}
+
+    def render_posts(self, jobs, workers):
+        if len(jobs) > PARALLEL_THRESHOLD:
+            ## slow to import, and rarely needed
+            from multiprocessing import Pool, cpu_count
+            workers = workers or cpu_count()
+        if len(jobs) > PARALLEL_THRESHOLD and workers > 1:
+            pool = Pool(workers)
+            try:
+                chunksize = max(1, len(jobs) // (workers * 4))
+                return pool.map(render_post, jobs, chunksize)
+            finally:
+                pool.close()
+                pool.join()
+        return map(render_post, jobs)
+
+    def post_page(self, post, path, taken):
+        """The page of a post, named after its slug as tag pages are
+        after their tags. Slugs of pages already `taken` get a -2,
+        -3, ... suffix.
+        """
+        from core import Dumblr
+        slug = (post.get('slug') or
+                os.path.splitext(os.path.basename(path))[0])
+        slug = Dumblr.slugify(unicode(slug)) or u"post"
+        page = u"post/{}.html".format(slug)
+        n = 1
+        while page in taken:
+            n += 1
+            page = u"post/{}-{}.html".format(slug, n)
+        return page
+
+    def index_pages(self, posts):
+        """(page, key, render) of index.html, page/2.html, ...
+        """
+        listed = sorted(((_date(post), page, post.get('title'))
+                         for page, post in posts), reverse=True)
+        chunks = [listed[i:i + PAGE_SIZE]
+                  for i in range(0, len(listed), PAGE_SIZE)] or [[]]
+        pages = []
+        for n, chunk in enumerate(chunks, 1):
+            page = u"index.html" if n == 1 else u"page/{}.html".format(n)
+            root = u"" if n == 1 else u"../"
+            key = (n, len(chunks), chunk)
+            pages.append((page, key, _listing(self.blog, self.blog, root,
+                                              chunk, n, len(chunks))))
+        return pages
+
+    def tag_index(self, posts):
+        """(page, key, render) of the page of every tag
+        """
+        ## by page, tags may slugify alike
+        tagged = {}
+        for page, post in posts:
+            item = (_date(post), page, post.get('title'))
+            for tag, tag_page in self.tag_pages(post):
+                tagged.setdefault(tag_page, (tag, []))[1].append(item)
+        pages = []
+        for tag_page, (tag, listed) in tagged.iteritems():
+            listed.sort(reverse=True)
+            pages.append((u"tags/{}".format(tag_page), (tag, listed),
+                          _listing(self.blog, tag, u"../", listed)))
+        return pages
+
+    def tag_page(self, tag):
+        ## few tags, on many posts
+        if tag not in self.tags:
+            from core import Dumblr
+            self.tags[tag] = u"{}.html".format(Dumblr.slugify(tag) or u"tag")
+        return self.tags[tag]
+
+    def tag_pages(self, post):
+        return [(tag, self.tag_page(tag)) for tag in post.get('tags', [])]
+
+    def load_cache(self):
+        """The posts and other pages that were built, none if
+        the site is gone or was built by other templates
+        """
+        empty = {'posts' : {}, 'pages' : {}}
+        if not os.path.isdir(self.path) or not os.path.isfile(self.cache_path):
+            return empty
+        try:
+            with open(self.cache_path, 'rb') as f:
+                d = cPickle.load(f)
+        except Exception:
+            return empty
+        if d.get('version') != self.version or d.get('path') != self.path:
+            return empty
+        return d
+
+    def save_cache(self, posts, pages):
+        if not os.path.isdir(os.path.dirname(self.cache_path)):
+            return
+        with open(self.cache_path, 'wb') as f:
+            cPickle.dump({'version' : self.version, 'path' : self.path,
+                          'posts' : posts, 'pages' : pages},
+                         f, cPickle.HIGHEST_PROTOCOL)
+
+def parse_header(text):
+    """The post index parser of builds
+    """
+    return frontmatter.loads(text, header_only=True)
+
+def render_post(job):
+    """Reads a post, returns its (page, html)
+    """
+    page, path, blog, tags = job
+    post = frontmatter.load(path)
+    body = post.get('body', u"")
+    if post.get('format') == 'markdown':
+        body = markdown(body)
+    tags = u"".join(TAG.format(root=u"../", page=tag_page,
+                               tag=cgi.escape(tag))
+                    for tag, tag_page in tags)
+    content = POST.format(title=cgi.escape(post.get('title') or u""),
+                          date=cgi.escape(_date(post)),
+                          body=body, tags=tags)
+    html = PAGE.format(title=cgi.escape(post.get('title') or blog),
+                       root=u"../", blog=cgi.escape(blog), content=content)
+    return page, html.encode('utf-8')
+
+def _date(post):
+    """The date of a post as text, posts are listed by it
+    """
+    return unicode(post.get('date') or u"")
+
+def _listing(blog, title, root, listed, n=1, pages=1):
+    """Renders a page listing posts, lazily
+    """
+    def render():
+        items = u"\n".join(ITEM.format(root=root, page=page,
+                                       title=cgi.escape(post_title or page),
+                                       date=cgi.escape(date))
+                           for date, page, post_title in listed)
+        nav = []
+        if n > 1:
+            nav.append(u'<a href="{}">newer</a>'.format(
+                u"../index.html" if n == 2 else u"{}.html".format(n - 1)))
+        if n < pages:
+            nav.append(u'<a href="{}page/{}.html">older</a>'.format(
+                u"" if n == 1 else u"../", n + 1))
+        content = LISTING.format(title=cgi.escape(title), items=items,
+                                 nav=u" ".join(nav))
+        return PAGE.format(title=cgi.escape(title), root=root,
+                           blog=cgi.escape(blog), content=content)
+    return render
+
+def markdown(text):
+    md = _markdown()
+    if md is not None:
+        return md.markdown(text)
+    return u"\n".join(u"<p>{}</p>".format(cgi.escape(p.strip()))
+                      for p in _paragraph_re.split(text) if p.strip())
+
+## the markdown module, False until looked for
+_md = False
+
+def _markdown():
+    global _md
+    if _md is False:
+        try:
+            import markdown as _md
+        except ImportError:
+            _md = None
+    return _md
@@ -0,0 +1,191 @@
+import cPickle
+import datetime
+import hashlib
+import json
+import os
+import zlib
+from timings import count
+
+## loose objects are packed once there are this many
+PACK_THRESHOLD = 256
+
+class ObjectStore(object):
+    """Content addressed store of post revisions.
+
+    Every unique revision of a post is stored once, zlib compressed,
+    under the sha1 of its canonical json. New objects are written
+    loose (objects/ab/cdef...) and later moved into packs
+    (packs/pack-<sha1>.pack) indexed by a pickled {hash: (offset, size)}.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.objects_path = os.path.join(path, "objects")
+        self.packs_path = os.path.join(path, "packs")
+        self._packs = None
+
+    @staticmethod
+    def serialize(post):
+        return json.dumps(post, sort_keys=True, separators=(',', ':'))
+
+    def put(self, post):
+        """Stores a post revision and returns its hash
+        """
+        data = ObjectStore.serialize(post)
+        digest = hashlib.sha1(data).hexdigest()
+        if self.has(digest):
+            count('objects.hit')
+        else:
+            count('objects.miss')
+            loose = self._loose_path(digest)
+            if not os.path.isdir(os.path.dirname(loose)):
+                os.makedirs(os.path.dirname(loose))
+            with open(loose + ".tmp", 'wb') as f:
+                f.write(zlib.compress(data))
+            os.rename(loose + ".tmp", loose)
+        return digest
+
+    def get(self, digest):
+        loose = self._loose_path(digest)
+        if os.path.isfile(loose):
+            with open(loose, 'rb') as f:
+                return json.loads(zlib.decompress(f.read()))
+
+        for pack, idx in self.packs():
+            if digest in idx:
+                offset, size = idx[digest]
+                with open(pack, 'rb') as f:
+                    f.seek(offset)
+                    return json.loads(zlib.decompress(f.read(size)))
+        raise KeyError(digest)
+
+    def has(self, digest):
+        return (os.path.isfile(self._loose_path(digest)) or
+                any(digest in idx for _, idx in self.packs()))
+
+    def loose(self):
+        """Hashes of every loose object
+        """
+        if not os.path.isdir(self.objects_path):
+            return []
+        return [d + f for d in sorted(os.listdir(self.objects_path))
+                for f in sorted(os.listdir(os.path.join(self.objects_path, d)))
+                if not f.endswith(".tmp")]
+
+    def packs(self):
+        """(pack path, index) of every pack
+        """
+        if self._packs is None:
+            self._packs = []
+            if os.path.isdir(self.packs_path):
+                for f in sorted(os.listdir(self.packs_path)):
+                    if f.endswith(".idx"):
+                        with open(os.path.join(self.packs_path, f), 'rb') as i:
+                            idx = cPickle.load(i)
+                        pack = os.path.join(self.packs_path, f[:-4] + ".pack")
+                        self._packs.append((pack, idx))
+        return self._packs
+
+    def pack(self):
+        """Moves every loose object into a new pack.
+        Returns the number of objects packed.
+        """
+        digests = self.loose()
+        if not digests:
+            return 0
+        if not os.path.isdir(self.packs_path):
+            os.makedirs(self.packs_path)
+
+        name = "pack-" + hashlib.sha1("".join(digests)).hexdigest()
+        pack = os.path.join(self.packs_path, name + ".pack")
+        idx = {}
+        with open(pack + ".tmp", 'wb') as f:
+            for digest in digests:
+                with open(self._loose_path(digest), 'rb') as l:
+                    data = l.read()
+                idx[digest] = (f.tell(), len(data))
+                f.write(data)
+        with open(pack[:-5] + ".idx.tmp", 'wb') as f:
+            cPickle.dump(idx, f, cPickle.HIGHEST_PROTOCOL)
+
+        ## the pack must be in place before its index
+        os.rename(pack + ".tmp", pack)
+        os.rename(pack[:-5] + ".idx.tmp", pack[:-5] + ".idx")
+        self._packs = None
+
+        for digest in digests:
+            os.remove(self._loose_path(digest))
+        for d in os.listdir(self.objects_path):
+            os.rmdir(os.path.join(self.objects_path, d))
+        return len(digests)
+
+    def _loose_path(self, digest):
+        return os.path.join(self.objects_path, digest[:2], digest[2:])
+
+class History(object):
+    """Manifests of post id to revision hash, one per recorded
+    snapshot, kept in manifests/ next to the object store
+    """
+    def __init__(self, path):
+        self.store = ObjectStore(path)
+        self.manifests_path = os.path.join(path, "manifests")
+
+    def record(self, posts, source):
+        """Stores every post of a snapshot and a manifest
+        pointing to them. Returns the manifest number.
+        """
+        if not os.path.isdir(self.manifests_path):
+            os.makedirs(self.manifests_path)
+
+        manifests = self.manifests()
+        number = manifests[-1] + 1 if manifests else 1
+        manifest = {'number' : number,
+                    'time' : "{} GMT".format(datetime.datetime.utcnow()),
+                    'source' : source,
+                    'posts' : [(post['id'], self.store.put(post))
+                               for post in posts]}
+        with open(self._manifest_path(number), 'wb') as f:
+            cPickle.dump(manifest, f, cPickle.HIGHEST_PROTOCOL)
+
+        if len(self.store.loose()) >= PACK_THRESHOLD:
+            self.store.pack()
+        return number
+
+    def manifests(self):
+        """Numbers of every recorded manifest, oldest first
+        """
+        if not os.path.isdir(self.manifests_path):
+            return []
+        return sorted(int(f) for f in os.listdir(self.manifests_path)
+                      if f.isdigit())
+
+    def manifest(self, number):
+        with open(self._manifest_path(number), 'rb') as f:
+            return cPickle.load(f)
+
+    def checkout(self, number):
+        """Posts of a manifest, as they were recorded
+        """
+        return [self.store.get(digest)
+                for _, digest in self.manifest(number)['posts']]
+
+    def log(self, post_id):
+        """Every distinct revision of a post, oldest first.
+
+        Each revision is the manifest it first showed up in
+        and its hash. A revision of None means the post was gone.
+        """
+        revisions = []
+        last = None
+        for number in self.manifests():
+            manifest = self.manifest(number)
+            digest = dict(manifest['posts']).get(post_id)
+            if digest != last and (digest or last):
+                revisions.append({'manifest' : number,
+                                  'time' : manifest['time'],
+                                  'source' : manifest['source'],
+                                  'hash' : digest})
+            last = digest
+        return revisions
+
+    def _manifest_path(self, number):
+        return os.path.join(self.manifests_path, "{:06d}".format(number))
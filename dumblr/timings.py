@@ -0,0 +1,170 @@
+"""Phase timings and counters of a dumblr run.
+
+Code marks its phases with `span` and counts what it does with
+`count`. Nothing is recorded until `enable` is called, so both
+are close to free otherwise.
+
+    with span('status'):
+        with span('dump'):
+            count('files.parsed', len(stale))
+
+Spans of the same name under the same parent are merged, and
+count how often they were entered. Counts go to the innermost
+open span of the thread. Threads that open spans of their own
+nest them under the innermost span of the main thread, and
+threads that do not (worker pools) count into it. Pairs of
+counters named `x.hit` and `x.miss` are reported as hit rates.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+class Span(object):
+    def __init__(self, name):
+        self.name = name
+        self.elapsed = 0.0
+        self.calls = 0
+        self.counts = {}
+        self.children = []
+
+    def child(self, name):
+        for c in self.children:
+            if c.name == name:
+                return c
+        c = Span(name)
+        self.children.append(c)
+        return c
+
+    def to_dict(self):
+        return {'name' : self.name,
+                'elapsed' : self.elapsed,
+                'calls' : self.calls,
+                'counts' : dict(self.counts),
+                'children' : [c.to_dict() for c in self.children]}
+
+class Timings(object):
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.root = Span('dumblr')
+        ## (span, start time) of every open span, innermost last
+        self.stack = [(self.root, None)]
+        ## stacks of other threads, based on the main one
+        self.local = threading.local()
+        self.main = None
+
+    def enable(self):
+        """Starts a fresh recording
+        """
+        self.enabled = True
+        self.root = Span(self.root.name)
+        self.root.calls = 1
+        self.stack = [(self.root, time.time())]
+        self.local = threading.local()
+        self.main = threading.current_thread()
+
+    def disable(self):
+        self.enabled = False
+
+    def _stack(self, own=False):
+        """The span stack of this thread. Unless `own` is set,
+        threads without spans of their own share the main one.
+        """
+        if threading.current_thread() is self.main:
+            return self.stack
+        stack = getattr(self.local, 'stack', None)
+        if stack is None or len(stack) == 1:
+            if not own:
+                return self.stack
+            ## (re)based on where the main thread is now
+            stack = self.local.stack = [self.stack[-1]]
+        return stack
+
+    def start(self, name):
+        if not self.enabled:
+            return
+        with self.lock:
+            stack = self._stack(own=True)
+            span = stack[-1][0].child(name)
+            span.calls += 1
+            stack.append((span, time.time()))
+
+    def stop(self):
+        if not self.enabled:
+            return
+        with self.lock:
+            stack = self._stack()
+            span, started = stack.pop()
+            span.elapsed += time.time() - started
+
+    @contextmanager
+    def span(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop()
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            counts = self._stack()[-1][0].counts
+            counts[name] = counts.get(name, 0) + n
+
+    def finish(self):
+        """Closes every open span, the root included
+        """
+        while len(self.stack) > 1:
+            self.stop()
+        self.root.elapsed = time.time() - self.stack[0][1]
+
+    def report(self):
+        """Lines of the span tree, each with its counters
+        """
+        lines = []
+        def walk(span, depth):
+            calls = " x{}".format(span.calls) if span.calls > 1 else ""
+            lines.append("{}{:<{}} {:>9.3f}s{}".format(
+                "  " * depth, span.name, 32 - 2 * depth, span.elapsed, calls))
+            for line in summarize(span.counts):
+                lines.append("{}  {}".format("  " * depth, line))
+            for c in span.children:
+                walk(c, depth + 1)
+        walk(self.root, 0)
+        return lines
+
+    def to_json(self):
+        return json.dumps(self.root.to_dict(), indent=2, sort_keys=True)
+
+def summarize(counts):
+    """Counter lines, with a hit rate for every hit/miss pair
+    """
+    lines = ["- {} : {}".format(name, counts[name]) for name in sorted(counts)]
+    for name in sorted(counts):
+        if not name.endswith('.hit'):
+            continue
+        prefix = name[:-len('hit')]
+        total = counts[name] + counts.get(prefix + 'miss', 0)
+        if total:
+            lines.append("- {}hit rate : {:.1%}".format(
+                prefix, counts[name] / float(total)))
+    return lines
+
+## the one recorder of this process
+timings = Timings()
+span = timings.span
+count = timings.count
+
+def timed(name):
+    """Decorator, runs the function in a span
+    """
+    def decorator(f):
+        @wraps(f)
+        def g(*args, **kwargs):
+            with span(name):
+                return f(*args, **kwargs)
+        return g
+    return decorator
@@ -0,0 +1,156 @@
+import json
+import re
+import threading
+import time
+from collections import namedtuple
+from requests.adapters import HTTPAdapter
+from requests_oauthlib import OAuth1Session
+from timings import count
+
+## enough connections for every fetch/push worker
+POOL_SIZE = 8
+
+Consumer = namedtuple('Consumer', ['key', 'secret'])
+
+class SessionRequest(object):
+    """Drop-in replacement for pytumblr's TumblrRequest.
+
+    pytumblr opens a new httplib2 connection for every call. We sign
+    every call on a single OAuth1Session instead, so connections are
+    kept alive and pooled across threads. Every call is counted in
+    self.stats. With a cache.ResponseCache in self.cache, reads are
+    answered from it and writes drop what it holds of their blog.
+    """
+    def __init__(self, ckey, skey, oauth, oauth_s,
+                 host="https://api.tumblr.com"):
+        self.host = host
+        ## pytumblr reads consumer.key to inject api_key
+        self.consumer = Consumer(ckey, skey)
+        self.session = OAuth1Session(ckey,
+                                     client_secret=skey,
+                                     resource_owner_key=oauth,
+                                     resource_owner_secret=oauth_s)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.stats = Stats()
+        ## a RateLimiter, or None for no limit
+        self.limiter = None
+        ## a ResponseCache, or None for no cache
+        self.cache = None
+
+    def get(self, url, params):
+        cache = self.cache
+        if cache:
+            resp = cache.get(url, params)
+            if resp is not None:
+                return resp
+        resp = self._send("GET", url, params=params)
+        ## failures carry 'meta', see json_parse
+        if cache and not (isinstance(resp, dict) and 'meta' in resp):
+            cache.put(url, params, resp)
+        return resp
+
+    def post(self, url, params={}, files=[]):
+        files = [(key, (filename, value)) for key, filename, value in files]
+        if self.cache:
+            self.cache.invalidate(url)
+        try:
+            return self._send("POST", url, data=params, files=files or None)
+        finally:
+            ## reads that raced the write may have cached the old posts
+            if self.cache:
+                self.cache.invalidate(url)
+
+    def _send(self, method, url, **kwargs):
+        if self.limiter:
+            self.limiter.wait()
+        start = time.time()
+        resp = self.session.request(method, self.host + url,
+                                    allow_redirects=False, **kwargs)
+        sent = resp.request.body or ''
+        self.stats.add(method, url, len(sent), len(resp.content),
+                       time.time() - start)
+        return self.json_parse(resp.content)
+
+    def json_parse(self, content):
+        """Same contract as pytumblr: the 'response' on success,
+        the whole payload (with 'meta') otherwise
+        """
+        try:
+            data = json.loads(content)
+        except ValueError:
+            data = {'meta' : {'status' : 500, 'msg' : 'Server Error'},
+                    'response' : {'error' : "Malformed JSON or HTML was returned."}}
+
+        if data['meta']['status'] in [200, 201, 301]:
+            return data['response']
+        return data
+
+class RateLimiter(object):
+    """Thread safe token bucket: `rate` calls a second,
+    in bursts of up to `burst`
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst or max(1.0, self.rate)
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Blocks until the caller may go ahead
+        """
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            ## callers queue up by taking tokens in advance
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+class Stats(object):
+    """Thread safe request, byte and latency counters per endpoint
+    """
+    _blog_re = re.compile(r'^/v2/blog/[^/]+')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def add(self, method, url, sent, received, latency):
+        endpoint = "{} {}".format(method,
+                                  self._blog_re.sub('/v2/blog/{blog}', url))
+        with self.lock:
+            e = self.endpoints.setdefault(endpoint, {'requests' : 0,
+                                                     'sent' : 0,
+                                                     'received' : 0,
+                                                     'latency' : 0.0})
+            e['requests'] += 1
+            e['sent'] += sent
+            e['received'] += received
+            e['latency'] += latency
+        count('api.requests')
+        count('api.sent', sent)
+        count('api.received', received)
+
+    def totals(self):
+        with self.lock:
+            t = {'requests' : 0, 'sent' : 0, 'received' : 0, 'latency' : 0.0}
+            for e in self.endpoints.itervalues():
+                for k in t:
+                    t[k] += e[k]
+            return t
+
+    def report(self):
+        """One line per endpoint, busiest first
+        """
+        with self.lock:
+            endpoints = sorted(self.endpoints.iteritems(),
+                               key=lambda x : -x[1]['requests'])
+            return ["{}\t{requests} requests\t{sent}B sent\t"
+                    "{received}B received\t{latency:.3f}s".format(k, **e)
+                    for k, e in endpoints]
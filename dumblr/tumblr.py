@@ -1,75 +1,395 @@
 # -*- coding: utf-8 -*-
 import click
+import copy
+import errno
 import pytumblr
+import random
+import socket
+import threading
+import time
+from collections import deque
 from exceptions import DumblrException
 from httplib2 import ServerNotFoundError
-from requests.exceptions import RequestException
+from itertools import islice
+from multiprocessing.pool import ThreadPool
+from requests.exceptions import ConnectionError, ConnectTimeout, RequestException
+from requests.packages.urllib3.exceptions import NewConnectionError
 from requests_oauthlib import OAuth1Session
+from transport import RateLimiter, SessionRequest
+
+## the api never returns more than 20 posts per request
+PAGE_LIMIT = 20
+FETCH_WORKERS = 8
+
+PUSH_WORKERS = 4
+PUSH_RETRIES = 3
+## seconds, doubled on every retry
+PUSH_BACKOFF = 0.5
+## rate limited or tumblr having a bad day
+TRANSIENT_STATUS = (429, 500, 502, 503, 504)
+## a create answered so may have been created anyway,
+## None is a network error once the request went out
+UNANSWERED_STATUS = (None, 500, 502, 503, 504)
+## requests a second of a push, tumblr takes about 300 a minute
+PUSH_RATE = 4
+
+NETWORK_ERRORS = (ServerNotFoundError, RequestException, socket.error)
 
 class Tumblr(object):
-    def __init__(self, ckey, skey, oauth, oauth_s):
+    def __init__(self, ckey, skey, oauth, oauth_s, name=None,
+                 host="https://api.tumblr.com"):
+        """`name` is the blog we push to. If it is not known
+        it is looked up with info() on first use.
+        """
         self.tumblr = pytumblr.TumblrRestClient(ckey, 
                                                 skey,
                                                 oauth,
-                                                oauth_s)
+                                                oauth_s,
+                                                host)
+        ## all calls share one keep-alive session
+        self.tumblr.request = SessionRequest(ckey, skey, oauth, oauth_s, host)
+        self._name = name
+
+    @property
+    def name(self):
+        if not self._name:
+            self._name = self.info()['name']
+        return self._name
+
+    @property
+    def stats(self):
+        """Per endpoint request counters, see transport.Stats
+        """
+        return self.tumblr.request.stats
+
+    def for_blog(self, name):
+        """A client pushing to another blog, sharing this one's
+        connections, counters and rate limit
+        """
+        t = copy.copy(self)
+        t.tumblr = copy.copy(self.tumblr)
+        t._name = name
+        return t
+
+    def limit_rate(self, rate):
+        """Limits this client and the ones sharing it
+        to `rate` requests a second
+        """
+        self.tumblr.request.limiter = RateLimiter(rate)
+
+    def use_cache(self, path, ttl=None):
+        """Answers reads of this client and the ones sharing
+        it from a cache in `path`, see cache.ResponseCache
+        """
+        from cache import CACHE_TTL, ResponseCache
+        self.tumblr.request.cache = ResponseCache(
+            path, CACHE_TTL if ttl is None else ttl)
 
     def info(self):
         """Retrieves blog information of the token holder
         
         Filters out all but the following:
         - 'user' 'name'
+        - the names of the user's 'blogs'
         """
         try:
             d = self.tumblr.info()
-        except ServerNotFoundError as e:
+        except NETWORK_ERRORS as e:
             raise DumblrException(str(e))
-        return {'name' : d['user']['name']}
+        if 'meta' in d:
+            raise DumblrException("{status}: {msg}".format(**d['meta']))
+        return {'name' : d['user']['name'],
+                'blogs' : [b['name'] for b in d['user'].get('blogs', [])]}
+
+    def get_text_posts(self, name, workers=FETCH_WORKERS, since=None):
+        """Retrieves all text posts from tumblr, including drafts,
+        see iter_text_posts
+        """
+        return list(self.iter_text_posts(name, workers, since))
 
-    def get_text_posts(self, name):
-        """Retrieves all text posts from tumblr, including drafts
+    def iter_text_posts(self, name, workers=FETCH_WORKERS, since=None):
+        """Yields every text post on tumblr, published posts newest
+        first and then drafts, a page at a time.
+
+        Published posts are paged by offset. The first page tells us
+        `total_posts`, so up to `workers` pages are fetched ahead
+        while the caller works on the current one. Drafts can only
+        be paged with `before_id`, hence they are walked serially,
+        one page ahead.
+
+        If `since` (a tumblr date string) is given, only published
+        posts dated at or after it are retrieved. Drafts are always
+        retrieved in full.
+        """
+        if since:
+            pages = self._iter_published_since(name, since)
+        else:
+            pages = self._iter_published(name, workers)
+        for page in _network(pages):
+            for post in page:
+                yield Tumblr.normalize(post, 'published')
+
+        for page in _network(self._iter_drafts(name)):
+            ## drafts api call cannot filter by type
+            for post in page:
+                if post['type'] == 'text':
+                    yield Tumblr.normalize(post, 'draft')
+
+    def get_text_post(self, name, id):
+        """Retrieves a single published text post by id.
+
+        Returns None if there is no such post. Drafts cannot
+        be retrieved by id.
         """
         try:
-            pub_posts = self.tumblr.posts(name, type='text', filter='raw')['posts']
-            draft_posts = self.tumblr.drafts(name, filter='raw')['posts']
-        except ServerNotFoundError as e:
+            resp = self.tumblr.posts(name, type='text', id=id, filter='raw')
+        except NETWORK_ERRORS as e:
             raise DumblrException(str(e))
 
-        ## drafts api call cannot filter by type
-        draft_posts = filter(lambda x : x['type'] == 'text', draft_posts)
+        if not resp.get('posts'):
+            return None
+        return Tumblr.normalize(resp['posts'][0], 'published')
 
-        ## remove every key but
-        keeps = ['body', 'date', 'format', 'slug', 'title', 'tags', 'id']
-        pub_posts = [{keep : post[keep] for keep in keeps} for post in pub_posts]
-        draft_posts = [{keep : post[keep] for keep in keeps} for post in draft_posts]
+    def _iter_published(self, name, workers):
+        """Yields every page of published posts
+        """
+        first = self._get_page(name, 0)
+        total = first.get('total_posts', 0)
+        offsets = iter(range(PAGE_LIMIT, total, PAGE_LIMIT))
 
-        ## include state 
-        pub_posts = map(lambda x : dict(x, state='published'), pub_posts)
-        draft_posts = map(lambda x : dict(x, state='draft'), draft_posts)
+        ## posts published while we page shift the offsets,
+        ## so the same post may show up on two pages
+        seen = set()
+        def unseen(page):
+            page = [post for post in page if post['id'] not in seen]
+            seen.update(post['id'] for post in page)
+            return page
+
+        pool = ThreadPool(max(1, workers))
+        try:
+            ahead = deque(pool.apply_async(self._get_page, (name, offset))
+                          for offset in islice(offsets, workers))
+            yield unseen(first['posts'])
+            while ahead:
+                page = ahead.popleft().get()
+                for offset in islice(offsets, 1):
+                    ahead.append(pool.apply_async(self._get_page,
+                                                  (name, offset)))
+                yield unseen(page['posts'])
+        finally:
+            pool.terminate()
+
+    def _iter_published_since(self, name, since):
+        """Yields pages of published posts newer than `since`
+
+        Posts come newest first, so we stop paging at the first
+        post older than `since`. Tumblr dates are always formatted
+        as "YYYY-MM-DD HH:MM:SS GMT" and compare as strings.
+        """
+        def fetch(offset):
+            page = self._get_page(name, offset)['posts']
+            newer = [post for post in page if post['date'] >= since]
+            if len(newer) < len(page) or len(page) < PAGE_LIMIT:
+                return newer, None
+            return newer, offset + PAGE_LIMIT
+        return _ahead(fetch, 0)
+
+    def _get_page(self, name, offset):
+        return Tumblr.check_response(
+            self.tumblr.posts(name, type='text', filter='raw',
+                              offset=offset, limit=PAGE_LIMIT))
+
+    def _iter_drafts(self, name):
+        """Yields every page of drafts by walking back with `before_id`
+        """
+        ## pytumblr's drafts() does not accept before_id
+        url = "/v2/blog/{}/posts/draft".format(Tumblr.blogname(name))
+        def fetch(before_id):
+            params = {'filter' : 'raw'}
+            if before_id is not None:
+                params['before_id'] = before_id
+            resp = Tumblr.check_response(
+                self.tumblr.send_api_request("get", url, params,
+                                             ['filter', 'before_id']))
+            if not resp['posts']:
+                return [], None
+            return resp['posts'], resp['posts'][-1]['id']
+        return _ahead(fetch, None)
+
+    def push_posts(self, changes, workers=PUSH_WORKERS,
+                   retries=PUSH_RETRIES, backoff=PUSH_BACKOFF,
+                   journal=None, quota=None, rate=PUSH_RATE):
+        """Pushes a batch of changes on a pool of `workers` threads.
+
+        Each change is a dict with 'action' and 'post', as returned
+        by Dumblr.status. Transient failures are retried up to
+        `retries` times with exponential backoff and full jitter.
+        Requests are spaced to `rate` a second.
+
+        Creates are only sent again when they surely did not get
+        through: answered with a 429, or the connection failed before
+        the request went out. Any other failure may have created the
+        post anyway, so it is returned unanswered (see unanswered).
+
+        Every change is recorded in `journal` (see journal.Journal)
+        as it is sent and as it is answered. Creates beyond what
+        `quota` (see journal.PostQuota) allows today are not sent,
+        and neither is anything left once tumblr keeps answering 429.
+        Those are deferred to a later push.
+
+        Returns the tumblr response of each change, in order.
+        Failed pushes are returned as the response 'meta'
+        instead of raising, so one bad post does not sink the batch.
+        """
+        if not changes:
+            return []
 
-        ## escape title - it is treated specially since yaml needs to parse it
-        pub_posts = map(lambda x : dict(x, title=repr(x['title'])), pub_posts)
-        draft_posts = map(lambda x : dict(x, title=repr(x['title'])), draft_posts)
+        limiter = RateLimiter(rate) if rate else None
+        limited = threading.Event()
+
+        def push(i):
+            change = changes[i]
+            if limited.is_set():
+                return Tumblr.deferred("rate limited")
+            creates = change['action'] == 'create' and quota is not None
+            if creates and not quota.take():
+                return Tumblr.deferred("daily post limit, until {}".format(
+                    time.strftime("%Y-%m-%d %H:%M:%S GMT",
+                                  time.gmtime(quota.resets()))))
+            if limiter:
+                limiter.wait()
+            if journal:
+                journal.sent(i)
+            resp = self._push_with_retry(change['action'], change['post'],
+                                         retries, backoff)
+            if journal:
+                journal.done(i, resp)
+            if Tumblr.is_transient(resp) and resp['meta']['status'] == 429:
+                limited.set()
+            if creates and not (resp and 'id' in resp or
+                                Tumblr.unanswered(resp)):
+                quota.give_back()
+            return resp
+
+        pool = ThreadPool(max(1, min(workers, len(changes))))
+        try:
+            return pool.map(push, range(len(changes)))
+        finally:
+            pool.close()
+
+    def _push_with_retry(self, action, post, retries, backoff):
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(random.uniform(0, backoff * 2 ** (attempt - 1)))
+            try:
+                ## _send_post mutates the post
+                resp = self._send_post(action, dict(post))
+            except DumblrException as e:
+                ## looking up the blog failed, nothing was sent
+                resp = {'meta' : {'status' : None, 'msg' : str(e)}}
+                continue
+            except NETWORK_ERRORS as e:
+                resp = {'meta' : {'status' : None, 'msg' : str(e)}}
+                if action == 'create' and not _not_sent(e):
+                    return resp
+                continue
+            if not Tumblr.is_transient(resp):
+                return resp
+            if action == 'create' and resp['meta']['status'] != 429:
+                return resp
+        return resp
+
+    def find_created(self, name, posts):
+        """The ids of `posts` if they were created on tumblr,
+        None for those that were not.
+
+        For creates that were sent but never answered. New posts
+        are the newest, so only the first page of posts and of
+        drafts is looked at. Posts are told apart by title and body.
+        """
+        url = "/v2/blog/{}/posts/draft".format(Tumblr.blogname(name))
+        try:
+            recent = self._get_page(name, 0)['posts']
+            recent += Tumblr.check_response(self.tumblr.send_api_request(
+                "get", url, {'filter' : 'raw'}, ['filter']))['posts']
+        except NETWORK_ERRORS as e:
+            raise DumblrException(str(e))
+        ids = dict(((p.get('title'), p.get('body')), p['id'])
+                   for p in reversed(recent))
+        return [ids.get((p.get('title'), p.get('body'))) for p in posts]
 
-        return pub_posts + draft_posts
-    
     def push_post(self, action, post):
         try:
-            info = self.info()
-            
-            if action == 'create':
-                ## we do not include 'id'
-                post.pop('id')
-                return self.tumblr.create_text(info['name'], type='text', 
-                                       **Tumblr.escape_unicode(post))
-            elif action == 'update':
-                return self.tumblr.edit_post(info['name'], type='text',
-                                             **Tumblr.escape_unicode(post))
-            elif action == 'delete':
-                return self.tumblr.delete_post(info['name'], post['id'])
-            return None
-        except ServerNotFoundError as e:
+            return self._send_post(action, post)
+        except NETWORK_ERRORS as e:
             raise DumblrException(str(e))
 
+    def _send_post(self, action, post):
+        name = self.name
+
+        if action == 'create':
+            ## we do not include 'id'
+            post.pop('id')
+            return self.tumblr.create_text(name, type='text',
+                                           **Tumblr.escape_unicode(post))
+        elif action == 'update':
+            return self.tumblr.edit_post(name, type='text',
+                                         **Tumblr.escape_unicode(post))
+        elif action == 'delete':
+            return self.tumblr.delete_post(name, post['id'])
+        return None
+
+    @staticmethod
+    def normalize(post, state):
+        """Keeps only what dumblr tracks of a post
+        """
+        ## remove every key but
+        keeps = ['body', 'date', 'format', 'slug', 'title', 'tags', 'id']
+        post = {keep : post[keep] for keep in keeps}
+
+        ## include state
+        post['state'] = state
+        return post
+
+    @staticmethod
+    def blogname(name):
+        """Same normalization pytumblr applies to blog names
+        """
+        if "." not in name:
+            name += ".tumblr.com"
+        return name
+
+    @staticmethod
+    def check_response(resp):
+        """pytumblr returns the raw 'meta' on failure
+        instead of raising
+        """
+        if 'meta' in resp and 'posts' not in resp:
+            raise DumblrException("{status}: {msg}".format(**resp['meta']))
+        return resp
+
+    @staticmethod
+    def is_transient(resp):
+        """Failed responses carry 'meta', successful ones do not
+        """
+        return (isinstance(resp, dict) and 'meta' in resp and
+                resp['meta'].get('status') in TRANSIENT_STATUS)
+
+    @staticmethod
+    def unanswered(resp):
+        """Whether a create that failed so may have been created,
+        see find_created
+        """
+        return (isinstance(resp, dict) and 'meta' in resp and
+                resp['meta'].get('status') in UNANSWERED_STATUS)
+
+    @staticmethod
+    def deferred(reason):
+        """The response of a change that was not sent
+        """
+        return {'meta' : {'status' : 429, 'deferred' : True,
+                          'msg' : "Deferred, {}".format(reason)}}
+
     @staticmethod
     def escape_unicode(post):
         """pytumblr does not support unicode too well
@@ -127,3 +447,41 @@ class Tumblr(object):
 
         tokens.update({'consumer_key' : ckey, 'secret_key' : skey})
         return tokens
+
+def _ahead(fetch, key):
+    """Yields the pages of `fetch`, which returns a page and the key
+    of the next one (None for no more), fetching the next
+    page while the caller works on this one
+    """
+    pool = ThreadPool(1)
+    try:
+        pending = pool.apply_async(fetch, (key,))
+        while pending:
+            page, key = pending.get()
+            pending = None
+            if key is not None:
+                pending = pool.apply_async(fetch, (key,))
+            yield page
+    finally:
+        pool.terminate()
+
+def _network(pages):
+    """Pages, network errors raised as DumblrException
+    """
+    try:
+        for page in pages:
+            yield page
+    except NETWORK_ERRORS as e:
+        raise DumblrException(str(e))
+
+def _not_sent(e):
+    """Whether a network error surely came before the request went out
+    """
+    if isinstance(e, (ServerNotFoundError, ConnectTimeout, socket.gaierror)):
+        return True
+    if isinstance(e, ConnectionError):
+        reason = getattr(e.args[0], 'reason', None) if e.args else None
+        return isinstance(reason, NewConnectionError)
+    if isinstance(e, socket.error):
+        return e.errno == errno.ECONNREFUSED
+    return False
@@ -3,32 +3,110 @@ import os
 import os.path as osp
 import sys
 from functools import wraps
+from timings import count
+
+## roots found so far, by the path they were looked up from
+_roots = {}
 
 def get_dumblr_root(path):
     """Returns path of dumblr repo, else 
     returns empty string
     
-    Recursively checks travels up the directory
-    to check the existence of ".dumblr" directory.
+    Travels up the directory to check the
+    existence of ".dumblr" directory.
     
     Returns the directory that contains .dumblr
-    subdirectory, empty string otherwise."""
+    subdirectory, empty string otherwise.
+    Found roots are remembered for the life of the process."""
     dumblr_dir = ".dumblr"
     path = osp.abspath(path)
+    if path in _roots:
+        return _roots[path]
 
-    if osp.abspath("/") == path:
-        return ""
-    elif osp.exists(osp.join(path, dumblr_dir)):
-        return path
-    else:
-        return get_dumblr_root(osp.join(path, ".."))
+    start = path
+    while osp.abspath("/") != path:
+        if osp.exists(osp.join(path, dumblr_dir)):
+            ## not there yet could be there later, found stays found
+            _roots[start] = path
+            return path
+        path = osp.dirname(path)
+    return ""
 
 def assert_dumblr_root(f):
+    """For commands taking the Dumblr first, which already
+    looked for the root
+    """
     @wraps(f)
-    def g(*args, **kwargs):
-        if not get_dumblr_root(os.getcwd()):
+    def g(dumblr, *args, **kwargs):
+        if not dumblr.initialized:
             click.echo("FATAL: Not a dubmlr repository!")
             click.echo("Try running `dumblr init`")
             sys.exit(1)
-        return f(*args, **kwargs)
+        return f(dumblr, *args, **kwargs)
     return g
+
+class BatchWriter(object):
+    """Writes files atomically, by renaming a fully written
+    temporary file over the target.
+
+    Temporary files are fsynced and renamed in batches of
+    `batch`, so a crash leaves each target either old or new.
+    With `hold`, they are fsynced in batches but none is renamed
+    before flush(). Call flush() when done, abort() to give up.
+    """
+    def __init__(self, batch=64, hold=False):
+        self.batch = batch
+        self.hold = hold
+        self.pending = []
+        ## fsynced, closed and not renamed yet
+        self.synced = []
+
+    def write(self, path, data):
+        tmp = osp.join(osp.dirname(path), ".{}.tmp".format(osp.basename(path)))
+        f = open(tmp, 'wb')
+        try:
+            f.write(data)
+        except:
+            f.close()
+            os.remove(tmp)
+            raise
+        self.pending.append((f, tmp, path))
+        count('files.written')
+        if len(self.pending) >= self.batch:
+            if self.hold:
+                self._sync()
+            else:
+                self.flush()
+
+    def _sync(self):
+        for f, _, _ in self.pending:
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        self.synced.extend((tmp, path) for _, tmp, path in self.pending)
+        self.pending = []
+
+    def flush(self):
+        self._sync()
+        for tmp, path in self.synced:
+            os.rename(tmp, path)
+
+        ## make the renames themselves durable
+        for d in set(osp.dirname(path) for _, path in self.synced):
+            fd = os.open(d, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        self.synced = []
+
+    def abort(self):
+        """Removes the temporary files not renamed yet
+        """
+        for f, _, _ in self.pending:
+            f.close()
+        for tmp in ([tmp for _, tmp, _ in self.pending] +
+                    [tmp for tmp, _ in self.synced]):
+            if osp.exists(tmp):
+                os.remove(tmp)
+        self.pending, self.synced = [], []
@@ -18,6 +18,12 @@ setup(
         'requests_oauthlib',
         'unidecode'
     ],
+    extras_require={
+        ## file watching for `dumblr daemon`, polls without it
+        'daemon' : ['pyinotify'],
+        ## markdown posts in `dumblr build`, plain paragraphs without it
+        'build' : ['markdown'],
+    },
     entry_points='''
         [console_scripts]
         dumblr=dumblr.cli:cli
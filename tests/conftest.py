@@ -0,0 +1,53 @@
+import os
+import pickle
+import pytest
+from dumblr import index
+from dumblr.core import Dumblr
+
+def post(i, **kwargs):
+    """A text post numbered i, `kwargs` replacing its fields
+    """
+    post = {'body' : "hello world\n", 'title' : "post-{}".format(i),
+            'date' : "2015-02-19 02:14:57 GMT", 'slug' : "post-{}".format(i),
+            'tags' : [], 'state' : "published", 'id' : i,
+            'format' : "markdown"}
+    post.update(kwargs)
+    return post
+
+def pull(posts):
+    """Saves posts as if pulled from tumblr and loads them
+    """
+    d = Dumblr()
+    d.save_snapshot(posts)
+    d.load()
+    return d
+
+@pytest.fixture
+def root(tmpdir, request):
+    """A dumblr root for blog foo, the current directory while
+    the test runs
+    """
+    tmpdir.mkdir(".dumblr").join("DUMBLR").write(pickle.dumps(
+        {'config' : {}, 'tumblr' : {'name' : 'foo'}}))
+    cwd = os.getcwd()
+    os.chdir(tmpdir.strpath)
+    request.addfinalizer(lambda : os.chdir(cwd))
+    return tmpdir
+
+@pytest.fixture
+def settled(monkeypatch):
+    """Files written by the test are as good as old ones
+    """
+    monkeypatch.setattr(index, 'RACY_WINDOW', -60)
+
+@pytest.fixture
+def reads(monkeypatch):
+    """Files read by the post index and the search index
+    """
+    reads = []
+    read = index._read
+    def counting(job):
+        reads.append(os.path.basename(job[0]))
+        return read(job)
+    monkeypatch.setattr(index, '_read', counting)
+    return reads
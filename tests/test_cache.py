@@ -0,0 +1,67 @@
+import os
+import pickle
+import time
+from conftest import post
+from dumblr.core import Dumblr
+from dumblr.cache import ResponseCache
+from dumblr.fakeapi import FakeTumblr
+from dumblr.tumblr import Tumblr
+
+def test_cache(tmpdir):
+    cache = ResponseCache(tmpdir.strpath, ttl=60)
+    url = "/v2/blog/foo.tumblr.com/posts/text"
+    assert cache.get(url, {'offset' : 0}) is None
+    cache.put(url, {'offset' : 0}, {'posts' : [1]})
+    cache.put("/v2/blog/bar.tumblr.com/posts/text", {}, {'posts' : [2]})
+    cache.put("/v2/user/info", {}, {'user' : {}})
+    assert cache.get(url, {'offset' : 0}) == {'posts' : [1]}
+    assert cache.get(url, {'offset' : 20}) is None
+
+    ## writes drop the reads of their blog only
+    cache.invalidate("/v2/blog/foo.tumblr.com/post/edit")
+    assert cache.get(url, {'offset' : 0}) is None
+    assert cache.get("/v2/blog/bar.tumblr.com/posts/text", {}) == {'posts' : [2]}
+    assert cache.get("/v2/user/info", {}) == {'user' : {}}
+
+    cache.ttl = -1
+    assert cache.get("/v2/user/info", {}) is None
+
+def test_cache_evicts_least_recently_used(tmpdir):
+    cache = ResponseCache(tmpdir.strpath, max_bytes=1000)
+    url = "/v2/blog/foo.tumblr.com/posts/text"
+    for i in range(3):
+        cache.put(url, {'offset' : i}, {'posts' : "x" * 200})
+        ## mtimes are only so precise
+        path = cache._path(url, {'offset' : i})
+        os.utime(path, (time.time() - 100 + i, time.time() - 100 + i))
+    cache.get(url, {'offset' : 0})
+    cache.put(url, {'offset' : 3}, {'posts' : "x" * 200})
+    cache.put(url, {'offset' : 4}, {'posts' : "x" * 200})
+
+    kept = [i for i in range(5) if cache.get(url, {'offset' : i})]
+    assert 0 in kept and 4 in kept
+    assert 1 not in kept
+    assert sum(os.path.getsize(path) for _, _, path in cache._entries()) <= 1000
+
+def test_cached_client(tmpdir):
+    with FakeTumblr('foo', [post(i) for i in range(1, 30)]) as api:
+        t = Tumblr('ckey', 'skey', 'oauth', 'oauth_s', 'foo', host=api.host)
+        t.use_cache(tmpdir.join("cache").strpath)
+        posts = t.get_text_posts('foo')
+        calls = len(api.requests)
+        assert t.get_text_posts('foo') == posts
+        assert len(api.requests) == calls
+
+        ## our own writes are seen at once
+        t.push_post('update', dict(post(3), body="edited"))
+        assert t.get_text_post('foo', 3)['body'] == "edited"
+        assert len(api.requests) > calls + 1
+
+def test_cache_ttl_setting(root):
+    root.join(".dumblr", "DUMBLR").write(pickle.dumps(
+        {'config' : {'consumer_key' : 'ckey', 'secret_key' : 'skey',
+                     'oauth_token' : 'oauth', 'oauth_token_secret' : 'oauth_s'},
+         'tumblr' : {'name' : 'foo'}}))
+    assert Dumblr()._get_tumblr().tumblr.request.cache.ttl == 60
+    Dumblr().set_setting('cache_ttl', "300")
+    assert Dumblr()._get_tumblr().tumblr.request.cache.ttl == 300
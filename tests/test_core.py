@@ -2,6 +2,7 @@ import os
 import pickle
 import pytest
 from dumblr.core import Dumblr
+from dumblr.exceptions import DumblrException
 from textwrap import dedent
 
 @pytest.fixture()
@@ -187,6 +188,285 @@ def test_dumblr_static_parse_frontmatter(dumblr, tmpdir):
 def test_dumblr_static_slugify():
     assert "hello-world" == Dumblr.slugify("hello world")
 
-def test_dumblr_pull(dumblr, tmpdir):
-    ## TODO: Create a test blog
-    pass
+class FakeTumblr(object):
+    """Stands in for dumblr.tumblr.Tumblr"""
+    def __init__(self, posts):
+        self.posts = posts
+        self.since = []
+        self.fetched = []
+
+    def get_text_posts(self, name, since=None):
+        self.since.append(since)
+        return [p for p in self.posts
+                if p['state'] == 'draft' or not since or p['date'] >= since]
+
+    def iter_text_posts(self, name, since=None):
+        return iter(self.get_text_posts(name, since))
+
+    def push_posts(self, changes, workers=None, retries=None, **kwargs):
+        self.pushed = changes
+        return [{'id' : 200 if c['post']['id'] == -1 else c['post']['id']}
+                for c in changes]
+
+    def get_text_post(self, name, id):
+        self.fetched.append(id)
+        return dict(remote_post(id, "2015-03-05 00:00:00 GMT"),
+                    slug="remote-slug-{}".format(id))
+
+def remote_post(i, date, state='published'):
+    return {'body' : "hello world",
+            'title' : "remote-{}".format(i),
+            'date' : date,
+            'slug' : "remote-{}".format(i),
+            'tags' : [],
+            'state' : state,
+            'id' : i,
+            'format' : "markdown"}
+
+@pytest.fixture()
+def remote(dumblr):
+    dumblr.CONFIG['tumblr'] = {'name' : 'bar'}
+    t = FakeTumblr([remote_post(11, "2015-03-02 00:00:00 GMT"),
+                    remote_post(10, "2015-03-01 00:00:00 GMT"),
+                    remote_post(12, "2015-03-03 00:00:00 GMT", 'draft')])
+    dumblr._get_tumblr = lambda : t
+    return t
+
+def test_dumblr_pull(dumblr, remote):
+    posts, name = dumblr.pull()
+    assert name == 'bar'
+    assert [p['id'] for p in dumblr.load_snapshot()] == [11, 10, 12]
+    cursor = dumblr.load_cursor()
+    assert cursor['id'] == 11
+    assert cursor['date'] == "2015-03-02 00:00:00 GMT"
+    assert 'synced' in cursor
+
+def test_dumblr_pull_incremental(dumblr, remote):
+    ## without a cursor, an incremental pull is a full pull
+    dumblr.pull(incremental=True)
+    assert remote.since == [None]
+
+    remote.posts = [remote_post(13, "2015-03-04 00:00:00 GMT"),
+                    remote_post(11, "2015-03-02 00:00:00 GMT"),
+                    remote_post(10, "2015-03-01 00:00:00 GMT")]
+    posts, _ = dumblr.pull(incremental=True)
+    assert remote.since[-1] == "2015-03-02 00:00:00 GMT"
+    assert [p['id'] for p in posts] == [13, 11]
+    ## the draft is gone, older posts are kept
+    assert [p['id'] for p in dumblr.load_snapshot()] == [13, 11, 10]
+    assert dumblr.load_cursor()['id'] == 13
+
+def test_dumblr_pull_load(dumblr, remote, tmpdir):
+    dumblr.pull()
+    old = dumblr.load_snapshot()
+    remote.posts = [remote_post(13, "2015-03-04 00:00:00 GMT"),
+                    remote_post(11, "2015-03-02 00:00:00 GMT"),
+                    remote_post(10, "2015-03-01 00:00:00 GMT", 'draft'),
+                    remote_post(14, "2015-03-05 00:00:00 GMT", 'draft')]
+    posts, name, result = dumblr.pull_load(incremental=True)
+    assert [p['id'] for p in posts] == [13, 11, 10, 14]
+    assert 'body' not in posts[0]
+    ## merged as merge_posts does, 10 is a draft now
+    snapshot = dumblr.load_snapshot()
+    assert snapshot == Dumblr.merge_posts(
+        old, [p for p in remote.posts if p['state'] == 'published' and
+              p['date'] >= "2015-03-02 00:00:00 GMT" or p['state'] == 'draft'])
+    assert [p['id'] for p in snapshot] == [13, 11, 10, 14]
+    assert sorted(result['written']) == sorted(
+        "remote-{}.markdown".format(i) for i in [10, 11, 13, 14])
+    assert dumblr.load()['written'] == []
+
+def test_dumblr_pull_load_fails(dumblr, remote, tmpdir):
+    def failing(name, since=None):
+        for i in range(199):
+            ## the page at offset 100
+            if i == 100:
+                raise DumblrException("Service Unavailable")
+            yield remote_post(1000 + i, "2015-03-01 00:00:00 GMT")
+    remote.iter_text_posts = failing
+    files = sorted(tmpdir.join("posts").listdir())
+    posts = dumblr.dump()
+    with pytest.raises(DumblrException):
+        dumblr.pull_load()
+    ## no post file, nor any temporary one, was left behind
+    assert sorted(tmpdir.join("posts").listdir()) == files
+    assert [p['id'] for p in dumblr.load_snapshot()] == [0, 1, 2]
+
+    ## temporary files are not posts
+    tmpdir.join("posts", ".remote-1000.markdown.tmp").write(
+        tmpdir.join("posts", "testpost-1.markdown").read())
+    assert dumblr.dump() == posts
+
+def test_dumblr_pull_load_order(dumblr, remote, tmpdir):
+    dumblr.pull()
+    ## a new draft taking the file of a kept published post
+    remote.posts = [remote_post(11, "2015-03-02 00:00:00 GMT"),
+                    dict(remote_post(15, "2015-03-05 00:00:00 GMT", 'draft'),
+                         slug="remote-10")]
+    _, _, result = dumblr.pull_load(incremental=True)
+    ## the snapshot comes first, as in load()
+    assert result['skipped'] == ["remote-10.markdown"]
+    assert "id: 10" in tmpdir.join("posts", "remote-10.markdown").read()
+    assert dumblr.load()['written'] == []
+
+def test_dumblr_static_merge_posts():
+    old = [remote_post(2, "b"), remote_post(1, "a"),
+           remote_post(3, "c", 'draft')]
+    new = [remote_post(4, "d"), dict(remote_post(2, "b"), body="edited"),
+           remote_post(5, "e", 'draft')]
+    merged = Dumblr.merge_posts(old, new)
+    assert [p['id'] for p in merged] == [4, 2, 1, 5]
+    assert merged[1]['body'] == "edited"
+
+def test_dumblr_push(dumblr, remote, tmpdir):
+    p = tmpdir.join("posts")
+    ## testpost-0 is deleted, 1 and 2 are updated and 3 is created
+    dumblr.new("a new draft", "markdown")
+    resps = dumblr.push()
+    assert sorted(r['post'] for r in resps) == [
+        'a-new-draft', 'testpost-0', 'testpost-1', 'testpost-2', 'testpost-3']
+    assert all(r['status'] == True for r in resps)
+
+    ## only published posts are fetched back, drafts are kept as pushed
+    assert sorted(remote.fetched) == [1, 2, 3]
+    snapshot = dict((post['id'], post) for post in dumblr.load_snapshot())
+    assert sorted(snapshot.keys()) == [1, 2, 3, 200]
+    assert snapshot[200]['slug'] == 'a-new-draft'
+    assert snapshot[1]['slug'] == 'remote-slug-1'
+
+    ## renamed posts are moved, everything else is left alone
+    assert sorted(f.basename for f in p.listdir()) == [
+        'a-new-draft.markdown', 'remote-slug-1.markdown',
+        'remote-slug-2.markdown', 'remote-slug-3.markdown']
+    assert Dumblr.parse_frontmatter(
+        p.join('a-new-draft.markdown').strpath)['id'] == 200
+
+    ## nothing left to push
+    assert dumblr.status() == []
+
+def test_dumblr_log_rollback(dumblr, remote, tmpdir):
+    dumblr.pull()
+    remote.posts[0] = dict(remote.posts[0], body="edited")
+    dumblr.pull()
+    dumblr.load()
+
+    assert [m['number'] for m in dumblr.log()] == [1, 2]
+    revisions = dumblr.log("remote-11.markdown")
+    assert [r['manifest'] for r in revisions] == [1, 2]
+    assert revisions[1]['post']['body'] == "edited"
+    assert dumblr.log("11") == revisions
+
+    paths = dumblr.rollback(1, "remote-11")
+    assert paths == [tmpdir.join("posts", "remote-11.markdown").strpath]
+    assert Dumblr.parse_frontmatter(paths[0])['body'] == "hello world"
+    assert [c['post']['id'] for c in dumblr.status()
+            if c['action'] == 'update'] == [11]
+
+def test_dumblr_load_incremental(dumblr, tmpdir):
+    result = dumblr.load()
+    assert result['written'] == ["testpost-{}.markdown".format(i)
+                                 for i in range(3)]
+    assert result['unchanged'] == []
+
+    ## a second load writes nothing
+    p = tmpdir.join("posts")
+    mtimes = dict((f.basename, f.mtime()) for f in p.listdir())
+    dumblr.dump()
+    result = dumblr.load()
+    assert result['written'] == []
+    assert len(result['unchanged']) == 3
+    assert mtimes == dict((f.basename, f.mtime()) for f in p.listdir())
+
+    ## only the edited post is written back
+    p.join("testpost-1.markdown").write("edited")
+    result = dumblr.load()
+    assert result['written'] == ["testpost-1.markdown"]
+    assert not [f for f in p.listdir() if f.basename.endswith(".tmp")]
+
+def test_dumblr_load_duplicates(dumblr, tmpdir):
+    posts = dumblr.load_snapshot()
+    posts.append(dict(posts[0], id=42, body="shadowed"))
+    dumblr.save_snapshot(posts)
+    result = dumblr.load()
+    assert result['skipped'] == ["testpost-0.markdown"]
+    assert Dumblr.parse_frontmatter(
+        tmpdir.join("posts", "testpost-0.markdown").strpath)['id'] == 0
+
+def test_dumblr_iter_diff(dumblr, monkeypatch):
+    assert [name for name, _ in dumblr.iter_diff('name')] == [
+        'testpost-1.markdown', 'testpost-2.markdown']
+    assert dict(dumblr.iter_diff('stat')) == {
+        'testpost-1.markdown' : (1, 1), 'testpost-2.markdown' : (1, 1)}
+
+    ## same results from a process pool
+    serial = list(dumblr.iter_diff('unified'))
+    monkeypatch.setattr("dumblr.core.DIFF_PARALLEL_THRESHOLD", 1)
+    dumblr.jobs = 2
+    assert list(dumblr.iter_diff('unified')) == serial
+    assert list(dumblr.iter_diff()) == sorted(dumblr.diff().items())
+
+def test_dumblr_timings(dumblr):
+    from dumblr.timings import timings
+    timings.enable()
+    try:
+        dumblr.status()
+        dumblr.status()
+    finally:
+        timings.disable()
+    status = timings.root.children[0]
+    assert status.name == 'status' and status.calls == 2
+    dump = status.children[0]
+    assert dump.name == 'dump'
+    assert dump.counts['index.miss'] + dump.counts['index.hit'] == 6
+
+def test_dumblr_each_blog(tmpdir, request):
+    from dumblr.fakeapi import FakeTumblr
+    from dumblr.tumblr import Tumblr
+    post = lambda i : {'title' : "post-{}".format(i), 'body' : "hello",
+                       'slug' : "post-{}".format(i), 'format' : "markdown",
+                       'id' : i}
+    api = FakeTumblr('foo', [post(1)], blogs={'bar' : [post(2), post(3)]})
+    request.addfinalizer(api.start().stop)
+    tmpdir.mkdir(".dumblr").join("DUMBLR").write(pickle.dumps(
+        {'config' : {'rate_limit' : 1000.0},
+         'tumblr' : {'name' : 'foo', 'blogs' : ['foo', 'bar']}}))
+    cwd = os.getcwd()
+    os.chdir(tmpdir.strpath)
+    request.addfinalizer(lambda : os.chdir(cwd))
+
+    d = Dumblr()
+    d._tumblr = Tumblr('ckey', 'skey', 'oauth', 'oauth_s', 'foo', host=api.host)
+    assert d.blogs() == ['foo', 'bar']
+    results = d.for_each_blog('pull')
+    assert [(blog, len(posts), name, error)
+            for blog, (posts, name), error in results] == [
+        ('foo', 1, 'foo', None), ('bar', 2, 'bar', None)]
+    assert d.rate_limit == 1000.0
+    d.for_each_blog('load')
+
+    ## the default blog keeps its layout, others get their own
+    assert tmpdir.join("posts", "post-1.markdown").check()
+    assert tmpdir.join("blogs", "bar", "post-3.markdown").check()
+    assert tmpdir.join(".dumblr", "blogs", "bar", "TUMBLR").check()
+    assert Dumblr('foo').posts_path == tmpdir.join("posts").strpath
+
+    Dumblr('bar').new("post 4", "markdown")
+    results = d.for_each_blog('push')
+    assert [len(resps) for _, resps, _ in results] == [0, 1]
+    assert len(api.drafts('bar')) == 1
+
+def test_dumblr_settings(dumblr, tmpdir):
+    d = Dumblr()
+    assert d.setting('rate_limit') is None
+    d.set_setting('rate_limit', "5")
+    ## kept next to the oauth keys, and read back by the next run
+    assert Dumblr().CONFIG['config'] == {'consumer_key' : 'foo',
+                                         'rate_limit' : 5.0}
+    assert Dumblr().setting('rate_limit') == 5.0
+    with pytest.raises(DumblrException):
+        d.set_setting('rate_limit', "fast")
+    with pytest.raises(DumblrException):
+        d.set_setting('consumer_key', "bar")
+
+    d.set_setting('rate_limit', None)
+    assert Dumblr().setting('rate_limit') is None
@@ -0,0 +1,108 @@
+import os
+import pytest
+import threading
+import time
+from conftest import post, pull
+from dumblr import daemon
+from dumblr.core import Dumblr
+from dumblr.fakeapi import FakeTumblr
+from dumblr.tumblr import Tumblr
+
+@pytest.fixture
+def root(root):
+    pull([post(i) for i in range(3)])
+    return root
+
+def sock(root):
+    return root.join(".dumblr", "daemon.sock").strpath
+
+def serve(request, poll=0.05, blog=None, **kwargs):
+    api = FakeTumblr('foo', [post(i) for i in range(3)]).start()
+    request.addfinalizer(api.stop)
+    warm = daemon.WarmDumblr(blog)
+    warm._tumblr = Tumblr('ckey', 'skey', 'oauth', 'oauth_s', 'foo',
+                          host=api.host)
+    server = daemon.Daemon(warm, poll=poll, **kwargs)
+    thread = threading.Thread(target=server.serve)
+    thread.daemon = True
+    thread.start()
+
+    def stop():
+        daemon.call(warm.DAEMON_SOCKET, 'stop')
+        thread.join(5)
+    request.addfinalizer(stop)
+    for _ in range(100):
+        if daemon.call(warm.DAEMON_SOCKET, 'ping'):
+            break
+        time.sleep(0.01)
+    return server, api
+
+def wait(condition, timeout=5):
+    end = time.time() + timeout
+    while time.time() < end:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+def test_no_daemon(root):
+    assert daemon.call(sock(root), 'status') is None
+
+def test_daemon_status(root, request):
+    ## the watcher is too slow to see the changes in time
+    server, _ = serve(request, poll=60)
+    assert daemon.call(sock(root), 'status') == []
+
+    root.join("posts", "post-1.markdown").write("edited\n", mode='a')
+    root.join("posts", "post-2.markdown").remove()
+    changes = daemon.call(sock(root), 'status')
+    assert sorted((c['action'], c['post']['id']) for c in changes) == [
+        ('delete', 2), ('update', 1)]
+
+    diffs = daemon.call(sock(root), 'diff', mode='name')
+    assert diffs == [["post-1.markdown", None]]
+    changes = daemon.call(sock(root), 'status', scope={'ids' : [2]})
+    assert [(c['action'], c['post']['id']) for c in changes] == [
+        ('delete', 2)]
+
+    with pytest.raises(daemon.DumblrException):
+        daemon.call(sock(root), 'frobnicate')
+
+    path = root.join("posts", "post-1.markdown")
+    path.write(path.read().replace("2015-02-19 02:14:57 GMT",
+                                   "2015-02-19 02:14:57"))
+    changes = daemon.call(sock(root), 'status', scope={'ids' : [1]})
+    assert changes[0]['post']['date'] == "2015-02-19 02:14:57 GMT"
+
+def test_daemon_warm(root, request, monkeypatch):
+    server, _ = serve(request)
+    daemon.call(sock(root), 'status')
+    ## nothing changed, nothing is read
+    monkeypatch.setattr(server.dumblr.index, 'refresh', None)
+    monkeypatch.setattr(Dumblr, 'open_snapshot', None)
+    assert daemon.call(sock(root), 'status') == []
+
+def test_daemon_auto_push(root, request):
+    server, api = serve(request, auto_push=True, debounce=0.1)
+    root.join("posts", "post-0.markdown").remove()
+    assert wait(lambda : 0 not in api.posts)
+    assert wait(lambda : daemon.call(sock(root), 'status') == [])
+    assert [p['id'] for p in Dumblr().load_snapshot()] == [1, 2]
+
+def test_daemon_single(root, request):
+    server, _ = serve(request)
+    with pytest.raises(daemon.DumblrException):
+        daemon.Daemon(server.dumblr).serve()
+
+def test_daemon_other_blog(root, request):
+    side = Dumblr('side')
+    os.makedirs(side.state_path)
+    side.save_snapshot([post(5)])
+    side.load()
+    root.join("blogs", "side", "post-5.markdown").remove()
+    server, _ = serve(request, blog='side')
+    assert server.dumblr.DAEMON_SOCKET == side.DAEMON_SOCKET
+    assert daemon.call(sock(root), 'ping') is None
+    changes = daemon.call(side.DAEMON_SOCKET, 'status')
+    assert [(c['action'], c['post']['id']) for c in changes] == [
+        ('delete', 5)]
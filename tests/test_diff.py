@@ -0,0 +1,78 @@
+import difflib
+import random
+import pytest
+from dumblr import diff
+
+def lines(seed, n):
+    r = random.Random(seed)
+    return ["line {}".format(r.randint(0, 5)) for _ in range(n)]
+
+def edit(seed):
+    a = lines(seed, 30)
+    b = list(a)
+    r = random.Random(seed)
+    for _ in range(r.randint(1, 4)):
+        i = r.randint(0, len(b) - 1)
+        b[i:i + r.randint(0, 3)] = lines(seed + 100, r.randint(0, 3))
+    return a, b
+
+@pytest.mark.parametrize("seed", range(20))
+def test_line_diff_reconstructs(seed):
+    a, b = edit(seed)
+    d = diff.line_diff(a, b)
+    assert [l[2:] for l in d if l[0] in " -"] == a
+    assert [l[2:] for l in d if l[0] in " +"] == b
+
+@pytest.mark.parametrize("seed", range(20))
+def test_unified_hunks(seed):
+    a, b = edit(seed)
+    expected = list(difflib.unified_diff(a, b, "a/x", "b/x", lineterm=""))
+    ## both may pick different (equally valid) matches,
+    ## but they agree on whether there is a change at all
+    assert bool(diff.unified_diff(a, b, "a/x", "b/x")) == bool(expected)
+
+def test_unified_matches_difflib():
+    a = ["line {}".format(i) for i in range(20)]
+    b = a[:3] + ["new"] + a[4:15] + a[16:] + ["last"]
+    expected = list(difflib.unified_diff(a, b, "a/x", "b/x", lineterm=""))
+    assert diff.unified_diff(a, b, "a/x", "b/x") == expected
+
+def test_opcodes_trim():
+    a = ["same"] * 5 + ["old"] + ["same"] * 5
+    b = ["same"] * 5 + ["new", "newer"] + ["same"] * 5
+    assert diff.opcodes(a, b) == [('equal', 0, 5, 0, 5),
+                                  ('replace', 5, 6, 5, 7),
+                                  ('equal', 6, 11, 7, 12)]
+    assert diff.opcodes(a, a) == [('equal', 0, 11, 0, 11)]
+    assert diff.opcodes([], ["x"]) == [('insert', 0, 0, 0, 1)]
+
+def test_opcodes_cutoff(monkeypatch):
+    monkeypatch.setattr(diff, 'LINE_CUTOFF', 10)
+    a = ["head"] + ["a{}".format(i) for i in range(20)] + ["tail"]
+    b = ["head"] + ["b{}".format(i) for i in range(15)] + ["tail"]
+    assert diff.opcodes(a, b) == [('equal', 0, 1, 0, 1),
+                                  ('replace', 1, 21, 1, 16),
+                                  ('equal', 21, 22, 16, 17)]
+
+def test_line_diff():
+    assert diff.line_diff(["a", "b", "c"], ["a", "x", "c"]) == [
+        "  a", "- b", "+ x", "  c"]
+
+def post(body, title="post"):
+    return {'title' : title, 'date' : "2015-02-19 02:14:57 GMT",
+            'slug' : "post", 'tags' : [], 'format' : "markdown",
+            'state' : "published", 'id' : 1, 'body' : body}
+
+def test_diff_post_modes():
+    old, new = post("a\nb\nc"), post("a\nx\nc\nd", "renamed")
+    job = lambda mode : ("post.markdown", old, new, ['body', 'title'], mode)
+
+    assert diff.diff_post(job('name')) == ("post.markdown", None)
+    _, attrs = diff.diff_post(job('attr'))
+    assert attrs == {'body' : "  a\n\t- b\n\t+ x\n\t  c\n\t+ d",
+                     'title' : "- post\n\t+ renamed"}
+    _, stat = diff.diff_post(job('stat'))
+    assert stat == (3, 2)
+    _, unified = diff.diff_post(job('unified'))
+    assert unified[:2] == ["--- a/post.markdown", "+++ b/post.markdown"]
+    assert "+title: renamed" in unified
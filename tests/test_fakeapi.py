@@ -0,0 +1,96 @@
+import time
+import pytest
+from conftest import post as plain_post
+from dumblr import fakeapi
+from dumblr.exceptions import DumblrException
+from dumblr.fakeapi import FakeTumblr
+from dumblr.tumblr import Tumblr
+
+def post(i, **kwargs):
+    ## dates and tags of their own, for paging and ordering
+    fields = {'title' : "post {}".format(i), 'body' : "body {}".format(i),
+              'date' : "2015-02-{:02d} 02:14:57 GMT".format(i % 28 + 1),
+              'tags' : ["tag"]}
+    fields.update(kwargs)
+    return plain_post(i, **fields)
+
+@pytest.fixture
+def api(request):
+    posts = [post(i) for i in range(1, 46)]
+    posts += [post(i, state='draft') for i in range(100, 125)]
+    api = FakeTumblr('foo', posts).start()
+    request.addfinalizer(api.stop)
+    return api
+
+def client(api):
+    return Tumblr('ckey', 'skey', 'oauth', 'oauth_s', host=api.host)
+
+def test_fake_pull(api):
+    t = client(api)
+    assert t.info() == {'name' : 'foo', 'blogs' : ['foo']}
+    posts = t.get_text_posts('foo')
+    assert len(posts) == 70
+    assert sorted(p['id'] for p in posts if p['state'] == 'draft') == \
+        range(100, 125)
+    assert dict((p['id'], p) for p in posts)[7] == post(7)
+    ## 3 pages of published posts, 2 of drafts and the empty one
+    assert api.requests.count(("GET", "/v2/blog/foo.tumblr.com/posts/text")) == 3
+    assert api.requests.count(("GET", "/v2/blog/foo.tumblr.com/posts/draft")) == 3
+
+def test_fake_push(api):
+    t = client(api)
+    new = dict(post(0), title=u"caf\xe9", id=-1)
+    resps = t.push_posts([{'action' : 'create', 'post' : new},
+                          {'action' : 'update',
+                           'post' : dict(post(1), body="edited")},
+                          {'action' : 'delete', 'post' : post(2)},
+                          {'action' : 'delete', 'post' : post(999)}])
+    assert resps[0] == {'id' : 125}
+    assert resps[1] == {'id' : 1}
+    assert resps[3]['meta']['status'] == 404
+
+    assert t.get_text_post('foo', 125)['title'] == u"caf\xe9"
+    assert t.get_text_post('foo', 1)['body'] == "edited"
+    assert t.get_text_post('foo', 2) is None
+
+def test_fake_failures(api):
+    t = client(api)
+    api.failures = [503, 429]
+    resps = t.push_posts([{'action' : 'update', 'post' : post(1)}],
+                         backoff=0)
+    assert resps == [{'id' : 1}]
+
+    api.failures = [503]
+    with pytest.raises(DumblrException):
+        t.get_text_posts('foo')
+
+class FrozenTime(object):
+    """The time module of fakeapi, stopped at a second"""
+    def time(self):
+        return 1424312097.5
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+def test_fake_rate_limit(monkeypatch):
+    ## every call lands in the same one second window
+    monkeypatch.setattr(fakeapi, 'time', FrozenTime())
+    with FakeTumblr('foo', [post(1)], rate_limit=2) as api:
+        t = client(api)
+        statuses = [t.tumblr.posts('foo', type='text').get('meta', {})
+                    .get('status', 200) for _ in range(4)]
+        assert statuses == [200, 200, 429, 429]
+
+def test_fake_error_rate():
+    with FakeTumblr('foo', [post(1)], error_rate=1, seed=0) as api:
+        assert client(api).tumblr.posts('foo')['meta']['status'] == 503
+
+def test_fake_pull_streams():
+    with FakeTumblr('foo', [post(i) for i in range(1, 201)]) as api:
+        posts = client(api).iter_text_posts('foo', workers=2)
+        next(posts)
+        time.sleep(0.2)
+        ## the first page and two ahead of it
+        assert len(api.requests) == 3
+        assert len(list(posts)) == 199
+        assert len(api.requests) == 11
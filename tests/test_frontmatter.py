@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import pytest
+import yaml
+from dumblr import frontmatter
+
+def post(**kwargs):
+    p = {'title' : u"hello world",
+         'date' : u"2015-02-19 02:14:57 GMT",
+         'slug' : u"hello-world",
+         'tags' : [],
+         'format' : u"markdown",
+         'state' : u"published",
+         'id' : 1}
+    p.update(kwargs)
+    return p
+
+TITLES = [u"hello world", u"u'quoted'", u'"double"', u"colon: here",
+          u"trailing:", u"# not a comment", u"a #b", u"- dash", u"[list]",
+          u"{map}", u"yes", u"No", u"null", u"~", u"12", u"0x1f", u"1.5",
+          u"2015-02-19", u"& anchor", u"* alias", u"!tag", u"%percent",
+          u"@at", u"`tick`", u"> folded", u"| literal", u" padded ",
+          u"back\\slash", u"tab\there", u"new\nline", u"unicode ☃ é",
+          u"nel\x85", u"ls\u2028", u"bell\x07", u"emoji \U0001f600", u""]
+
+TAGS = [[u"a", u"b c"], [u"comma, inside"], [u"colon:x"], [u"[bracket]"],
+        [u"'single'"], [u'"double"'], [u"yes"], [u"☃"], [u"1"], [u"#hash"]]
+
+@pytest.mark.parametrize("title", TITLES)
+def test_frontmatter_title_roundtrip(title):
+    p = post(title=title)
+    fm = frontmatter.dumps(p)
+    ## the fast path agrees with yaml, without needing it
+    assert yaml.safe_load(fm.split(u"---")[1]) == p
+    assert frontmatter._parse_known(fm.split(u"---")[1]) == p
+    assert frontmatter.loads(fm + u"body") == dict(p, body=u"body")
+
+@pytest.mark.parametrize("tags", TAGS)
+def test_frontmatter_tags_roundtrip(tags):
+    p = post(tags=tags)
+    fm = frontmatter.dumps(p)
+    assert yaml.safe_load(fm.split(u"---")[1]) == p
+    assert frontmatter._parse_known(fm.split(u"---")[1]) == p
+
+def test_frontmatter_dumps():
+    assert frontmatter.dumps(post(tags=[u"a", u"b c"], id=-1)) == (
+        u"---\n"
+        u"title: hello world\n"
+        u"date: 2015-02-19 02:14:57 GMT\n"
+        u"slug: hello-world\n"
+        u"tags: [a, b c]\n"
+        u"format: markdown\n"
+        u"state: published\n"
+        u"id: -1\n"
+        u"---\n")
+
+@pytest.mark.parametrize("header", [
+    u"title: foo # comment\n",
+    u"title: foo\ntags:\n  - a\n  - b\n",
+    u"title: foo\nextra: 1\n",
+    u"title: 'it''s'\n",
+    u"title: \"\\u263a\"\n",
+    u"id: 0x10\n",
+])
+def test_frontmatter_fallback(header):
+    assert frontmatter.parse_header(header) == yaml.safe_load(header)
+
+@pytest.mark.parametrize("date, expected", [
+    (u"2015-01-01 10:00:00", u"2015-01-01 10:00:00 GMT"),
+    (u"2015-01-01T10:00:00+02:00", u"2015-01-01 08:00:00 GMT"),
+    (u"2015-01-01", u"2015-01-01 00:00:00 GMT"),
+    (u"2015-02-19 02:14:57 GMT", u"2015-02-19 02:14:57 GMT"),
+])
+def test_frontmatter_dates(date, expected):
+    ## hand written dates are read as dumblr writes them
+    post = frontmatter.loads(u"---\ndate: {}\nid: 1\n---\n".format(date))
+    assert post['date'] == expected
+
+def test_frontmatter_not_a_mapping():
+    with pytest.raises(ValueError):
+        frontmatter.loads(u"---\njust text\n---\nbody")
+    with pytest.raises(ValueError):
+        frontmatter.loads(u"no frontmatter")
+
+def test_frontmatter_header_only(tmpdir):
+    f = tmpdir.join("post.markdown")
+    f.write_text(frontmatter.dumps(post()) + u"body\n---\nmore body",
+                 encoding='utf-8')
+    assert frontmatter.load(f.strpath, header_only=True) == post()
+    assert frontmatter.load(f.strpath)['body'] == u"body\n---\nmore body"
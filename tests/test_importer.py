@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import json
+import pytest
+from textwrap import dedent
+from dumblr import importer
+from dumblr.core import Dumblr
+from dumblr.exceptions import DumblrException
+
+def imported(d, source):
+    return [(status, name) for status, name, _ in d.iter_import(source)]
+
+def tumblr_post(i, **kwargs):
+    post = {'type' : 'text', 'id' : i, 'title' : u"Caf\xe9 {}".format(i),
+            'body' : "<p>{}</p>".format(i), 'slug' : "cafe-{}".format(i),
+            'date' : "2015-02-19 02:14:57 GMT", 'tags' : ["a", "b"],
+            'format' : "html", 'state' : "published"}
+    post.update(kwargs)
+    return post
+
+def test_import_jekyll(root):
+    site = root.mkdir("site")
+    site.mkdir("_posts").join("2014-05-01-hello-world.md").write(dedent("""\
+    ---
+    layout: post
+    title: "Hello: world"
+    tags: one two
+    ---
+    Hello!
+    """))
+    site.mkdir("_drafts").join("later.markdown").write(dedent("""\
+    ---
+    date: 2014-05-02 10:00:00 +0200
+    ---
+    Later.
+    """))
+    site.join("about.md").write("---\ntitle: About\n---\n")
+
+    d = Dumblr()
+    assert imported(d, site.strpath) == [
+        ('written', 'hello-world.markdown'), ('written', 'later.markdown')]
+    post = Dumblr.parse_frontmatter(root.join("posts", "hello-world.markdown")
+                                    .strpath)
+    assert post == {'title' : "Hello: world",
+                    'date' : "2014-05-01 00:00:00 GMT",
+                    'slug' : "hello-world", 'tags' : ["one", "two"],
+                    'format' : "markdown", 'state' : "published", 'id' : -1,
+                    'body' : "Hello!\n"}
+    post = Dumblr.parse_frontmatter(root.join("posts", "later.markdown")
+                                    .strpath)
+    assert post['state'] == "draft"
+    assert post['title'] == "later"
+    assert post['date'] == "2014-05-02 08:00:00 GMT"
+
+def test_import_hugo(root):
+    content = root.mkdir("content")
+    content.join("_index.md").write("+++\ntitle = 'Section'\n+++\n")
+    content.mkdir("post").join("first.html").write(dedent("""\
+    +++
+    title = "First"
+    date = 2016-01-02T03:04:05Z
+    tags = ["x", "y"]
+    draft = true
+    [params]
+    title = "not this"
+    +++
+    <p>first</p>
+    """))
+    assert imported(Dumblr(), content.strpath) == [('written', 'first.html')]
+    post = Dumblr.parse_frontmatter(root.join("posts", "first.html").strpath)
+    assert (post['title'], post['date'], post['tags'], post['state'],
+            post['format']) == ("First", "2016-01-02 03:04:05 GMT",
+                                ["x", "y"], "draft", "html")
+
+def test_import_tumblr_xml(root):
+    root.join("export.xml").write(dedent("""\
+    <?xml version="1.0" encoding="UTF-8"?>
+    <tumblr version="1.0"><posts>
+    <post id="1" type="regular" date-gmt="2015-02-19 02:14:57 GMT"
+          format="markdown" slug="first"><regular-title>First</regular-title>
+    <regular-body>Body &amp; soul</regular-body><tag>a</tag><tag>b</tag></post>
+    <post id="2" type="photo" slug="photo"></post>
+    <post id="3" type="regular" private="true"><regular-body>x</regular-body>
+    </post>
+    </posts></tumblr>
+    """))
+    results = list(Dumblr().iter_import("export.xml"))
+    assert results == [('written', 'first.markdown', "regular 1"),
+                       ('skipped', "photo 2", "not a text post"),
+                       ('written', '3.html', "regular 3")]
+    post = Dumblr.parse_frontmatter(root.join("posts", "first.markdown")
+                                    .strpath)
+    assert (post['body'], post['tags']) == ("Body & soul", ["a", "b"])
+    assert Dumblr.parse_frontmatter(
+        root.join("posts", "3.html").strpath)['state'] == "draft"
+
+@pytest.mark.parametrize("dump", [
+    lambda posts : json.dumps(posts),
+    lambda posts : json.dumps({'meta' : {'status' : 200},
+                               'response' : {'blog' : {'name' : 'bar'},
+                                             'posts' : posts}}, indent=2)])
+def test_import_tumblr_json(root, monkeypatch, dump):
+    ## posts span many reads
+    monkeypatch.setattr(importer, 'CHUNK', 64)
+    posts = [tumblr_post(i) for i in range(20)]
+    root.join("export.json").write(dump(posts))
+    results = imported(Dumblr(), "export.json")
+    assert results == [('written', "cafe-{}.html".format(i))
+                       for i in range(20)]
+    post = Dumblr.parse_frontmatter(root.join("posts", "cafe-3.html").strpath)
+    assert post['title'] == u"Caf\xe9 3"
+
+def test_import_json_errors(root):
+    root.join("bad.json").write('{"posts" : [{"id" : 1}')
+    with pytest.raises(DumblrException):
+        list(Dumblr().iter_import("bad.json"))
+    root.join("bad.txt").write('')
+    with pytest.raises(DumblrException):
+        list(Dumblr().iter_import("bad.txt"))
+    root.join("bad.xml").write('<tumblr><posts><post id="1">')
+    with pytest.raises(DumblrException):
+        list(Dumblr().iter_import("bad.xml"))
+
+    ## not posts at all
+    root.join("odd.json").write(json.dumps([42, "x", tumblr_post(1)]))
+    assert [(status, name) for status, name, _ in
+            Dumblr().iter_import("odd.json")] == [
+        ('skipped', 42), ('skipped', "x"), ('written', "cafe-1.html")]
+
+def test_import_undated(root):
+    site = root.mkdir("site")
+    site.join("undated.md").write("---\ntitle: Undated\n---\nHi\n")
+    root.join("export.jsonl").write(json.dumps(tumblr_post(1, date=None)))
+    d = Dumblr()
+    assert imported(d, site.strpath) == [('written', "undated.markdown")]
+    assert imported(d, "export.jsonl") == [('written', "cafe-1.html")]
+    ## dated the same every time, so importing again adds nothing
+    assert imported(d, site.strpath) == [('unchanged', "undated.markdown")]
+    assert imported(d, "export.jsonl") == [('unchanged', "cafe-1.html")]
+
+def test_import_slug_collisions(root, monkeypatch):
+    posts = [tumblr_post(i, slug="same") for i in range(6)]
+    root.join("export.jsonl").write(
+        "\n".join(json.dumps(post) for post in posts))
+    root.mkdir("posts").join("same.markdown").write("taken")
+
+    ## a pool, a batch at a time
+    monkeypatch.setattr("dumblr.core.IMPORT_BATCH", 4)
+    d = Dumblr()
+    d.jobs = 2
+    assert imported(d, "export.jsonl") == [('written', "same-{}.html".format(i))
+                                           for i in range(2, 8)]
+    assert Dumblr.parse_frontmatter(
+        root.join("posts", "same-7.html").strpath)['slug'] == "same-7"
+
+    ## importing again does not duplicate anything
+    assert [status for status, _ in imported(d, "export.jsonl")] == \
+        ['unchanged'] * 6
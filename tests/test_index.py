@@ -0,0 +1,86 @@
+import os
+import pytest
+from dumblr.index import PostIndex
+
+class Parser(object):
+    def __init__(self):
+        self.parsed = []
+
+    def __call__(self, text):
+        self.parsed.append(text)
+        if not text.startswith("---"):
+            raise ValueError("no frontmatter")
+        return {'body' : text}
+
+def age(f, seconds=60):
+    """Pushes mtime out of the racy window"""
+    st = os.stat(f.strpath)
+    os.utime(f.strpath, (st.st_atime - seconds, st.st_mtime - seconds))
+
+@pytest.fixture
+def posts(tmpdir):
+    d = tmpdir.mkdir("posts")
+    for i in range(3):
+        d.join("post-{}.markdown".format(i)).write("---\n{}".format(i))
+        age(d.join("post-{}.markdown".format(i)))
+    d.join("notes.txt").write("not a post")
+    age(d.join("notes.txt"))
+    return d
+
+def test_index_refresh(posts, tmpdir):
+    parse = Parser()
+    index = PostIndex(tmpdir.join("INDEX").strpath)
+    entries = index.refresh(posts.strpath, parse)
+    assert [name for name, _ in entries] == [
+        'notes.txt', 'post-0.markdown', 'post-1.markdown', 'post-2.markdown']
+    assert entries[0][1] is None
+    assert entries[1][1] == {'body' : "---\n0"}
+    assert len(parse.parsed) == 4
+    index.save()
+
+    ## nothing changed, nothing is read
+    parse = Parser()
+    index = PostIndex(tmpdir.join("INDEX").strpath)
+    assert index.refresh(posts.strpath, parse) == entries
+    assert parse.parsed == []
+
+def test_index_changes(posts, tmpdir):
+    index = PostIndex(tmpdir.join("INDEX").strpath)
+    index.refresh(posts.strpath, Parser())
+    index.save()
+
+    posts.join("post-0.markdown").write("---\nchanged")
+    posts.join("post-1.markdown").remove()
+    ## touched but not changed: read, not parsed
+    posts.join("post-2.markdown").setmtime()
+
+    parse = Parser()
+    index = PostIndex(tmpdir.join("INDEX").strpath)
+    entries = dict(index.refresh(posts.strpath, parse))
+    assert parse.parsed == ["---\nchanged"]
+    assert entries['post-0.markdown'] == {'body' : "---\nchanged"}
+    assert 'post-1.markdown' not in entries
+    assert 'post-1.markdown' not in index.entries
+
+def test_index_corrupt(posts, tmpdir):
+    tmpdir.join("INDEX").write("garbage")
+    index = PostIndex(tmpdir.join("INDEX").strpath)
+    assert len(index.refresh(posts.strpath, Parser())) == 4
+
+def parse_post(text):
+    if not text.startswith("---"):
+        raise ValueError("no frontmatter")
+    return {'body' : text}
+
+def test_index_parallel(tmpdir, monkeypatch):
+    monkeypatch.setattr("dumblr.index.PARALLEL_THRESHOLD", 10)
+    d = tmpdir.mkdir("posts")
+    for i in range(50):
+        d.join("post-{:02d}.markdown".format(i)).write("---\n{}".format(i))
+
+    serial = PostIndex(tmpdir.join("INDEX1").strpath)
+    parallel = PostIndex(tmpdir.join("INDEX2").strpath)
+    entries = parallel.refresh(d.strpath, parse_post, workers=3)
+    assert entries == serial.refresh(d.strpath, parse_post, workers=1)
+    assert [post['body'] for _, post in entries] == [
+        "---\n{}".format(i) for i in range(50)]
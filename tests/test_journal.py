@@ -0,0 +1,168 @@
+import pytest
+from textwrap import dedent
+from conftest import post
+from dumblr import journal
+from dumblr.core import Dumblr
+from dumblr.fakeapi import FakeTumblr
+from dumblr.journal import Journal, PostQuota, post_quota
+from dumblr.tumblr import Tumblr
+
+@pytest.fixture
+def api(root, request):
+    api = FakeTumblr('foo', [post(i) for i in range(1, 4)]).start()
+    request.addfinalizer(api.stop)
+    d = dumblr(api)
+    d.pull()
+    d.load()
+    return api
+
+def dumblr(api):
+    d = Dumblr()
+    d._tumblr = Tumblr('ckey', 'skey', 'oauth', 'oauth_s', 'foo',
+                       host=api.host)
+    return d
+
+def creates(api):
+    return api.requests.count(("POST", "/v2/blog/foo.tumblr.com/post"))
+
+def test_journal(tmpdir):
+    path = tmpdir.join("PUSH")
+    j = Journal(path.strpath)
+    j.start([{'action' : 'create', 'post' : post(-1), 'diff' : {}},
+             {'action' : 'delete', 'post' : post(2)}])
+    j.sent(0)
+    j.sent(1)
+    j.done(1, {'id' : 2})
+    ## a crash while writing a line
+    path.write('{"done" : 0, "sta', mode='ab')
+
+    changes, sent, statuses = Journal(path.strpath).load()
+    assert changes == [{'action' : 'create', 'post' : post(-1)},
+                       {'action' : 'delete', 'post' : post(2)}]
+    assert sent == set([0, 1])
+    assert statuses == {1 : {'id' : 2}}
+    j.remove()
+    assert not path.check()
+
+def test_post_quota(tmpdir):
+    path = tmpdir.join("POSTED").strpath
+    quota = PostQuota(path, limit=2)
+    assert quota.take() and quota.take()
+    assert not quota.take()
+    assert quota.resets() > quota.posted[0]
+
+    ## remembered across pushes
+    assert not PostQuota(path, limit=2).take()
+    quota.give_back()
+    assert PostQuota(path, limit=2).take()
+
+def test_post_quota_shared(tmpdir):
+    path = tmpdir.join("POSTED").strpath
+    ## a daemon and a push from the command line
+    daemon, command = PostQuota(path, limit=3), PostQuota(path, limit=3)
+    assert daemon.take()
+    assert command.take() and command.take()
+    assert not daemon.take()
+    command.give_back()
+    assert daemon.take()
+    assert len(PostQuota(path).posted) == 3
+
+def test_push_hand_written_date(api, tmpdir):
+    tmpdir.join("posts", "dated.markdown").write(dedent("""\
+        ---
+        title: dated
+        date: 2015-01-01 10:00:00
+        slug: dated
+        tags: []
+        format: markdown
+        state: draft
+        id: -1
+        ---
+
+        hello
+        """))
+    assert dumblr(api).push() == [{'post' : 'dated', 'status' : True}]
+    assert creates(api) == 1
+
+def test_push_resumes(api, tmpdir, monkeypatch):
+    d = dumblr(api)
+    d.new("new one", "markdown")
+    d.new("new two", "markdown")
+
+    ## pushed, but cut short before the files got their ids
+    def crash(changes, statuses):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(d, 'reconcile', crash)
+    with pytest.raises(KeyboardInterrupt):
+        d.push()
+    assert creates(api) == 2
+    assert tmpdir.join(".dumblr", "PUSH").check()
+
+    resps = dumblr(api).push()
+    assert sorted(r['post'] for r in resps) == ['new-one', 'new-two']
+    assert all(r['status'] == True for r in resps)
+    ## nothing was created twice
+    assert creates(api) == 2
+    assert len(api.drafts()) == 2
+    assert not tmpdir.join(".dumblr", "PUSH").check()
+    assert dumblr(api).status() == []
+
+def test_push_resumes_unanswered(api, tmpdir):
+    d = dumblr(api)
+    d.new("lost", "markdown")
+    change, = d.status()
+    ## tumblr created the post, the answer never came
+    j = Journal(d.JOURNAL_FILE)
+    j.start([change])
+    j.sent(0)
+    api.add(change['post'])
+
+    assert dumblr(api).push() == [{'post' : 'lost', 'status' : True}]
+    assert creates(api) == 0
+    assert len(api.drafts()) == 1
+    assert dumblr(api).status() == []
+
+@pytest.mark.parametrize('status', [503, None])
+def test_push_resumes_failed_answer(api, tmpdir, status):
+    d = dumblr(api)
+    d.new("lost", "markdown")
+    change, = d.status()
+    ## tumblr created the post, then answered with a failure
+    j = Journal(d.JOURNAL_FILE)
+    j.start([change])
+    j.sent(0)
+    j.done(0, {'meta' : {'status' : status, 'msg' : "timed out"}})
+    api.add(change['post'])
+
+    assert dumblr(api).push() == [{'post' : 'lost', 'status' : True}]
+    assert creates(api) == 0
+    assert len(api.drafts()) == 1
+
+def test_push_settles_failed_answer(api, tmpdir):
+    d = dumblr(api)
+    d.new("lost", "markdown")
+    api.lost = [503]
+    assert d.push() == [{'post' : 'lost', 'status' : True}]
+    ## not sent again, and the file got the id tumblr gave it
+    assert creates(api) == 1
+    assert len(api.drafts()) == 1
+    assert dumblr(api).status() == []
+    assert dumblr(api).push() == []
+
+def test_push_defers_past_daily_limit(api, tmpdir, monkeypatch):
+    monkeypatch.setattr(journal, 'DAILY_POST_LIMIT', 1)
+    d = dumblr(api)
+    for title in ["one", "two", "three"]:
+        d.new(title, "markdown")
+    resps = d.push()
+    assert [r['status'] for r in resps].count(True) == 1
+    deferred = [r['status'] for r in resps if r['status'] is not True]
+    assert len(deferred) == 2
+    assert all(status['deferred'] for status in deferred)
+    assert creates(api) == 1
+
+    ## the next window takes the rest
+    post_quota(d.POSTED_FILE).limit = 10
+    resps = dumblr(api).push()
+    assert [r['status'] for r in resps] == [True, True]
+    assert creates(api) == 3
@@ -0,0 +1,68 @@
+import pytest
+from conftest import post, pull
+from dumblr.core import Dumblr
+from dumblr.exceptions import DumblrException
+from dumblr.scope import Scope
+
+def tagged(i):
+    return post(i, tags=["even" if i % 2 == 0 else "odd"])
+
+@pytest.fixture
+def root(root, settled):
+    d = pull([tagged(i) for i in range(10)])
+    assert d.status() == []
+    return root
+
+def edit(root, i):
+    path = root.join("posts", "post-{}.markdown".format(i))
+    path.write(path.read().replace("hello", "bye"))
+
+def changes(status):
+    return sorted((c['action'], c['post']['id']) for c in status)
+
+def test_scope_from_paths(root):
+    posts = root.join("posts").strpath
+    assert Scope.from_paths(posts, ["posts/post-1.markdown"]).patterns == [
+        "post-1.markdown"]
+    assert Scope.from_paths(posts, ["posts/*.md", "posts"]).patterns == [
+        "*.md", "*"]
+    assert Scope.from_paths(posts, ["post-2.markdown"]).patterns == [
+        "post-2.markdown"]
+    with pytest.raises(DumblrException):
+        Scope.from_paths(posts, ["elsewhere/post-1.markdown"])
+    assert not Scope()
+
+def test_status_by_path(root, reads):
+    edit(root, 1)
+    edit(root, 2)
+    d = Dumblr()
+    scope = Scope.from_paths(d.posts_path, ["posts/post-1.markdown"])
+    assert changes(d.status(scope)) == [('update', 1)]
+    assert reads == ["post-1.markdown"]
+
+    scope = Scope.from_paths(d.posts_path, ["posts/post-[12].*"])
+    assert changes(d.status(scope)) == [('update', 1), ('update', 2)]
+
+def test_status_by_id_and_tag(root, reads):
+    edit(root, 1)
+    edit(root, 2)
+    edit(root, 3)
+    d = Dumblr()
+    assert changes(d.status(Scope(ids=[2, 5]))) == [('update', 2)]
+    ## only the changed files are read again
+    assert sorted(reads) == ["post-1.markdown", "post-2.markdown",
+                             "post-3.markdown"]
+    assert changes(d.status(Scope(tags=["odd"]))) == [
+        ('update', 1), ('update', 3)]
+    assert changes(d.status(Scope(tags=["odd"], ids=[1]))) == [('update', 1)]
+
+def test_status_scoped_deletes(root):
+    d = Dumblr()
+    root.join("posts", "post-4.markdown").remove()
+    ## renamed, not deleted
+    root.join("posts", "post-6.markdown").rename(
+        root.join("posts", "renamed.markdown"))
+    scope = Scope.from_paths(d.posts_path, ["posts/post-[46].markdown"])
+    assert changes(d.status(scope)) == [('delete', 4)]
+    assert changes(d.status(Scope(ids=[4]))) == [('delete', 4)]
+    assert changes(d.status(Scope(ids=[6]))) == []
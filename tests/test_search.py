@@ -0,0 +1,93 @@
+import pytest
+from click.testing import CliRunner
+from conftest import post, pull
+from dumblr.cli import cli
+from dumblr.core import Dumblr
+from dumblr.search import SearchIndex, query_terms, words
+
+def numbered(i, **kwargs):
+    """A post with words, a date, tags and a state of its own
+    """
+    fields = {'body' : "hello world number{}\n".format(i),
+              'date' : "2015-02-{:02d} 02:14:57 GMT".format(i + 1),
+              'tags' : ["even" if i % 2 == 0 else "odd"],
+              'state' : "draft" if i == 3 else "published"}
+    fields.update(kwargs)
+    return post(i, **fields)
+
+@pytest.fixture
+def root(root, settled):
+    pull([numbered(i) for i in range(10)])
+    return root
+
+def ids(posts):
+    return [p['id'] for p in posts]
+
+def test_words():
+    assert words(u"Hello, hello World! a I/O") == set([u"hello", u"world"])
+    assert query_terms([u"Hello", u"wor*", u"a"]) == ([u"hello"], [u"wor"])
+    assert query_terms([u"foo-ba*"]) == ([u"foo"], [u"ba"])
+
+def test_search(root):
+    d = Dumblr()
+    ## newest first
+    assert ids(d.search()) == range(9, -1, -1)
+    assert ids(d.search(tags=["ODD"])) == [9, 7, 5, 3, 1]
+    assert ids(d.search(tags=["odd"], state="published")) == [9, 7, 5, 1]
+    assert ids(d.search([u"number4"])) == [4]
+    assert ids(d.search([u"hello", u"number4"])) == [4]
+    assert ids(d.search([u"number*"])) == range(9, -1, -1)
+    assert ids(d.search([u"nothing"])) == []
+    assert ids(d.search(since="2015-02-03", until="2015-02-05")) == [4, 3, 2]
+    assert ids(d.search(since="2015-02-09")) == [9, 8]
+    found = d.search([u"number2"])[0]
+    assert found['name'] == "post-2.markdown"
+    assert found['tags'] == ["even"]
+
+def test_search_reads_changed_files_only(root, reads):
+    d = Dumblr()
+    d.search()
+    assert len(reads) == 10
+    del reads[:]
+    assert ids(d.search([u"hello"])) == range(9, -1, -1)
+    assert reads == []
+
+    path = root.join("posts", "post-1.markdown")
+    path.write(path.read().replace("hello", "bye"))
+    root.join("posts", "post-2.markdown").remove()
+    assert ids(d.search([u"hello"])) == [9, 8, 7, 6, 5, 4, 3, 0]
+    assert ids(d.search([u"bye"])) == [1]
+    assert reads == ["post-1.markdown"]
+
+def test_load_updates_search_index(root, reads):
+    d = Dumblr()
+    d.search()
+    del reads[:]
+    d.save_snapshot([numbered(i) for i in range(10)] +
+                    [numbered(10, body="brand new\n")])
+    d.load()
+    ## the new file only, not a scan of every file
+    assert reads == ["post-10.markdown"]
+    assert ids(d.search([u"brand"], refresh=False)) == [10]
+
+def test_index_skips_other_files(tmpdir):
+    posts = tmpdir.mkdir("posts")
+    posts.join("notes.txt").write("not a post: [\n")
+    search = SearchIndex(tmpdir.join("SEARCH").strpath)
+    assert search.refresh(posts.strpath)
+    assert search.query() == []
+    search.close()
+
+def test_cli_search(root):
+    runner = CliRunner()
+    result = runner.invoke(cli, ['search', 'number*', 'tag:odd',
+                                 'state:published', 'since:2015-02-05'])
+    assert result.exit_code == 0
+    assert "post-9.markdown" in result.output
+    assert "post-5.markdown" in result.output
+    assert "post-3.markdown" not in result.output
+    assert "# Total : 3" in result.output
+
+    result = runner.invoke(cli, ['ls', '--tag', 'even', '--until', '2015-02-03'])
+    assert result.exit_code == 0
+    assert "# Total : 2" in result.output
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import pickle
+import pytest
+from conftest import post as plain_post, pull
+from dumblr import snapshot
+from dumblr.snapshot import Snapshot
+
+def post(i):
+    return plain_post(i, title=u"caf\xe9 {}".format(i),
+                      body=u"b\xf6dy {}\n".format(i), tags=[u"日本"])
+
+@pytest.fixture
+def decompressed(monkeypatch):
+    """Bodies decompressed so far
+    """
+    bodies = []
+    decompress = snapshot.zlib.decompress
+    def counting(data):
+        bodies.append(data)
+        return decompress(data)
+    monkeypatch.setattr(snapshot.zlib, 'decompress', counting)
+    return bodies
+
+def test_snapshot_roundtrip(tmpdir, decompressed):
+    path = tmpdir.join("TUMBLR").strpath
+    posts = [post(i) for i in range(5)]
+    del posts[3]['body']
+    snapshot.write(path, posts)
+
+    s = Snapshot(path)
+    assert len(s) == 5
+    header = post(1)
+    del header['body']
+    assert s.headers[1] == header
+    assert s.hashes[3] is None
+    assert s.hashes[2] == snapshot.body_hash(u"b\xf6dy 2\n")
+    assert decompressed == []
+
+    assert s.post(2) == post(2)
+    assert len(decompressed) == 1
+    assert list(s) == posts
+    assert not tmpdir.join(".TUMBLR.tmp").check()
+
+def test_snapshot_legacy(tmpdir):
+    path = tmpdir.join("TUMBLR")
+    posts = [post(i) for i in range(3)]
+    path.write(pickle.dumps(posts), mode='wb')
+    s = Snapshot(path.strpath)
+    assert list(s) == posts
+    assert s.hashes[0] == snapshot.body_hash(posts[0]['body'])
+
+def test_snapshot_broken(tmpdir):
+    path = tmpdir.join("TUMBLR")
+    with pytest.raises(IOError):
+        Snapshot(path.strpath)
+    path.write("")
+    with pytest.raises(EOFError):
+        Snapshot(path.strpath)
+    snapshot.write(path.strpath, [post(1)])
+    path.write(path.read('rb')[:-20], mode='wb')
+    with pytest.raises(EOFError):
+        Snapshot(path.strpath)
+
+def test_status_reads_changed_bodies(root, decompressed):
+    d = pull([post(i) for i in range(10)])
+    del decompressed[:]
+    assert d.status() == []
+    assert decompressed == []
+
+    path = root.join("posts", "post-4.markdown")
+    path.write(path.read('rb').replace("dy 4", "dy four"), mode='wb')
+    assert [(c['action'], c['diff'].keys()) for c in d.status()] == [
+        ('update', ['body'])]
+    assert len(decompressed) == 1
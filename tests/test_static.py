@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import pytest
+from conftest import post
+from dumblr import static
+from dumblr.core import Dumblr
+
+def page(i, **kwargs):
+    """A post with markup, a date and tags of its own
+    """
+    fields = {'title' : u"Post <{}>".format(i),
+              'body' : u"Hello *{}*\n".format(i),
+              'date' : u"2015-02-{:02d} 02:14:57 GMT".format(i + 1),
+              'tags' : [u"all", u"t{}".format(i % 2)]}
+    fields.update(kwargs)
+    return post(i, **fields)
+
+@pytest.fixture
+def root(root, monkeypatch):
+    monkeypatch.setattr(static, 'PAGE_SIZE', 2)
+    root.mkdir("posts")
+    d = Dumblr()
+    for i in range(5):
+        d.write_post(page(i))
+    d.write_post(page(9, state=u"draft"))
+    return root
+
+def test_build(root):
+    result = Dumblr().build()
+    assert sorted(result['rendered']) == sorted(
+        ["post/post-{}.html".format(i) for i in range(5)] +
+        ["index.html", "page/2.html", "page/3.html", "style.css",
+         "tags/all.html", "tags/t0.html", "tags/t1.html"])
+    site = root.join("site")
+    assert not site.join("post", "post-9.html").check()
+
+    html = site.join("post", "post-3.html").read()
+    assert "<h1>Post &lt;3&gt;</h1>" in html
+    assert '<a href="../tags/t1.html">t1</a>' in html
+    ## newest first
+    index = site.join("index.html").read()
+    assert index.index("post-4.html") < index.index("post-3.html")
+    assert "post-2.html" not in index
+    assert 'href="page/2.html">older' in index
+    assert site.join("tags", "t1.html").read().count("<li>") == 2
+
+def test_build_incremental(root):
+    Dumblr().build()
+    assert Dumblr().build()['rendered'] == []
+
+    ## a body edit only touches its post
+    path = root.join("posts", "post-1.markdown")
+    path.write(path.read().replace("Hello", "Bye"))
+    assert Dumblr().build()['rendered'] == ["post/post-1.html"]
+    assert "Bye" in root.join("site", "post", "post-1.html").read()
+
+    ## a new title shows on the pages listing it
+    path.write(path.read().replace("Post <1>", "Renamed"))
+    assert sorted(Dumblr().build()['rendered']) == [
+        "page/2.html", "post/post-1.html", "tags/all.html", "tags/t1.html"]
+
+    ## removed posts take their pages with them
+    root.join("posts", "post-0.markdown").remove()
+    result = Dumblr().build()
+    assert "post/post-0.html" in result['removed']
+    assert "tags/t0.html" in result['rendered']
+    assert not root.join("site", "post", "post-0.html").check()
+
+    assert len(Dumblr().build(force=True)['rendered']) == 10
+
+def test_build_odd_headers(root):
+    posts = root.join("posts")
+    ## written by hand, yaml reads the date as a datetime
+    posts.join("dated.markdown").write(
+        "---\ntitle: Dated\ndate: 2015-03-01 10:00:00\nslug: dated\n"
+        "tags: []\n---\nHi\n")
+    posts.join("escape.markdown").write(
+        "---\ntitle: Escape\nslug: ../../x\n---\nHi\n")
+    posts.join("twin.markdown").write(
+        "---\ntitle: Twin\nslug: post-1\n---\nHi\n")
+    result = Dumblr().build()
+    ## pages stay in the site, and none is lost to another
+    assert "post/dated.html" in result['rendered']
+    assert "post/x.html" in result['rendered']
+    assert "post/post-1-2.html" in result['rendered']
+    assert not root.join("x.html").check()
+    site = root.join("site")
+    assert "2015-03-01 10:00:00 GMT" in site.join("post", "dated.html").read()
+    assert site.join("index.html").read().index("dated.html") < \
+        site.join("index.html").read().index("post-4.html")
+
+def test_build_parallel(root, monkeypatch):
+    monkeypatch.setattr(static, 'PARALLEL_THRESHOLD', 1)
+    d = Dumblr()
+    d.jobs = 2
+    d.build()
+    serial = root.join("site", "post", "post-2.html").read()
+    root.join("site").remove()
+    monkeypatch.setattr(static, 'PARALLEL_THRESHOLD', 100)
+    Dumblr().build()
+    assert root.join("site", "post", "post-2.html").read() == serial
+
+def test_markdown_fallback(monkeypatch):
+    monkeypatch.setattr(static, '_md', None)
+    assert static.markdown(u"a <b>\n\n\nc\n") == u"<p>a &lt;b&gt;</p>\n<p>c</p>"
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import pytest
+from conftest import post as plain_post
+from dumblr import store
+from dumblr.store import History, ObjectStore
+
+def post(i, body="hello world"):
+    return plain_post(i, body=body, tags=[u"täg"])
+
+def test_store_dedup(tmpdir):
+    s = ObjectStore(tmpdir.strpath)
+    h1 = s.put(post(1))
+    assert s.put(post(1)) == h1
+    h2 = s.put(post(1, "changed"))
+    assert h1 != h2
+    assert len(s.loose()) == 2
+    assert s.get(h1) == post(1)
+
+def test_store_pack(tmpdir):
+    s = ObjectStore(tmpdir.strpath)
+    hashes = [s.put(post(i)) for i in range(10)]
+    assert s.pack() == 10
+    assert s.loose() == []
+    assert tmpdir.join("objects").listdir() == []
+
+    s = ObjectStore(tmpdir.strpath)
+    assert all(s.get(h) == post(i) for i, h in enumerate(hashes))
+    ## packed objects are not stored again
+    s.put(post(3))
+    assert s.loose() == []
+    with pytest.raises(KeyError):
+        s.get("0" * 40)
+
+def test_history(tmpdir, monkeypatch):
+    monkeypatch.setattr(store, 'PACK_THRESHOLD', 3)
+    h = History(tmpdir.strpath)
+    assert h.record([post(1), post(2)], 'pull') == 1
+    assert h.record([post(1), post(2, "edited")], 'pull') == 2
+    ## post 1 is gone, then comes back
+    assert h.record([post(2, "edited")], 'push') == 3
+    assert h.record([post(1), post(2, "edited")], 'pull') == 4
+
+    ## three unique revisions got packed
+    assert h.store.loose() == []
+    assert h.manifests() == [1, 2, 3, 4]
+    assert h.checkout(2) == [post(1), post(2, "edited")]
+
+    assert [r['manifest'] for r in h.log(2)] == [1, 2]
+    log = h.log(1)
+    assert [(r['manifest'], r['source']) for r in log] == [
+        (1, 'pull'), (3, 'push'), (4, 'pull')]
+    assert log[1]['hash'] is None
+    assert log[0]['hash'] == log[2]['hash']
+    assert h.log(42) == []
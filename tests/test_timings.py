@@ -0,0 +1,71 @@
+import json
+from dumblr.timings import Timings, summarize
+
+def test_timings_disabled():
+    t = Timings()
+    with t.span('phase'):
+        t.count('files.read')
+    assert t.root.children == []
+    assert t.root.counts == {}
+
+def test_timings_tree():
+    t = Timings()
+    t.enable()
+    with t.span('push'):
+        t.count('api.requests', 2)
+        for _ in range(3):
+            with t.span('fetch'):
+                t.count('api.requests')
+    t.count('files.written')
+    t.finish()
+
+    push = t.root.children[0]
+    assert push.name == 'push'
+    assert push.counts == {'api.requests' : 2}
+    ## same named spans are merged
+    assert len(push.children) == 1
+    assert push.children[0].calls == 3
+    assert push.children[0].counts == {'api.requests' : 3}
+    assert t.root.counts == {'files.written' : 1}
+    assert t.root.elapsed >= push.elapsed >= push.children[0].elapsed
+
+    lines = t.report()
+    assert lines[0].startswith("dumblr")
+    assert lines[-2].strip().startswith("fetch")
+    assert lines[-2].endswith("x3")
+    assert json.loads(t.to_json())['children'][0]['name'] == 'push'
+
+    ## enable starts over
+    t.enable()
+    assert t.root.children == []
+
+def test_timings_summarize():
+    assert summarize({'index.hit' : 3, 'index.miss' : 1, 'files.read' : 1}) == [
+        "- files.read : 1", "- index.hit : 3", "- index.miss : 1",
+        "- index.hit rate : 75.0%"]
+    assert summarize({'index.hit' : 0}) == ["- index.hit : 0"]
+
+def test_timings_threads():
+    from multiprocessing.pool import ThreadPool
+    t = Timings()
+    t.enable()
+
+    def blog(name):
+        with t.span(name):
+            t.count('posts', 2)
+            with t.span('fetch'):
+                pass
+        ## workers without spans count into the main thread's
+        t.count('api.requests')
+
+    pool = ThreadPool(3)
+    with t.span('pull'):
+        pool.map(blog, ['a', 'b', 'c'])
+    pool.close()
+    t.finish()
+
+    pull = t.root.children[0]
+    assert sorted(c.name for c in pull.children) == ['a', 'b', 'c']
+    assert all(c.counts == {'posts' : 2} and c.children[0].name == 'fetch'
+               for c in pull.children)
+    assert pull.counts == {'api.requests' : 3}
@@ -0,0 +1,70 @@
+import httpretty
+import json
+import pytest
+import time
+from dumblr.transport import RateLimiter, SessionRequest, Stats
+from dumblr.tumblr import Tumblr
+
+HOST = "http://localhost"
+
+def respond(status, response):
+    return json.dumps({'meta' : {'status' : status, 'msg' : 'OK'},
+                       'response' : response})
+
+@pytest.fixture
+def api(request):
+    httpretty.reset()
+    httpretty.enable()
+    request.addfinalizer(httpretty.disable)
+    httpretty.register_uri(httpretty.GET, HOST + "/v2/user/info",
+                           body=respond(200, {'user' : {'name' : 'foo'}}))
+    httpretty.register_uri(httpretty.POST,
+                           HOST + "/v2/blog/foo.tumblr.com/post/edit",
+                           body=respond(200, {'id' : 1}))
+    httpretty.register_uri(httpretty.POST,
+                           HOST + "/v2/blog/foo.tumblr.com/post/delete",
+                           body=respond(404, []))
+
+def test_session_request_get(api):
+    r = SessionRequest('ckey', 'skey', 'oauth', 'oauth_s', HOST)
+    assert r.get("/v2/user/info", {}) == {'user' : {'name' : 'foo'}}
+    ## calls are signed
+    assert 'oauth_signature' in httpretty.last_request().headers['Authorization']
+
+def test_session_request_failure(api):
+    r = SessionRequest('ckey', 'skey', 'oauth', 'oauth_s', HOST)
+    resp = r.post("/v2/blog/foo.tumblr.com/post/delete", {'id' : 1})
+    assert resp['meta']['status'] == 404
+
+def test_tumblr_name_cached(api):
+    t = Tumblr('ckey', 'skey', 'oauth', 'oauth_s', host=HOST)
+    post = {'title' : 'foo', 'body' : 'bar', 'tags' : [], 'id' : 1}
+    t.push_post('update', dict(post))
+    t.push_post('update', dict(post))
+    endpoints = t.stats.endpoints
+    assert endpoints["GET /v2/user/info"]['requests'] == 1
+    assert endpoints["POST /v2/blog/{blog}/post/edit"]['requests'] == 2
+
+    ## known blog names never hit info
+    t = Tumblr('ckey', 'skey', 'oauth', 'oauth_s', name='foo', host=HOST)
+    t.push_post('update', dict(post))
+    assert "GET /v2/user/info" not in t.stats.endpoints
+
+def test_stats():
+    s = Stats()
+    s.add("GET", "/v2/blog/foo.tumblr.com/posts/text", 0, 100, 0.5)
+    s.add("GET", "/v2/blog/bar.tumblr.com/posts/text", 0, 50, 0.25)
+    s.add("POST", "/v2/blog/foo.tumblr.com/post", 20, 10, 0.25)
+    assert s.endpoints["GET /v2/blog/{blog}/posts/text"] == {
+        'requests' : 2, 'sent' : 0, 'received' : 150, 'latency' : 0.75}
+    assert s.totals() == {'requests' : 3, 'sent' : 20,
+                          'received' : 160, 'latency' : 1.0}
+    assert s.report()[0].startswith("GET /v2/blog/{blog}/posts/text\t2")
+
+def test_rate_limiter():
+    limiter = RateLimiter(50, burst=2)
+    start = time.time()
+    for _ in range(7):
+        limiter.wait()
+    ## 2 at once, then 5 more at 50 a second
+    assert 0.08 <= time.time() - start < 0.5
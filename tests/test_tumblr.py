@@ -1,6 +1,9 @@
+import errno
 import json
 import pytest
-from dumblr.tumblr import Tumblr
+import requests
+import socket
+from dumblr.tumblr import Tumblr, _not_sent
 
 @pytest.fixture
 def tokens():
@@ -32,3 +35,153 @@ def test_tumblr_posts(tumblr):
 def test_tumblr_create_post(tumblr):
     ## TODO: How can i test this?
     pass
+
+class FakeClient(object):
+    """Stands in for pytumblr.TumblrRestClient"""
+    def __init__(self, published, drafts):
+        self.published = published
+        self.draft_posts = drafts
+        self.calls = []
+        self.failures = []
+
+    def posts(self, name, type=None, **kwargs):
+        self.calls.append(('posts', kwargs.get('offset')))
+        offset = kwargs.get('offset', 0)
+        limit = kwargs.get('limit', 20)
+        return {'posts' : self.published[offset:offset+limit],
+                'total_posts' : len(self.published)}
+
+    def send_api_request(self, method, url, params={}, valid_parameters=[],
+                         needs_api_key=False):
+        self.calls.append(('drafts', params.get('before_id')))
+        posts = self.draft_posts
+        if 'before_id' in params:
+            posts = [p for p in posts if p['id'] < params['before_id']]
+        return {'posts' : posts[:20]}
+
+    def info(self):
+        return {'user' : {'name' : 'devty1023'}}
+
+    def create_text(self, name, **kwargs):
+        return self._write('create', kwargs)
+
+    def edit_post(self, name, **kwargs):
+        return self._write('update', kwargs)
+
+    def delete_post(self, name, id):
+        return self._write('delete', {'id' : id})
+
+    def _write(self, action, params):
+        self.calls.append((action, params.get('slug', params.get('id'))))
+        if self.failures:
+            failure = self.failures.pop(0)
+            if isinstance(failure, Exception):
+                raise failure
+            return {'meta' : {'status' : failure,
+                              'msg' : 'Service Unavailable'}}
+        return {'id' : params.get('id', 42)}
+
+def fake_post(i, _type='text'):
+    return {'body' : "body {}".format(i),
+            'date' : "2015-02-19 02:14:57 GMT",
+            'format' : "markdown",
+            'slug' : "post-{}".format(i),
+            'title' : "post {}".format(i),
+            'tags' : [],
+            'type' : _type,
+            'id' : i}
+
+def local_post(i):
+    post = dict(fake_post(i), state='published')
+    post.pop('type')
+    return post
+
+@pytest.fixture
+def offline():
+    t = Tumblr('ckey', 'skey', 'oauth', 'oauth_s')
+    published = [fake_post(i) for i in range(1000, 945, -1)]
+    drafts = [fake_post(i) for i in range(100, 55, -1)]
+    drafts[3]['type'] = 'photo'
+    t.tumblr = FakeClient(published, drafts)
+    return t
+
+def test_tumblr_posts_paginated(offline):
+    posts = offline.get_text_posts('devty1023', workers=2)
+    published = [p for p in posts if p['state'] == 'published']
+    drafts = [p for p in posts if p['state'] == 'draft']
+    assert [p['id'] for p in published] == range(1000, 945, -1)
+    assert len(drafts) == 44
+    assert sorted(c[1] for c in offline.tumblr.calls
+                  if c[0] == 'posts') == [0, 20, 40]
+    assert [c[1] for c in offline.tumblr.calls
+            if c[0] == 'drafts'] == [None, 81, 61, 56]
+
+def test_tumblr_posts_since(offline):
+    for i, post in enumerate(offline.tumblr.published):
+        post['date'] = "2015-02-19 02:{:02d}:00 GMT".format(59 - i)
+    since = offline.tumblr.published[24]['date']
+    posts = offline.get_text_posts('devty1023', since=since)
+    published = [p for p in posts if p['state'] == 'published']
+    assert [p['id'] for p in published] == range(1000, 975, -1)
+    ## the second page holds the cursor, the third is never requested
+    assert [c[1] for c in offline.tumblr.calls
+            if c[0] == 'posts'] == [0, 20]
+
+def test_tumblr_push_posts(offline):
+    changes = [{'action' : 'create', 'post' : dict(local_post(-1), id=-1)},
+               {'action' : 'update', 'post' : local_post(7)},
+               {'action' : 'delete', 'post' : local_post(8)}]
+    resps = offline.push_posts(changes, workers=3, backoff=0)
+    assert resps == [{'id' : 42}, {'id' : 7}, {'id' : 8}]
+    ## posts are not mutated by the push
+    assert changes[0]['post']['id'] == -1
+
+def test_tumblr_push_posts_retry(offline):
+    offline.tumblr.failures = [503, 429]
+    changes = [{'action' : 'update', 'post' : local_post(7)}]
+    assert offline.push_posts(changes, backoff=0) == [{'id' : 7}]
+    assert len([c for c in offline.tumblr.calls if c[0] == 'update']) == 3
+
+def test_tumblr_push_posts_gives_up(offline):
+    offline.tumblr.failures = [503, 400]
+    changes = [{'action' : 'update', 'post' : local_post(7)}]
+    resps = offline.push_posts(changes, backoff=0)
+    ## 400 is not worth retrying
+    assert resps[0]['meta']['status'] == 400
+
+    offline.tumblr.failures = [503] * 5
+    resps = offline.push_posts(changes, retries=2, backoff=0)
+    assert resps[0]['meta']['status'] == 503
+    assert len(offline.tumblr.failures) == 2
+
+def test_tumblr_push_posts_creates_once(offline):
+    changes = [{'action' : 'create', 'post' : dict(local_post(-1), id=-1)}]
+    creates = lambda : [c for c in offline.tumblr.calls if c[0] == 'create']
+    ## tumblr may have created it, sending it again would make two
+    for failure, status in [(503, 503), (socket.timeout("timed out"), None)]:
+        offline.tumblr.failures = [failure]
+        del offline.tumblr.calls[:]
+        resps = offline.push_posts(changes, backoff=0)
+        assert resps[0]['meta']['status'] == status
+        assert Tumblr.unanswered(resps[0])
+        assert len(creates()) == 1
+
+    ## surely not created
+    offline.tumblr.failures = [
+        429, socket.error(errno.ECONNREFUSED, "Connection refused")]
+    del offline.tumblr.calls[:]
+    assert offline.push_posts(changes, backoff=0) == [{'id' : 42}]
+    assert len(creates()) == 3
+
+    ## updates are retried as before
+    offline.tumblr.failures = [socket.timeout("timed out"), 503]
+    changes = [{'action' : 'update', 'post' : local_post(7)}]
+    assert offline.push_posts(changes, backoff=0) == [{'id' : 7}]
+
+def test_tumblr_not_sent():
+    ## nothing listens on port 1
+    with pytest.raises(requests.ConnectionError) as e:
+        requests.get("http://127.0.0.1:1")
+    assert _not_sent(e.value)
+    assert not _not_sent(requests.ConnectionError("Connection aborted."))
+    assert not _not_sent(socket.timeout("timed out"))
@@ -1,5 +1,5 @@
 import pytest
-from dumblr.utils import get_dumblr_root, assert_dumblr_root
+from dumblr.utils import get_dumblr_root, assert_dumblr_root, BatchWriter
 
 def test_get_dumblr_root_no(tmpdir):
     assert get_dumblr_root(tmpdir.strpath) == ""
@@ -7,3 +7,34 @@ def test_get_dumblr_root_no(tmpdir):
 def test_get_dumblr_root_yes(tmpdir):
     tmpdir.mkdir(".dumblr")
     assert get_dumblr_root(tmpdir.strpath) == tmpdir.strpath
+
+def test_get_dumblr_root_nested(tmpdir):
+    nested = tmpdir.mkdir("a").mkdir("b")
+    assert get_dumblr_root(nested.strpath) == ""
+    tmpdir.mkdir(".dumblr")
+    ## not found is not remembered
+    assert get_dumblr_root(nested.strpath) == tmpdir.strpath
+    tmpdir.join(".dumblr").remove()
+    ## found is
+    assert get_dumblr_root(nested.strpath) == tmpdir.strpath
+
+def test_assert_dumblr_root(tmpdir):
+    class Fake(object):
+        initialized = False
+    command = assert_dumblr_root(lambda dumblr, x : x)
+    with pytest.raises(SystemExit):
+        command(Fake(), 1)
+    Fake.initialized = True
+    assert command(Fake(), 1) == 1
+
+def test_batch_writer(tmpdir):
+    w = BatchWriter(batch=2)
+    w.write(tmpdir.join("a").strpath, "a")
+    assert tmpdir.listdir() == [tmpdir.join(".a.tmp")]
+    w.write(tmpdir.join("b").strpath, "b")
+    ## full batch is flushed
+    assert sorted(f.basename for f in tmpdir.listdir()) == ["a", "b"]
+    w.write(tmpdir.join("a").strpath, "c")
+    w.flush()
+    assert tmpdir.join("a").read() == "c"
+    assert sorted(f.basename for f in tmpdir.listdir()) == ["a", "b"]